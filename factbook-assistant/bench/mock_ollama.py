@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Stand-in for the Ollama HTTP API, for benchmarks (no GPU, no network).
+
+  python bench/mock_ollama.py --port 11435 --embed-ms 5 --token-ms 2
+
+Endpoints:
+  POST /api/embed       {"model", "input": str | [str]} -> {"embeddings"}
+  POST /api/embeddings  {"model", "prompt"}             -> {"embedding"}
+  POST /api/generate    {"model", "prompt", "stream"}   -> NDJSON tokens or
+                                                           one JSON object
+  GET  /api/version, /api/tags
+
+Vectors are deterministic: seeded by sha256(model + text), so the same text
+always embeds to the same vector across runs and machines. Latency is
+simulated per request plus per input (embeddings) or per token
+(generation), and the final generate object carries Ollama's timing fields
+(eval_count, eval_duration, ...) so callers that report them keep working.
+"""
+
+import json
+import time
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+import numpy as np
+
+DEFAULT_DIM = 768
+
+
+def mock_vector(model: str, text: str, dim: int = DEFAULT_DIM) -> List[float]:
+    seed = int.from_bytes(hashlib.sha256(f"{model}\x00{text}".encode("utf-8")).digest()[:8], "little")
+    v = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return (v / np.linalg.norm(v)).tolist()
+
+
+class MockConfig:
+    def __init__(
+        self,
+        dim: int = DEFAULT_DIM,
+        embed_ms: float = 0.0,
+        embed_item_ms: float = 0.0,
+        first_token_ms: float = 0.0,
+        token_ms: float = 0.0,
+        tokens: int = 40,
+    ):
+        self.dim = dim
+        self.embed_ms = embed_ms
+        self.embed_item_ms = embed_item_ms
+        self.first_token_ms = first_token_ms
+        self.token_ms = token_ms
+        self.tokens = tokens
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Like Ollama's Go server; without it keep-alive clients stall on
+    # delayed ACKs between the header and body writes
+    disable_nagle_algorithm = True
+
+    def log_message(self, fmt, *args):
+        pass
+
+    @property
+    def config(self) -> MockConfig:
+        return self.server.config
+
+    def _send_json(self, code: int, obj: dict) -> None:
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _chunk(self, obj: dict) -> None:
+        line = (json.dumps(obj) + "\n").encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/api/version":
+            self._send_json(200, {"version": "0.0.0-mock"})
+        elif self.path == "/api/tags":
+            self._send_json(200, {"models": []})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        n = int(self.headers.get("Content-Length", 0))
+        try:
+            req = json.loads(self.rfile.read(n) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": "invalid JSON"})
+            return
+        self.server.count(self.path)
+        model = str(req.get("model", ""))
+
+        if self.path == "/api/embed":
+            inputs = req.get("input", "")
+            inputs = [inputs] if isinstance(inputs, str) else list(inputs)
+            time.sleep((self.config.embed_ms + self.config.embed_item_ms * len(inputs)) / 1000)
+            self._send_json(200, {
+                "model": model,
+                "embeddings": [mock_vector(model, t, self.config.dim) for t in inputs],
+            })
+        elif self.path == "/api/embeddings":
+            text = str(req.get("prompt", req.get("input", "")))
+            time.sleep((self.config.embed_ms + self.config.embed_item_ms) / 1000)
+            self._send_json(200, {"embedding": mock_vector(model, text, self.config.dim)})
+        elif self.path == "/api/generate":
+            self._generate(model, req)
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def _generate(self, model: str, req: dict) -> None:
+        cfg = self.config
+        words = [f"tok{i}" for i in range(cfg.tokens)]
+        prompt_tokens = len(str(req.get("prompt", "")).split())
+        t0 = time.perf_counter()
+        final = {
+            "model": model,
+            "done": True,
+            "prompt_eval_count": prompt_tokens,
+            "eval_count": len(words),
+        }
+
+        if not req.get("stream", True):
+            time.sleep((cfg.first_token_ms + cfg.token_ms * len(words)) / 1000)
+            final["response"] = " ".join(words)
+            final["total_duration"] = int((time.perf_counter() - t0) * 1e9)
+            final["eval_duration"] = int(cfg.token_ms * len(words) * 1e6)
+            final["prompt_eval_duration"] = int(cfg.first_token_ms * 1e6)
+            self._send_json(200, final)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        time.sleep(cfg.first_token_ms / 1000)
+        for i, w in enumerate(words):
+            if i:
+                time.sleep(cfg.token_ms / 1000)
+            self._chunk({"model": model, "response": w + " ", "done": False})
+        final["response"] = ""
+        final["total_duration"] = int((time.perf_counter() - t0) * 1e9)
+        final["eval_duration"] = int(cfg.token_ms * len(words) * 1e6)
+        final["prompt_eval_duration"] = int(cfg.first_token_ms * 1e6)
+        self._chunk(final)
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+class MockOllama(ThreadingHTTPServer):
+    """
+    In-process mock server:
+
+    with MockOllama(MockConfig(dim=384)) as mock:
+        os.environ["OLLAMA_HOST"] = mock.url
+    """
+
+    daemon_threads = True
+
+    def __init__(self, config: Optional[MockConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _Handler)
+        self.config = config or MockConfig()
+        self.requests = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, path: str) -> None:
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    def start(self) -> "MockOllama":
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self) -> "MockOllama":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def add_mock_args(parser) -> None:
+    parser.add_argument("--dim", type=int, default=DEFAULT_DIM, help=f"Embedding size (default: {DEFAULT_DIM})")
+    parser.add_argument("--embed-ms", type=float, default=0.0, help="Latency per embed request")
+    parser.add_argument("--embed-item-ms", type=float, default=0.0, help="Extra latency per embedded text")
+    parser.add_argument("--first-token-ms", type=float, default=0.0, help="Latency before the first generated token")
+    parser.add_argument("--token-ms", type=float, default=0.0, help="Latency per generated token")
+    parser.add_argument("--tokens", type=int, default=40, help="Tokens per generated answer (default: 40)")
+
+
+def config_from_args(args) -> MockConfig:
+    return MockConfig(
+        dim=args.dim,
+        embed_ms=args.embed_ms,
+        embed_item_ms=args.embed_item_ms,
+        first_token_ms=args.first_token_ms,
+        token_ms=args.token_ms,
+        tokens=args.tokens,
+    )
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Mock Ollama API server for benchmarks.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=11435)
+    add_mock_args(ap)
+    args = ap.parse_args()
+
+    server = MockOllama(config_from_args(args), args.host, args.port)
+    print(f"[INFO] Mock Ollama on {server.url} (dim={args.dim}); set OLLAMA_HOST={server.url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
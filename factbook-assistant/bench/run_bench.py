@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+"""
+Reproducible performance suite for the factbook assistant.
+
+Runs entirely offline: an in-process mock Ollama (bench/mock_ollama.py)
+answers every embed/generate call with deterministic vectors and tokens,
+and all inputs are synthetic (bench/synth.py), so two runs of the same
+commit on the same machine measure the same work.
+
+  python bench/run_bench.py run                          # 1k/10k/100k chunks
+  python bench/run_bench.py run --sizes 1000 1000000     # 1M is opt-in
+  python bench/run_bench.py run --embed-ms 20 --token-ms 15   # model-like latency
+  python bench/run_bench.py compare bench/results/A.json bench/results/B.json
+
+Measured:
+  build     - chunking, end-to-end ingestion (chunk -> embed -> write)
+              throughput, BM25 and IVF build times
+  per size  - corpus load (mmap and resident), first query after load,
+              top_k latency p50/p90/p99 for flat, IVF, BM25, hybrid and
+              int8 + re-rank search, batched search throughput, and the
+              recall of IVF / int8 against exact search
+  shortcuts - field index build/load, shortcut lookup, the regex fallback
+              and raw regex search over factbook.txt
+  e2e       - query_factbook.answer_query (shortcut and semantic, blocking
+              and streamed) and citl_multi_rag.answer_question
+
+Results go to bench/results/<time>-<commit>.json (or --out) as flat
+"section.metric" keys plus the commit, interpreter and configuration;
+``compare`` prints the change per metric and exits with status 1 when
+one regressed by more than --threshold percent. Synthetic corpora are kept
+in --work-dir and reused while their parameters match.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import contextlib
+import subprocess
+from pathlib import Path
+from typing import Callable, Dict, List, Sequence
+
+import numpy as np
+
+BENCH_DIR = Path(__file__).resolve().parent
+ROOT = BENCH_DIR.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(BENCH_DIR))
+
+from mock_ollama import MockOllama, add_mock_args, config_from_args  # noqa: E402
+import synth  # noqa: E402
+
+RESULTS_DIR = BENCH_DIR / "results"
+WORK_DIR = BENCH_DIR / "work"
+RESULT_FORMAT = 1
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+
+# Metric name endings where a larger number is better; everything else
+# (latencies, build times) is better when smaller
+HIGHER_IS_BETTER = ("_per_s", "_qps", "recall")
+
+Metrics = Dict[str, float]
+
+
+def size_label(n: int) -> str:
+    if n % 1_000_000 == 0:
+        return f"{n // 1_000_000}M"
+    if n % 1_000 == 0:
+        return f"{n // 1_000}k"
+    return str(n)
+
+
+def timed(fn: Callable, *args, **kwargs):
+    t0 = time.perf_counter()
+    out = fn(*args, **kwargs)
+    return out, time.perf_counter() - t0
+
+
+def latency(fn: Callable[[int], object], n: int, warmup: int = 3) -> List[float]:
+    """
+    Seconds per call of fn(i) for i in range(n), after a short warmup.
+    """
+    for i in range(min(warmup, n)):
+        fn(i)
+    times = []
+    for i in range(n):
+        t0 = time.perf_counter()
+        fn(i)
+        times.append(time.perf_counter() - t0)
+    return times
+
+
+def add_latency(metrics: Metrics, prefix: str, times: Sequence[float]) -> None:
+    ms = np.asarray(times) * 1000
+    metrics[f"{prefix}.p50_ms"] = float(np.percentile(ms, 50))
+    metrics[f"{prefix}.p90_ms"] = float(np.percentile(ms, 90))
+    metrics[f"{prefix}.p99_ms"] = float(np.percentile(ms, 99))
+
+
+@contextlib.contextmanager
+def quiet():
+    """
+    Swallow the indexers' progress prints so the report stays readable.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def git_commit() -> Dict[str, object]:
+    try:
+        sha = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no", "--", "."],
+            cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": "unknown", "dirty": None}
+    return {"commit": sha, "dirty": bool(dirty)}
+
+
+# ---------------------------------------------------------------------
+# Sections
+# ---------------------------------------------------------------------
+
+def bench_build(work: Path, args) -> Metrics:
+    from citl_bm25 import build_for_corpus as build_bm25
+    from citl_chunker import chunk_file
+    from citl_embed import EmbedEngine
+    from citl_ingest import ingest_file
+    from citl_vector_index import build_for_corpus as build_ivf
+
+    m: Metrics = {}
+    src = work / "book.txt"
+    index_dir = work / "index"
+    synth.write_book(src, args.build_chunks)
+
+    n, secs = timed(lambda: sum(1 for _ in chunk_file(src)))
+    m["build.chunk_per_s"] = n / secs
+    engine = EmbedEngine()
+    with quiet():
+        n, secs = timed(ingest_file, src, index_dir, "build", engine, resume=False)
+        m["build.ingest_per_s"] = n / secs
+        m["build.ingest_s"] = secs
+        m["build.bm25_s"] = timed(build_bm25, index_dir, "build")[1]
+        m["build.ivf_s"] = timed(build_ivf, index_dir, "build", ann="ivf")[1]
+    print(f"[INFO] build: {n} chunks ingested at {m['build.ingest_per_s']:.0f} chunks/s")
+    return m
+
+
+def bench_size(work: Path, n: int, args) -> Metrics:
+    from citl_bm25 import build_for_corpus as build_bm25
+    from citl_corpus import open_corpus
+    from citl_vector_index import FlatIndex, ann_path, load_ivf, sample_queries
+    from citl_vector_index import build_for_corpus as build_ivf
+
+    label = size_label(n)
+    name = f"s{label}"
+    index_dir = work / "index"
+    p = f"{label}."
+    m: Metrics = {}
+
+    t0 = time.perf_counter()
+    wrote = synth.ensure_corpus(index_dir, name, n, args.dim, "float32", seed=args.seed)
+    wrote |= synth.ensure_corpus(index_dir, f"{name}_q8", n, args.dim, "int8", keep_full=True, seed=args.seed)
+    if wrote:
+        print(f"[INFO] {label}: wrote synthetic corpora in {time.perf_counter() - t0:.1f}s")
+    with quiet():
+        m[p + "bm25_build_s"] = timed(build_bm25, index_dir, name)[1]
+        m[p + "ivf_build_s"] = timed(build_ivf, index_dir, name, ann="ivf")[1]
+
+    # -- load -----------------------------------------------------------
+    corpus, secs = timed(open_corpus, index_dir, name, mmap=False)
+    m[p + "load.resident_ms"] = secs * 1000
+    corpus.close()
+    del corpus
+    corpus, secs = timed(open_corpus, index_dir, name)
+    m[p + "load.mmap_ms"] = secs * 1000
+
+    rng = np.random.default_rng(args.seed)
+    queries = sample_queries(corpus.emb, args.queries, seed=args.seed)
+    rows = rng.choice(len(corpus), size=len(queries), replace=False)
+    texts = [" ".join(corpus.chunks[int(r)]["text"].split()[:6]) for r in rows]
+
+    # The first query pays for opening the search backends and paging in
+    m[p + "load.first_query_ms"] = timed(corpus.search, queries[0], args.k, texts[0])[1] * 1000
+    q8 = open_corpus(index_dir, f"{name}_q8")
+    m[p + "load.int8_mb"] = q8.emb.nbytes / 2**20
+
+    # -- top_k ----------------------------------------------------------
+    flat = FlatIndex(corpus.emb)
+    ivf = load_ivf(ann_path(index_dir, name), corpus.emb, index_dir / f"{name}.emb.npy")
+    k, nq = args.k, len(queries)
+
+    truth = [set(flat.search(q, k)[0].tolist()) for q in queries]
+    add_latency(m, p + "flat", latency(lambda i: flat.search(queries[i], k), nq))
+    add_latency(m, p + "ivf", latency(lambda i: ivf.search(queries[i], k), nq))
+    add_latency(m, p + "bm25", latency(lambda i: corpus.lexical.search(texts[i], k), nq))
+    add_latency(m, p + "hybrid", latency(lambda i: corpus.search(queries[i], k, texts[i]), nq))
+    add_latency(m, p + "int8", latency(lambda i: q8.search(queries[i], k), nq))
+
+    def recall(search) -> float:
+        hits = sum(len(want & set(search(q)[0].tolist())) for q, want in zip(queries, truth))
+        return hits / max(1, nq * k)
+
+    m[p + "ivf.recall"] = recall(lambda q: ivf.search(q, k))
+    m[p + "int8.recall"] = recall(lambda q: q8.search(q, k))
+
+    _, secs = timed(corpus.search_batch, queries, k)
+    m[p + "batch_qps"] = nq / secs
+
+    q8.close()
+    corpus.close()
+    print(
+        f"[INFO] {label}: flat p50 {m[p + 'flat.p50_ms']:.2f} ms, ivf p50 {m[p + 'ivf.p50_ms']:.2f} ms "
+        f"(recall {m[p + 'ivf.recall']:.3f}), hybrid p50 {m[p + 'hybrid.p50_ms']:.2f} ms"
+    )
+    return m
+
+
+def bench_shortcuts(work: Path, args) -> Metrics:
+    import query_factbook as qf
+    from citl_factbook_fields import FIELD_LABELS, build_field_index
+
+    m: Metrics = {}
+    txt = work / "factbook.txt"
+    fields_path = work / "index" / "factbook.fields.json"
+    names = synth.write_factbook(txt, args.countries, seed=args.seed)
+    qf.TXT_PATH, qf.FIELDS_PATH = txt, fields_path
+    qf._field_index = None
+
+    m["shortcut.field_index_build_ms"] = timed(build_field_index, txt, fields_path)[1] * 1000
+    m["shortcut.field_index_load_ms"] = timed(qf.get_field_index)[1] * 1000
+
+    rng = np.random.default_rng(args.seed)
+    fields = sorted(FIELD_LABELS)
+    picks = [(fields[i % len(fields)], names[int(j)]) for i, j in enumerate(rng.integers(0, len(names), args.queries))]
+    queries = [f"{f}:{c}" for f, c in picks]
+    misses = sum(1 for q in queries if not qf.shortcut_lookup(q))
+    if misses:
+        print(f"[WARN] {misses}/{len(queries)} shortcut queries missed the field index")
+
+    add_latency(m, "shortcut.lookup", latency(lambda i: qf.shortcut_lookup(queries[i]), len(queries)))
+    # The regex paths scan the whole text; fewer rounds keep the suite quick
+    nr = min(len(queries), args.regex_queries)
+    add_latency(m, "shortcut.regex_fallback", latency(lambda i: qf.regex_search(qf.shortcut(queries[i])), nr))
+    raw = [rf"Internet country code:\s*\.{c[:2].lower()}" for _, c in picks]
+    add_latency(m, "regex.raw", latency(lambda i: qf.regex_search(raw[i]), nr))
+    print(
+        f"[INFO] shortcuts: lookup p50 {m['shortcut.lookup.p50_ms']:.3f} ms, "
+        f"regex fallback p50 {m['shortcut.regex_fallback.p50_ms']:.2f} ms"
+    )
+    return m
+
+
+def bench_e2e(work: Path, names: Sequence[str], args) -> Metrics:
+    import citl_multi_rag
+    import query_factbook as qf
+    from citl_corpus import open_corpus
+
+    m: Metrics = {}
+    index_dir = work / "index"
+    corpora = {name: open_corpus(index_dir, name) for name in names}
+    first = corpora[names[0]]
+    n = args.e2e_queries
+    countries = synth.country_names(args.countries)
+    shortcut_qs = [f"capital:{countries[i % len(countries)]}" for i in range(n)]
+    questions = [f"what does chapter {i} say about {synth.word(i)}?" for i in range(n)]
+
+    def ask(q: str, stream: bool = False) -> str:
+        on_token = (lambda tok: None) if stream else None
+        return qf.answer_query(q, 5, 4000, index_loader=lambda: first, on_token=on_token)
+
+    add_latency(m, "e2e.shortcut", latency(lambda i: ask(shortcut_qs[i]), n))
+    add_latency(m, "e2e.semantic", latency(lambda i: ask(questions[i]), n))
+    add_latency(m, "e2e.semantic_stream", latency(lambda i: ask(questions[i], stream=True), n))
+    add_latency(
+        m,
+        "e2e.multi",
+        latency(lambda i: citl_multi_rag.answer_question(questions[i], names, 5, 4000, loader=corpora.get), n),
+    )
+    for corpus in corpora.values():
+        corpus.close()
+    print(
+        f"[INFO] e2e: shortcut p50 {m['e2e.shortcut.p50_ms']:.1f} ms, "
+        f"semantic p50 {m['e2e.semantic.p50_ms']:.1f} ms, multi p50 {m['e2e.multi.p50_ms']:.1f} ms"
+    )
+    return m
+
+
+# ---------------------------------------------------------------------
+# run / compare
+# ---------------------------------------------------------------------
+
+def run(args) -> None:
+    work = Path(args.work_dir)
+    (work / "index").mkdir(parents=True, exist_ok=True)
+    mock = MockOllama(config_from_args(args)).start()
+    # Must be set before the first repo import: citl_ollama reads it once
+    os.environ["OLLAMA_HOST"] = mock.url
+
+    result = {
+        "format": RESULT_FORMAT,
+        "label": args.label,
+        **git_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "config": {
+            k: v for k, v in vars(args).items() if k not in ("cmd", "func", "out", "label", "work_dir")
+        },
+    }
+    metrics: Metrics = {}
+    t0 = time.perf_counter()
+    try:
+        if not args.skip_build:
+            metrics.update(bench_build(work, args))
+        for n in args.sizes:
+            metrics.update(bench_size(work, n, args))
+        metrics.update(bench_shortcuts(work, args))
+        if args.sizes:
+            names = [f"s{size_label(n)}" for n in sorted(args.sizes)[:2]]
+            metrics.update(bench_e2e(work, names, args))
+    finally:
+        mock.stop()
+    result["seconds"] = time.perf_counter() - t0
+    result["mock_requests"] = dict(mock.requests)
+    result["metrics"] = metrics
+
+    out = Path(args.out) if args.out else RESULTS_DIR / (
+        f"{time.strftime('%Y%m%d-%H%M%S')}-{result['commit']}{'-dirty' if result['dirty'] else ''}.json"
+    )
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(result, indent=2), encoding="utf-8")
+    print_metrics(metrics)
+    print(f"[INFO] {len(metrics)} metrics in {result['seconds']:.0f}s -> {out}")
+
+
+def print_metrics(metrics: Metrics) -> None:
+    width = max((len(k) for k in metrics), default=10)
+    for key, value in metrics.items():
+        print(f"{key:<{width}}  {value:>12.3f}")
+
+
+def compare(args) -> None:
+    old = json.loads(Path(args.old).read_text(encoding="utf-8"))
+    new = json.loads(Path(args.new).read_text(encoding="utf-8"))
+    print(f"old: {old.get('commit')} {old.get('label') or ''} ({old.get('created')})")
+    print(f"new: {new.get('commit')} {new.get('label') or ''} ({new.get('created')})")
+    if old.get("config") != new.get("config"):
+        print("[WARN] The runs used different settings; deltas may not be comparable")
+
+    keys = [k for k in new["metrics"] if k in old["metrics"]]
+    width = max((len(k) for k in keys), default=10)
+    print(f"{'metric':<{width}}  {'old':>12}{'new':>12}{'change':>10}")
+    regressions = []
+    for key in keys:
+        a, b = old["metrics"][key], new["metrics"][key]
+        change = (b - a) / a * 100 if a else 0.0
+        worse = -change if key.endswith(HIGHER_IS_BETTER) else change
+        # Sub-threshold absolute differences in tiny timings are noise
+        noise = key.endswith("_ms") and abs(b - a) < args.min_ms
+        flag = ""
+        if worse > args.threshold and not noise:
+            flag = "  REGRESSION"
+            regressions.append(key)
+        elif -worse > args.threshold and not noise:
+            flag = "  faster" if key.endswith(("_ms", "_s")) else "  better"
+        print(f"{key:<{width}}  {a:>12.3f}{b:>12.3f}{change:>+9.1f}%{flag}")
+
+    only = sorted(set(old["metrics"]) ^ set(new["metrics"]))
+    if only:
+        print(f"[INFO] {len(only)} metrics only in one run: {', '.join(only)}")
+    if regressions:
+        print(f"[WARN] {len(regressions)} regressions over {args.threshold:.0f}%")
+        sys.exit(1)
+    print(f"[INFO] No regressions over {args.threshold:.0f}%")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Offline performance suite (mock Ollama, synthetic corpora).")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    r = sub.add_parser("run", help="Run the suite and write a JSON result")
+    r.add_argument("--sizes", type=int, nargs="*", default=DEFAULT_SIZES, help="Corpus sizes in chunks")
+    r.add_argument("--queries", type=int, default=200, help="Timed queries per measurement")
+    r.add_argument("--regex-queries", type=int, default=30, help="Timed queries for the regex paths")
+    r.add_argument("--e2e-queries", type=int, default=30, help="Timed end-to-end questions per path")
+    r.add_argument("-k", type=int, default=5)
+    r.add_argument("--build-chunks", type=int, default=2000, help="Size of the ingestion benchmark")
+    r.add_argument("--skip-build", action="store_true", help="Skip the ingestion benchmark")
+    r.add_argument("--countries", type=int, default=250, help="Countries in the synthetic factbook.txt")
+    r.add_argument("--seed", type=int, default=0)
+    r.add_argument("--work-dir", default=str(WORK_DIR), help="Synthetic inputs (reused across runs)")
+    r.add_argument("--out", help=f"Result file (default: {RESULTS_DIR}/<time>-<commit>.json)")
+    r.add_argument("--label", default="", help="Free-text note stored with the result")
+    add_mock_args(r)
+    r.set_defaults(func=run)
+
+    c = sub.add_parser("compare", help="Compare two result files")
+    c.add_argument("old")
+    c.add_argument("new")
+    c.add_argument("--threshold", type=float, default=10.0, help="Regression threshold in percent")
+    c.add_argument("--min-ms", type=float, default=0.05, help="Ignore latency changes smaller than this")
+    c.set_defaults(func=compare)
+
+    args = ap.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
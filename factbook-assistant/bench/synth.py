@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Synthetic inputs for the benchmarks, all deterministic for a given seed.
+
+  write_factbook(path, 250)           - Factbook-format text, N countries
+  write_book(path, 2000)              - OpenStax-style book, ~N chunks
+  ensure_corpus(index_dir, "s100k", 100_000, dim=768, dtype="int8")
+                                      - a binary corpus written directly
+                                        with CorpusWriter (no Ollama)
+
+Corpus vectors are drawn around sqrt(N) random centres, so IVF lists are
+as uneven as real embeddings, and chunk texts are Zipf-distributed words,
+so BM25 postings have a realistic long tail. Corpora are written in
+bounded batches (1M x 768 never sits in memory) and reused across runs
+while their manifest matches the requested parameters.
+"""
+
+import sys
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from citl_corpus import CorpusWriter, corpus_exists, read_manifest  # noqa: E402
+
+SYLLABLES = (
+    "ka lo mi ra ten vor sa lu pe dri an os gel tur fa ni bel cor da mes "
+    "ul ba rin ho zet qui lam ser tov e"
+).split()
+
+SYNTH_FORMAT = 1
+WRITE_BATCH = 8192
+WORDS_PER_CHUNK = 120
+
+
+def word(i: int) -> str:
+    # Bijective base-len(SYLLABLES) spelling of i: unique, pronounceable
+    parts = []
+    i += 1
+    while i:
+        i, r = divmod(i - 1, len(SYLLABLES))
+        parts.append(SYLLABLES[r])
+    return "".join(reversed(parts))
+
+
+def vocabulary(n: int = 20000) -> List[str]:
+    return [word(i) for i in range(n)]
+
+
+def country_names(n: int) -> List[str]:
+    # Offset past the short words so no name collides with a vocabulary term
+    return [word(5000 + i * 7).capitalize() + "ia" for i in range(n)]
+
+
+def _sentences(rng: np.random.Generator, vocab: List[str], n_words: int) -> str:
+    ranks = np.minimum(rng.zipf(1.2, size=n_words), len(vocab)) - 1
+    words = [vocab[r] for r in ranks]
+    out = []
+    for lo in range(0, n_words, 12):
+        s = " ".join(words[lo : lo + 12])
+        out.append(s[:1].upper() + s[1:] + ".")
+    return " ".join(out)
+
+
+# ---------------------------------------------------------------------
+# Text sources
+# ---------------------------------------------------------------------
+
+def write_factbook(path: Path, n_countries: int, seed: int = 0) -> List[str]:
+    """
+    Factbook-format text (country line, section headings, "Field: value"
+    lines) that parse_factbook() and the shortcut regexes understand.
+    Returns the country names.
+    """
+    rng = np.random.default_rng(seed)
+    vocab = vocabulary(2000)
+    names = country_names(n_countries)
+    with open(path, "w", encoding="utf-8") as f:
+        for i, name in enumerate(names):
+            nb = ", ".join(names[(i + d) % n_countries] for d in (1, 2, 3))
+            f.write(
+                f"{name}\n"
+                "Introduction\n"
+                f"Background: {_sentences(rng, vocab, 120)}\n"
+                "Geography\n"
+                f"Location: {_sentences(rng, vocab, 16)}\n"
+                f"Area: total: {rng.integers(1_000, 9_000_000):,} sq km\n"
+                "Land boundaries:\n"
+                f"border countries: {nb}\n"
+                "People and Society\n"
+                f"Population: {rng.integers(10_000, 900_000_000):,}\n"
+                f"Languages: {name}ish (official)\n"
+                f"Religions: {vocab[i % 50]} {rng.integers(1, 99)}%\n"
+                f"Life expectancy at birth: total population: {rng.uniform(50, 85):.1f} years\n"
+                "Government\n"
+                f"Government type: {vocab[i % 20]} republic\n"
+                "Capital\n"
+                f"name: {name} City\n"
+                "Economy\n"
+                f"GDP (purchasing power parity): ${rng.integers(1, 20_000)} billion\n"
+                f"Currency: {vocab[i % 200]}\n"
+                "Communications\n"
+                f"Internet country code: .{name[:2].lower()}\n"
+                "\n\n"
+            )
+    return names
+
+
+def write_book(path: Path, approx_chunks: int, seed: int = 0) -> None:
+    """
+    Book text with "Chapter N" / "N.M Title" headings and 220-word
+    paragraphs, sized so citl_chunker yields roughly ``approx_chunks``
+    chunks at the default 350 tokens.
+    """
+    rng = np.random.default_rng(seed)
+    vocab = vocabulary()
+    paragraphs = max(1, approx_chunks)
+    with open(path, "w", encoding="utf-8") as f:
+        for p in range(paragraphs):
+            chapter, rest = divmod(p, 40)
+            if rest == 0:
+                f.write(f"Chapter {chapter + 1} {word(chapter).capitalize()}\n\n")
+            if rest % 8 == 0:
+                f.write(f"{chapter + 1}.{rest // 8 + 1} {word(rest).capitalize()} Concepts\n\n")
+            f.write(_sentences(rng, vocab, 220) + "\n\n")
+
+
+# ---------------------------------------------------------------------
+# Binary corpora
+# ---------------------------------------------------------------------
+
+def _batches(n: int, dim: int, seed: int) -> Iterator[Tuple[List[dict], np.ndarray]]:
+    rng = np.random.default_rng(seed)
+    n_centres = max(1, int(np.sqrt(n)))
+    centres = rng.standard_normal((n_centres, dim)).astype(np.float32)
+    centres /= np.linalg.norm(centres, axis=1, keepdims=True)
+    vocab = vocabulary()
+    for lo in range(0, n, WRITE_BATCH):
+        m = min(WRITE_BATCH, n - lo)
+        which = rng.integers(0, n_centres, size=m)
+        noise = rng.standard_normal((m, dim)).astype(np.float32) * (1.2 / np.sqrt(dim))
+        vecs = centres[which] + noise
+        chunks = [
+            {"id": lo + i, "text": _sentences(rng, vocab, WORDS_PER_CHUNK), "section": f"cluster {c}"}
+            for i, c in enumerate(which.tolist())
+        ]
+        yield chunks, vecs
+
+
+def ensure_corpus(
+    index_dir: Path,
+    name: str,
+    n: int,
+    dim: int,
+    dtype: str = "float32",
+    keep_full: bool = True,
+    model: str = "nomic-embed-text",
+    seed: int = 0,
+) -> bool:
+    """
+    Write synthetic corpus ``name`` unless an identical one is already
+    there. Returns True if it was (re)written.
+    """
+    meta = {
+        "synthetic": SYNTH_FORMAT,
+        "n": n,
+        "dim": dim,
+        "seed": seed,
+    }
+    manifest = read_manifest(index_dir, name) if corpus_exists(index_dir, name) else None
+    if (
+        manifest is not None
+        and manifest.get("meta") == meta
+        and manifest.get("model") == model
+        and manifest.get("dtype") == dtype
+        and bool(manifest.get("full")) == (keep_full and dtype != "float32")
+    ):
+        return False
+
+    writer = CorpusWriter(
+        index_dir, name, dtype=dtype, meta=dict(meta, model=model), resume=False, keep_full=keep_full
+    )
+    try:
+        for chunks, vecs in _batches(n, dim, seed):
+            writer.append(chunks, vecs)
+    except BaseException:
+        writer.close()
+        raise
+    writer.finish()
+    return True
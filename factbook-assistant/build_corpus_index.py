@@ -1,42 +1,14 @@
 import argparse
-import json
 from pathlib import Path
 
-import numpy as np
-import requests
 from tqdm import tqdm
 
-EMBED_MODEL = "nomic-embed-text"
-EMBED_URL = "http://localhost:11434/api/embed"
-
-
-def embed(text: str) -> np.ndarray:
-    """
-    Call Ollama /api/embed and return ONE normalized embedding vector.
-    Compatible with your existing build_factbook_index.py behavior.
-    """
-    r = requests.post(EMBED_URL, json={"model": EMBED_MODEL, "input": text})
-    r.raise_for_status()
-    out = r.json()
-
-    vec = None
-    if isinstance(out, dict):
-        # Current Ollama /api/embed usually returns {"embedding": [...]}
-        vec = out.get("embedding")
-        if vec is None:
-            # But we also support {"embeddings": [[...]]}
-            embs = out.get("embeddings")
-            if isinstance(embs, list) and embs:
-                vec = embs[0]
-    else:
-        raise RuntimeError(f"Unexpected embed response type: {type(out)}: {out}")
-
-    if vec is None:
-        raise RuntimeError(f"Could not find 'embedding' in embed response: {out}")
-
-    v = np.asarray(vec, dtype=np.float32)
-    v /= (np.linalg.norm(v) + 1e-8)
-    return v
+import citl_bm25
+from citl_chunker import add_chunker_args
+from citl_corpus import INDEX_DIR, add_storage_args, cache_path, corpus_paths, legacy_name
+from citl_embed import EMBED_MODEL, EmbedCache, EmbedEngine, add_engine_args
+from citl_ingest import add_ingest_args, ingest_file
+from citl_vector_index import add_ann_args, build_for_corpus
 
 
 def main() -> None:
@@ -48,43 +20,69 @@ def main() -> None:
         required=True,
         help="Source .txt file (e.g. 'Nursing Fundamentals 2e.txt')",
     )
+    parser.add_argument(
+        "--name",
+        help="Corpus name (e.g. 'nursing'); defaults to the --out name or the source stem",
+    )
     parser.add_argument(
         "--out",
-        required=True,
-        help="Output JSON file (e.g. 'nursing_embeddings.json')",
+        help="Legacy output name (e.g. 'nursing_embeddings.json'); only used to derive --name",
     )
     parser.add_argument(
-        "--chunk",
-        type=int,
-        default=1500,
-        help="Chunk size in characters (default: 1500)",
+        "--index-dir",
+        default=str(INDEX_DIR),
+        help=f"Index directory to write into (default: {INDEX_DIR})",
     )
+    add_storage_args(parser)
+    add_chunker_args(parser)
+    add_engine_args(parser)
+    add_ann_args(parser)
+    add_ingest_args(parser)
     args = parser.parse_args()
 
     src_path = Path(args.src)
-    out_path = Path(args.out)
+    if args.name:
+        name = args.name
+    elif args.out:
+        name = legacy_name(Path(args.out))
+    else:
+        name = src_path.stem
 
     if not src_path.exists():
         raise FileNotFoundError(f"Source file not found: {src_path}")
 
-    raw = src_path.read_text(encoding="utf-8", errors="ignore")
-
-    chunks = []
-    for i in range(0, len(raw), args.chunk):
-        text = raw[i : i + args.chunk]
-        chunks.append({"i": len(chunks), "text": text})
-
-    print(f"Embedding {len(chunks)} chunks from {src_path.name}...")
-
-    all_vecs = []
-    for c in tqdm(chunks):
-        v = embed(c["text"])
-        all_vecs.append(v.tolist())
-
-    data = {"embeddings": all_vecs, "chunks": chunks}
-    out_path.write_text(json.dumps(data), encoding="utf-8")
-
-    print(f"Wrote embeddings for {len(chunks)} chunks to {out_path}")
+    engine = EmbedEngine(
+        model=EMBED_MODEL, batch_size=args.batch_size, workers=args.workers
+    )
+    index_dir = Path(args.index_dir)
+    cache = None if args.no_cache else EmbedCache(cache_path(index_dir, name))
+
+    print(f"Embedding chunks from {src_path.name}...")
+    try:
+        with tqdm(unit="chunk") as bar:
+            n = ingest_file(
+                src_path,
+                index_dir,
+                name,
+                engine,
+                cache=cache,
+                max_tokens=args.max_tokens,
+                overlap_tokens=args.overlap_tokens,
+                dtype=args.dtype,
+                keep_full=not args.no_full,
+                resume=not args.restart,
+                on_batch=bar.update,
+            )
+    finally:
+        if cache is not None:
+            cache.close()
+    print(engine.report())
+    build_for_corpus(index_dir, name, args.ann, args.nlist)
+    citl_bm25.build_for_corpus(index_dir, name)
+
+    emb_path, ch_path, _ = corpus_paths(index_dir, name)
+    print(f"Wrote embeddings for {n} chunks to {emb_path}")
+    print(f"Wrote chunks -> {ch_path}")
 
 
 if __name__ == "__main__":
@@ -2,129 +2,38 @@
 """
 Builds a semantic search index over factbook.txt using Ollama embeddings.
 
-Outputs:
-  index/factbook.emb.npy      - numpy array of shape (N, D)
-  index/factbook.chunks.jsonl - one JSON per line: {"id": int, "text": str}
+Outputs (binary corpus layout, see citl_corpus.py):
+  index/factbook.emb.npy      - numpy array of shape (N, D), rows normalized
+                                (--dtype float16/int8 for smaller indexes)
+  index/factbook.chunks.jsonl - one JSON per line: {"id": int, "text": str, ...}
+  index/factbook.offsets.npy  - byte offset of each line in the .jsonl
+  index/factbook.fields.json  - country -> section -> field byte spans for
+                                shortcut queries (see citl_factbook_fields.py)
 """
 
-import os
-import json
+import argparse
 import pathlib
-from typing import List
-
-import numpy as np
-import requests
 from tqdm import tqdm
 
-ROOT = Path(__file__).resolve().parent
+import citl_bm25
+from citl_chunker import add_chunker_args
+from citl_corpus import add_storage_args, cache_path
+from citl_embed import EMBED_MODEL, EmbedCache, EmbedEngine, add_engine_args
+from citl_ingest import add_ingest_args, ingest_file
+from citl_factbook_fields import build_field_index
+from citl_vector_index import add_ann_args, build_for_corpus
 
-FACTBOOK = ROOT / "factbook.txt"
-EMB_JSON = ROOT / "factbook_embeddings.json"
 # ---------------------------------------------------------------------
 # Configuration
 # ---------------------------------------------------------------------
 
-# Ollama endpoint & embedding model
-OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "http://127.0.0.1:11434")
-EMB_URL = f"{OLLAMA_HOST}/api/embeddings"
-EMB_MODEL = os.environ.get("FACTBOOK_EMBED", "nomic-embed-text")
-
 # Paths (all relative to this script's folder)
 ROOT = pathlib.Path(__file__).resolve().parent
 FACTBOOK_TXT = ROOT / "factbook.txt"
 INDEX_DIR = ROOT / "index"
 EMB_PATH = INDEX_DIR / "factbook.emb.npy"
 CH_PATH = INDEX_DIR / "factbook.chunks.jsonl"
-
-
-# ---------------------------------------------------------------------
-# Ollama embedding helper (robust to different JSON shapes)
-# ---------------------------------------------------------------------
-
-def ollama_embed(text: str) -> np.ndarray:
-    """
-    Call Ollama /api/embeddings and return a **normalized** float32 vector.
-
-    Handles responses shaped like:
-      {"embedding": [...]}
-      {"embeddings": [[...]]}
-      [{"embedding": [...]}]
-      [{"embeddings": [[...]]}]
-    """
-    payload = {
-        "model": EMB_MODEL,
-        "input": text,
-    }
-    r = requests.post(EMB_URL, json=payload, timeout=120)
-    r.raise_for_status()
-    data = r.json()
-
-    vec = None
-
-    # Case 1: dict
-    if isinstance(data, dict):
-        if "embedding" in data:
-            vec = data["embedding"]
-        elif "embeddings" in data:
-            first = data["embeddings"][0]
-            if isinstance(first, dict) and "embedding" in first:
-                vec = first["embedding"]
-            else:
-                vec = first
-
-    # Case 2: list
-    elif isinstance(data, list) and data:
-        first = data[0]
-        if isinstance(first, dict):
-            if "embedding" in first:
-                vec = first["embedding"]
-            elif "embeddings" in first:
-                inner = first["embeddings"][0]
-                if isinstance(inner, dict) and "embedding" in inner:
-                    vec = inner["embedding"]
-                else:
-                    vec = inner
-        else:
-            vec = first
-
-    if vec is None:
-        raise RuntimeError(f"Could not find embedding in Ollama response: {data}")
-
-    v = np.asarray(vec, dtype=np.float32)
-    v /= (np.linalg.norm(v) + 1e-8)
-    return v
-
-
-# ---------------------------------------------------------------------
-# Chunking
-# ---------------------------------------------------------------------
-
-def make_chunks(text: str, max_chars: int = 1200, overlap: int = 200) -> List[str]:
-    """
-    Simple paragraph-aware chunker for the Factbook text.
-    """
-    paragraphs = [p.strip() for p in text.split("\n\n") if p.strip()]
-    chunks: List[str] = []
-    current = ""
-
-    for p in paragraphs:
-        if not current:
-            current = p
-            continue
-
-        # If we can append this paragraph without exceeding max_chars
-        if len(current) + 2 + len(p) <= max_chars:
-            current += "\n\n" + p
-        else:
-            chunks.append(current)
-            # start new chunk with an overlap from the end of the previous
-            tail = current[-overlap:]
-            current = tail + "\n\n" + p
-
-    if current:
-        chunks.append(current)
-
-    return chunks
+FIELDS_PATH = INDEX_DIR / "factbook.fields.json"
 
 
 # ---------------------------------------------------------------------
@@ -132,6 +41,16 @@ def make_chunks(text: str, max_chars: int = 1200, overlap: int = 200) -> List[st
 # ---------------------------------------------------------------------
 
 def main() -> None:
+    ap = argparse.ArgumentParser(
+        description="Build the semantic index over factbook.txt"
+    )
+    add_chunker_args(ap, max_tokens=300)
+    add_storage_args(ap)
+    add_engine_args(ap)
+    add_ann_args(ap)
+    add_ingest_args(ap)
+    args = ap.parse_args()
+
     if not FACTBOOK_TXT.exists():
         raise SystemExit(
             f"ERROR: {FACTBOOK_TXT} not found.\n"
@@ -141,27 +60,37 @@ def main() -> None:
     INDEX_DIR.mkdir(exist_ok=True)
 
     print(f"Reading Factbook from: {FACTBOOK_TXT}")
-    raw_text = FACTBOOK_TXT.read_text(encoding="utf-8", errors="ignore")
-
-    chunks = make_chunks(raw_text)
-    print(f"Total chunks to embed: {len(chunks)}", flush=True)
-
-    embeddings: List[np.ndarray] = []
-    with tqdm(total=len(chunks), desc="Embedding") as bar:
-        for c in chunks:
-            v = ollama_embed(c)
-            embeddings.append(v)
-            bar.update(1)
-
-    emb_arr = np.stack(embeddings, axis=0)
-    # row-normalize again, just to be safe
-    emb_arr /= (np.linalg.norm(emb_arr, axis=1, keepdims=True) + 1e-8)
-
-    np.save(EMB_PATH, emb_arr)
 
-    with CH_PATH.open("w", encoding="utf-8") as f:
-        for i, c in enumerate(chunks):
-            f.write(json.dumps({"id": i, "text": c}, ensure_ascii=False) + "\n")
+    fields = build_field_index(FACTBOOK_TXT, FIELDS_PATH)
+    print(f"Indexed fields for {len(fields['countries'])} countries -> {FIELDS_PATH}")
+
+    engine = EmbedEngine(
+        model=EMBED_MODEL, batch_size=args.batch_size, workers=args.workers
+    )
+    # Unchanged chunks are reused from the cache; only edits hit Ollama
+    cache = None if args.no_cache else EmbedCache(cache_path(INDEX_DIR, "factbook"))
+    try:
+        with tqdm(desc="Embedding", unit="chunk") as bar:
+            n = ingest_file(
+                FACTBOOK_TXT,
+                INDEX_DIR,
+                "factbook",
+                engine,
+                cache=cache,
+                max_tokens=args.max_tokens,
+                overlap_tokens=args.overlap_tokens,
+                dtype=args.dtype,
+                keep_full=not args.no_full,
+                resume=not args.restart,
+                on_batch=bar.update,
+            )
+    finally:
+        if cache is not None:
+            cache.close()
+    print(engine.report())
+    print(f"Total chunks: {n}")
+    build_for_corpus(INDEX_DIR, "factbook", args.ann, args.nlist)
+    citl_bm25.build_for_corpus(INDEX_DIR, "factbook")
 
     print()
     print(f"Saved embeddings -> {EMB_PATH}")
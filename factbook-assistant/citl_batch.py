@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Batch question mode shared by citl_multi_rag.py and query_factbook.py.
+
+  python citl_multi_rag.py --source all --batch questions.jsonl --out answers.jsonl
+  python query_factbook.py --batch faq.jsonl
+
+Input is JSONL, one question per line: {"question": "..."} (or "query"),
+any other fields such as "id" are copied to the output. A plain JSON string
+per line works too. The whole batch is embedded with a few /api/embed
+requests, scored with one Q @ E.T product, and generation requests go
+through a bounded worker pool. Answers are written as JSONL in input order,
+each as soon as it and everything before it is done.
+
+Environment:
+  CITL_GEN_WORKERS - concurrent /api/generate requests (default: 2; match
+                     OLLAMA_NUM_PARALLEL on the Ollama side)
+"""
+
+import os
+import sys
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional, Sequence, TextIO
+
+import numpy as np
+
+import citl_trace
+from citl_cache import QueryCache
+from citl_embed import EmbedEngine
+
+DEFAULT_GEN_WORKERS = int(os.environ.get("CITL_GEN_WORKERS", "2"))
+
+
+def read_questions(path: Path) -> List[dict]:
+    """
+    Load a questions JSONL file as records that all have a "question" key.
+    """
+    records: List[dict] = []
+    with open(path, "r", encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            data = json.loads(line)
+            if isinstance(data, str):
+                data = {"question": data}
+            elif isinstance(data, dict) and "question" not in data and "query" in data:
+                data = dict(data, question=data["query"])
+            if not isinstance(data, dict) or not str(data.get("question", "")).strip():
+                raise ValueError(f"{path}:{lineno}: expected a question string or object")
+            records.append(data)
+    return records
+
+
+def embed_questions(
+    texts: Sequence[str],
+    model: str,
+    cache: Optional[QueryCache] = None,
+) -> np.ndarray:
+    """
+    Embed many questions at once: cached ones come from the query cache,
+    the rest go to Ollama in batched /api/embed requests. Returns (Q, D)
+    normalized float32 rows in input order.
+    """
+    vecs: List[Optional[np.ndarray]] = [None] * len(texts)
+    if cache is not None:
+        for i, text in enumerate(texts):
+            vecs[i] = cache.get_embedding(text, model)
+
+    todo = [i for i, v in enumerate(vecs) if v is None]
+    if todo:
+        engine = EmbedEngine(model=model)
+        fresh = engine.embed([texts[i] for i in todo])
+        for i, v in zip(todo, fresh):
+            vecs[i] = v
+            if cache is not None:
+                cache.put_embedding(texts[i], model, v)
+
+    if not vecs:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.stack(vecs).astype(np.float32, copy=False)
+
+
+def run_ordered(
+    items: Iterable,
+    fn: Callable,
+    workers: int = DEFAULT_GEN_WORKERS,
+) -> Iterable:
+    """
+    Apply ``fn`` to each item on a thread pool and yield (item, result) in
+    input order. At most ``workers`` calls are in flight.
+    """
+    workers = max(1, int(workers))
+    pending: deque = deque()
+    it = iter(items)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        try:
+            while True:
+                while len(pending) < workers:
+                    item = next(it, None)
+                    if item is None:
+                        break
+                    pending.append((item, pool.submit(fn, item)))
+                if not pending:
+                    break
+                item, fut = pending.popleft()
+                yield item, fut.result()
+        finally:
+            for _, fut in pending:
+                fut.cancel()
+
+
+def write_answers(
+    jobs: Sequence[dict],
+    answer: Callable[[dict], str],
+    out: TextIO,
+    workers: int = DEFAULT_GEN_WORKERS,
+    tool: str = "batch",
+) -> int:
+    """
+    Answer every job (a record with its retrieved context) through the
+    pool and write {..., "answer", "seconds"} lines to ``out`` in order.
+    A failed question is written with an "error" field instead.
+    Returns the number of errors. With tracing on, every answer is traced
+    as its own query of ``tool``.
+    """
+    def run(job: dict) -> dict:
+        t0 = time.perf_counter()
+        try:
+            with citl_trace.trace(tool, str(job["record"].get("question", ""))):
+                with citl_trace.stage("generate"):
+                    result = {"answer": answer(job)}
+        except Exception as e:
+            result = {"error": f"{type(e).__name__}: {e}"}
+        result["seconds"] = round(time.perf_counter() - t0, 3)
+        return result
+
+    errors = 0
+    for job, result in run_ordered(jobs, run, workers):
+        record = {k: v for k, v in job["record"].items()}
+        record.update(result)
+        errors += "error" in result
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        out.flush()
+    return errors
+
+
+def open_output(path: str) -> TextIO:
+    if path == "-":
+        return sys.stdout
+    return open(path, "w", encoding="utf-8")
+
+
+def report(n: int, seconds: float, errors: int = 0) -> str:
+    rate = n / seconds * 60 if seconds > 0 else 0.0
+    msg = f"[INFO] Answered {n} questions in {seconds:.1f}s ({rate:.1f} questions/min)"
+    if errors:
+        msg += f", {errors} failed"
+    return msg
+
+
+def add_batch_args(parser) -> None:
+    parser.add_argument(
+        "--batch",
+        metavar="QUESTIONS_JSONL",
+        default=None,
+        help="Answer every question in a JSONL file instead of a single question.",
+    )
+    parser.add_argument(
+        "--out",
+        default="-",
+        help="With --batch: answers JSONL path (default: stdout).",
+    )
+    parser.add_argument(
+        "--gen-workers",
+        type=int,
+        default=DEFAULT_GEN_WORKERS,
+        help=f"With --batch: concurrent generate requests (default: {DEFAULT_GEN_WORKERS}).",
+    )
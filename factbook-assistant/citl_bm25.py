@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+"""
+BM25 inverted index for hybrid (lexical + vector) retrieval.
+
+Cosine search misses exact terms students type (drug names, statute terms,
+country codes). Each corpus gets a compact inverted index, built by the
+indexers next to its embeddings as index/<name>.bm25.npz:
+
+  terms        - (V,) sorted UTF-8 byte strings; a term is found with
+                 np.searchsorted, no dict to build at load time
+  term_offsets - (V + 1,) int64; postings of term t are
+                 [term_offsets[t], term_offsets[t + 1])
+  doc_ids      - (P,) int32 chunk rows, per term sorted by weight (desc)
+  weights      - (P,) float32 precomputed BM25 impact of the term in the
+                 chunk, so a query is just slicing and summing arrays
+  tfs, doc_len - (P,) term frequencies and (N,) chunk lengths in tokens, so
+                 appended chunks (citl_lectures.py) only tokenize the new
+                 text; the weights are then re-derived from these arrays
+
+Vector and BM25 rankings are combined with reciprocal rank fusion:
+score(d) = sum 1 / (RRF_K + rank(d)) over both lists.
+
+Environment:
+  CITL_HYBRID - "1" (default) fuse BM25 when an index exists, "0" vectors only
+"""
+
+import os
+import re
+import time
+import argparse
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+BM25_SUFFIX = ".bm25.npz"
+HYBRID = os.environ.get("CITL_HYBRID", "1") != "0"
+
+K1 = 1.2
+B = 0.75
+RRF_K = 60
+# Candidates taken from each ranking before fusing
+FUSE_DEPTH = 50
+# Postings read per query term (highest impact first); bounds the cost of
+# very common terms
+MAX_POSTINGS = 50000
+MAX_TERM_LEN = 40
+
+_TOKEN_RE = re.compile(r"[0-9a-z]+")
+
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have he her his in is it its of on or "
+    "that the their they this to was were which will with what who how when where "
+    "why do does did can could should would you your".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [
+        t for t in _TOKEN_RE.findall(text.lower())
+        if t not in STOPWORDS and len(t) <= MAX_TERM_LEN
+    ]
+
+
+def bm25_path(index_dir: Path, name: str) -> Path:
+    return Path(index_dir) / f"{name}{BM25_SUFFIX}"
+
+
+def _top(scores: np.ndarray, k: int) -> np.ndarray:
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    idx = np.argpartition(-scores, k - 1)[:k]
+    return idx[np.argsort(-scores[idx], kind="stable")]
+
+
+# ---------------------------------------------------------------------
+# Index
+# ---------------------------------------------------------------------
+
+class BM25Index:
+    """
+    Array-backed inverted index with precomputed BM25 weights.
+    """
+
+    def __init__(
+        self,
+        terms: np.ndarray,
+        term_offsets: np.ndarray,
+        doc_ids: np.ndarray,
+        weights: np.ndarray,
+        n_docs: int,
+        tfs: Optional[np.ndarray] = None,
+        doc_len: Optional[np.ndarray] = None,
+    ):
+        self.terms = terms
+        self.term_offsets = term_offsets
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.n_docs = n_docs
+        # Only needed to extend the index (None for older index files)
+        self.tfs = tfs
+        self.doc_len = doc_len
+
+    def __len__(self) -> int:
+        return self.n_docs
+
+    def postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        key = term.encode("utf-8")
+        t = int(np.searchsorted(self.terms, key))
+        if t >= self.terms.shape[0] or self.terms[t] != key:
+            return self.doc_ids[:0], self.weights[:0]
+        lo = int(self.term_offsets[t])
+        hi = min(int(self.term_offsets[t + 1]), lo + MAX_POSTINGS)
+        return self.doc_ids[lo:hi], self.weights[lo:hi]
+
+    def search(self, text: str, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k chunk rows by BM25 score for a free-text query.
+        """
+        ids_parts, w_parts = [], []
+        for term in set(tokenize(text)):
+            ids, ws = self.postings(term)
+            if ids.shape[0]:
+                ids_parts.append(ids)
+                w_parts.append(ws)
+        if not ids_parts:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        if len(ids_parts) == 1:
+            docs, scores = ids_parts[0], w_parts[0]
+        else:
+            ids = np.concatenate(ids_parts)
+            ws = np.concatenate(w_parts)
+            if ids.shape[0] * 8 >= self.n_docs:
+                # Dense accumulator: O(postings + docs), no sort
+                scores = np.bincount(ids, weights=ws, minlength=self.n_docs).astype(np.float32)
+                docs = np.arange(self.n_docs)
+            else:
+                docs, inv = np.unique(ids, return_inverse=True)
+                scores = np.bincount(inv, weights=ws).astype(np.float32)
+        top = _top(scores, k)
+        top = top[scores[top] > 0]
+        return docs[top].astype(np.int64), scores[top]
+
+
+def _count_terms(chunks: Iterable[dict], first_doc: int = 0):
+    """
+    Tokenize chunks (rows first_doc, first_doc + 1, ...) into postings:
+    (sorted terms, term id per posting, doc ids, term frequencies, lengths).
+    """
+    vocab = {}
+    term_ids = array("i")
+    doc_ids = array("i")
+    tfs = array("f")
+    doc_len = array("i")
+
+    for d, chunk in enumerate(chunks, first_doc):
+        toks = tokenize(chunk["text"])
+        doc_len.append(len(toks))
+        for term, n in Counter(toks).items():
+            term_ids.append(vocab.setdefault(term, len(vocab)))
+            doc_ids.append(d)
+            tfs.append(n)
+
+    tid = np.frombuffer(term_ids, dtype=np.int32)
+    # Renumber terms in sorted byte order so lookups can use searchsorted
+    terms = np.array([t.encode("utf-8") for t in vocab], dtype=object)
+    order = np.argsort(terms) if len(vocab) else np.zeros(0, dtype=np.int64)
+    new_id = np.empty(len(vocab), dtype=np.int64)
+    new_id[order] = np.arange(len(vocab))
+    tid = new_id[tid] if len(vocab) else tid.astype(np.int64)
+    sorted_terms = np.array(list(terms[order]), dtype="S") if len(vocab) else np.zeros(0, dtype="S1")
+    return (
+        sorted_terms,
+        tid,
+        np.frombuffer(doc_ids, dtype=np.int32),
+        np.frombuffer(tfs, dtype=np.float32),
+        np.frombuffer(doc_len, dtype=np.int32),
+    )
+
+
+def _weigh(terms: np.ndarray, tid: np.ndarray, did: np.ndarray, tf: np.ndarray, doc_len: np.ndarray) -> BM25Index:
+    """
+    BM25 weights for postings (term ids index the sorted ``terms``), grouped
+    per term and sorted by weight.
+    """
+    n_docs = doc_len.shape[0]
+    dl = doc_len.astype(np.float32)
+    df = np.bincount(tid, minlength=terms.shape[0]).astype(np.float32)
+    idf = np.log1p((n_docs - df + 0.5) / (df + 0.5))
+    avgdl = float(dl.mean()) if n_docs else 1.0
+    norm = K1 * (1 - B + B * dl[did] / max(avgdl, 1e-6))
+    weights = (idf[tid] * tf * (K1 + 1) / (tf + norm)).astype(np.float32)
+
+    post = np.lexsort((-weights, tid))
+    counts = np.bincount(tid, minlength=terms.shape[0])
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    return BM25Index(terms, offsets, did[post], weights[post], n_docs, tf[post], doc_len)
+
+
+def build_bm25(chunks: Iterable[dict]) -> BM25Index:
+    """
+    Build the index from chunk dicts in row order (a ChunkStore streams).
+    """
+    return _weigh(*_count_terms(chunks))
+
+
+def extend_bm25(index: BM25Index, chunks: Iterable[dict]) -> BM25Index:
+    """
+    The index with ``chunks`` appended as rows n_docs, n_docs + 1, ...
+    Only the new chunks are tokenized; IDF and average length change with
+    every chunk, so the weights of all postings are re-derived (array
+    arithmetic, no text is read again).
+    """
+    if index.tfs is None or index.doc_len is None:
+        raise ValueError("BM25 index has no term frequencies; rebuild it")
+    new_terms, new_tid, new_did, new_tf, new_len = _count_terms(chunks, index.n_docs)
+    terms = np.union1d(index.terms, new_terms)
+    old_tid = np.repeat(
+        np.searchsorted(terms, index.terms), np.diff(index.term_offsets)
+    )
+    return _weigh(
+        terms,
+        np.concatenate([old_tid, np.searchsorted(terms, new_terms)[new_tid]]),
+        np.concatenate([index.doc_ids, new_did]),
+        np.concatenate([index.tfs, new_tf]),
+        np.concatenate([index.doc_len, new_len]),
+    )
+
+
+def save_bm25(index: BM25Index, path: Path, chunks_path: Path) -> None:
+    st = Path(chunks_path).stat()
+    path = Path(path)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        np.savez(
+            f,
+            terms=index.terms,
+            term_offsets=index.term_offsets,
+            doc_ids=index.doc_ids,
+            weights=index.weights,
+            n_docs=np.int64(index.n_docs),
+            tfs=index.tfs if index.tfs is not None else np.zeros(0, dtype=np.float32),
+            doc_len=index.doc_len if index.doc_len is not None else np.zeros(0, dtype=np.int32),
+            chunks_sig=np.array([st.st_size, st.st_mtime_ns], dtype=np.int64),
+        )
+    os.replace(tmp, path)
+
+
+def load_bm25(path: Path, chunks_path: Path) -> Optional[BM25Index]:
+    """
+    Load a BM25 index, or None if it is missing or older than the chunks.
+    """
+    path = Path(path)
+    if not path.exists():
+        return None
+    st = Path(chunks_path).stat()
+    index, sig = _read_bm25(path)
+    if sig != (st.st_size, st.st_mtime_ns):
+        print(f"[WARN] {path.name} is older than the chunks; using vector search only")
+        return None
+    return index
+
+
+def _read_bm25(path: Path) -> Tuple[BM25Index, tuple]:
+    """
+    (index, chunks signature it was built for) from an index file.
+    """
+    # Read everything and close the archive, so the file can be replaced
+    with np.load(path) as data:
+        n_docs = int(data["n_docs"])
+        tfs = data["tfs"] if "tfs" in data.files else None
+        doc_len = data["doc_len"] if "doc_len" in data.files else None
+        if doc_len is None or doc_len.shape[0] != n_docs:
+            # Written before term frequencies were kept: cannot be extended
+            tfs = doc_len = None
+        index = BM25Index(
+            data["terms"], data["term_offsets"], data["doc_ids"], data["weights"], n_docs, tfs, doc_len
+        )
+        return index, tuple(data["chunks_sig"])
+
+
+def build_for_corpus(index_dir: Path, name: str) -> None:
+    """
+    Called by the indexers once the corpus files are in place.
+    """
+    from citl_corpus import corpus_paths, open_corpus
+
+    t0 = time.perf_counter()
+    corpus = open_corpus(index_dir, name)
+    index = build_bm25(corpus.chunks)
+    corpus.close()
+    path = bm25_path(index_dir, name)
+    save_bm25(index, path, corpus_paths(index_dir, name)[1])
+    print(
+        f"Built BM25 index ({index.terms.shape[0]} terms, {index.doc_ids.shape[0]} postings) "
+        f"in {time.perf_counter() - t0:.1f}s -> {path}"
+    )
+
+
+def append_for_corpus(index_dir: Path, name: str, start: int) -> None:
+    """
+    Called after chunks were appended to a corpus from row ``start`` on:
+    adds just those chunks to its BM25 index. Falls back to a full build
+    when the index does not end at ``start`` (missing, older format, or
+    written for another version of the corpus).
+    """
+    from citl_corpus import corpus_paths, open_corpus
+
+    path = bm25_path(index_dir, name)
+    old = _read_bm25(path)[0] if start and path.exists() else None
+    if old is None or old.n_docs != start or old.tfs is None:
+        build_for_corpus(index_dir, name)
+        return
+
+    t0 = time.perf_counter()
+    corpus = open_corpus(index_dir, name)
+    try:
+        index = extend_bm25(old, (corpus.chunks[i] for i in range(start, len(corpus))))
+    finally:
+        corpus.close()
+    save_bm25(index, path, corpus_paths(index_dir, name)[1])
+    print(
+        f"Added {index.n_docs - start} chunks to the BM25 index ({index.terms.shape[0]} terms) "
+        f"in {time.perf_counter() - t0:.2f}s -> {path}"
+    )
+
+
+# ---------------------------------------------------------------------
+# Fusion
+# ---------------------------------------------------------------------
+
+def rrf_fuse(rankings: Sequence[np.ndarray], k: int, rrf_k: int = RRF_K) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Reciprocal rank fusion of several best-first id lists.
+    Returns (ids, fused scores), best first.
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, i in enumerate(ranking.tolist()):
+            fused[i] = fused.get(i, 0.0) + 1.0 / (rrf_k + rank + 1)
+    if not fused:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    ids = np.fromiter(fused.keys(), dtype=np.int64, count=len(fused))
+    scores = np.fromiter(fused.values(), dtype=np.float32, count=len(fused))
+    top = _top(scores, k)
+    return ids[top], scores[top]
+
+
+def main() -> None:
+    from citl_corpus import INDEX_DIR, open_corpus
+
+    ap = argparse.ArgumentParser(description="Build or query BM25 indexes.")
+    ap.add_argument("--name", required=True, help="Corpus name")
+    ap.add_argument("--index-dir", default=str(INDEX_DIR))
+    ap.add_argument("query", nargs="?", help="Optional: search instead of building")
+    ap.add_argument("-k", type=int, default=5)
+    args = ap.parse_args()
+
+    index_dir = Path(args.index_dir)
+    if not args.query:
+        build_for_corpus(index_dir, args.name)
+        return
+
+    corpus = open_corpus(index_dir, args.name)
+    index = corpus.lexical
+    if index is None:
+        raise SystemExit(f"ERROR: no BM25 index for '{args.name}'; build it first.")
+    t0 = time.perf_counter()
+    ids, scores = index.search(args.query, args.k)
+    took = (time.perf_counter() - t0) * 1000
+    for i, sc in zip(ids, scores):
+        print(f"{sc:7.3f}  #{i}  {corpus.chunks[int(i)]['text'][:100]!r}")
+    print(f"[INFO] {len(tokenize(args.query))} terms in {took:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Two-level query cache shared by query_factbook.py, citl_multi_rag.py and
+citl_rag_server.py.
+
+  level 1: normalized query text + embed model       -> query embedding
+  level 2: query + retrieved context + LLM + options -> final answer
+
+Both levels live in one SQLite file (index/query_cache.sqlite by default,
+CITL_QUERY_CACHE to move it), are size-bounded with least-recently-used
+eviction, and can expire entries after a TTL. Hit/miss counters are kept in
+the same file so they add up across CLI runs.
+
+Environment:
+  CITL_QUERY_CACHE      - cache file path
+  CITL_CACHE_TTL        - seconds before an entry expires (default: never)
+  CITL_CACHE_EMBEDDINGS - max cached query embeddings (default: 20000)
+  CITL_CACHE_ANSWERS    - max cached answers (default: 5000)
+"""
+
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent
+CACHE_PATH = Path(os.environ.get("CITL_QUERY_CACHE", str(ROOT / "index" / "query_cache.sqlite")))
+
+_ttl = os.environ.get("CITL_CACHE_TTL")
+DEFAULT_TTL: Optional[float] = float(_ttl) if _ttl else None
+DEFAULT_MAX_EMBEDDINGS = int(os.environ.get("CITL_CACHE_EMBEDDINGS", "20000"))
+DEFAULT_MAX_ANSWERS = int(os.environ.get("CITL_CACHE_ANSWERS", "5000"))
+
+
+def normalize_query(text: str) -> str:
+    """
+    'What is the  Capital of France?' -> 'what is the capital of france'
+    """
+    text = re.sub(r"\s+", " ", text.strip().lower())
+    return text.rstrip(" ?.!")
+
+
+def _hash(*parts) -> str:
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class QueryCache:
+    """
+    SQLite-backed LRU/TTL cache for query embeddings and answers.
+
+    Safe to share between threads (the resident server does).
+    """
+
+    def __init__(
+        self,
+        path: Path = CACHE_PATH,
+        max_embeddings: int = DEFAULT_MAX_EMBEDDINGS,
+        max_answers: int = DEFAULT_MAX_ANSWERS,
+        ttl: Optional[float] = DEFAULT_TTL,
+    ):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.limits = {"embeddings": max_embeddings, "answers": max_answers}
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY, dim INTEGER NOT NULL, vec BLOB NOT NULL,
+                created REAL NOT NULL, last_used REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS answers (
+                key TEXT PRIMARY KEY, answer TEXT NOT NULL,
+                created REAL NOT NULL, last_used REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS counters (
+                name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+            CREATE INDEX IF NOT EXISTS embeddings_lru ON embeddings (last_used);
+            CREATE INDEX IF NOT EXISTS answers_lru ON answers (last_used);
+            """
+        )
+        self.conn.commit()
+
+    # -- internals -------------------------------------------------------
+
+    def _count(self, name: str) -> None:
+        self.conn.execute(
+            "INSERT INTO counters (name, value) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,),
+        )
+
+    def _get(self, table: str, cols: str, key: str):
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute(
+                f"SELECT {cols}, created FROM {table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl is not None and now - row[-1] > self.ttl:
+                self.conn.execute(f"DELETE FROM {table} WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self._count(f"{table}_miss")
+            else:
+                self.conn.execute(
+                    f"UPDATE {table} SET last_used = ? WHERE key = ?", (now, key)
+                )
+                self._count(f"{table}_hit")
+            self.conn.commit()
+        return None if row is None else row[:-1]
+
+    def _put(self, table: str, cols: str, key: str, values: tuple) -> None:
+        now = time.time()
+        marks = ",".join("?" * (len(values) + 3))
+        with self._lock:
+            self.conn.execute(
+                f"INSERT OR REPLACE INTO {table} (key, {cols}, created, last_used) "
+                f"VALUES ({marks})",
+                (key, *values, now, now),
+            )
+            if self.ttl is not None:
+                self.conn.execute(
+                    f"DELETE FROM {table} WHERE created < ?", (now - self.ttl,)
+                )
+            # LRU: drop the least recently used rows beyond the size limit
+            self.conn.execute(
+                f"DELETE FROM {table} WHERE key IN ("
+                f" SELECT key FROM {table} ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.limits[table],),
+            )
+            self.conn.commit()
+
+    # -- level 1: query embeddings -----------------------------------------
+
+    @staticmethod
+    def embedding_key(text: str, model: str) -> str:
+        return _hash("emb", normalize_query(text), model)
+
+    def get_embedding(self, text: str, model: str) -> Optional[np.ndarray]:
+        row = self._get("embeddings", "dim, vec", self.embedding_key(text, model))
+        if row is None:
+            return None
+        dim, blob = row
+        return np.frombuffer(blob, dtype=np.float32, count=dim).copy()
+
+    def put_embedding(self, text: str, model: str, vec: np.ndarray) -> None:
+        v = np.asarray(vec, dtype=np.float32)
+        self._put("embeddings", "dim, vec", self.embedding_key(text, model), (int(v.shape[0]), v.tobytes()))
+
+    # -- level 2: answers --------------------------------------------------
+
+    @staticmethod
+    def answer_key(question: str, context: str, model: str, options: dict) -> str:
+        """
+        The context hash stands in for the retrieved chunk IDs: it changes
+        whenever retrieval picks different chunks or a chunk's text changes.
+        """
+        ctx_hash = hashlib.sha256(context.encode("utf-8")).hexdigest()
+        return _hash("ans", normalize_query(question), ctx_hash, model, options)
+
+    def get_answer(self, question: str, context: str, model: str, options: dict) -> Optional[str]:
+        row = self._get("answers", "answer", self.answer_key(question, context, model, options))
+        return None if row is None else row[0]
+
+    def put_answer(self, question: str, context: str, model: str, options: dict, answer: str) -> None:
+        self._put("answers", "answer", self.answer_key(question, context, model, options), (answer,))
+
+    # -- reporting ---------------------------------------------------------
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            out = {name: value for name, value in self.conn.execute("SELECT name, value FROM counters")}
+            for table in ("embeddings", "answers"):
+                out[f"{table}_size"] = self.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        for table in ("embeddings", "answers"):
+            out.setdefault(f"{table}_hit", 0)
+            out.setdefault(f"{table}_miss", 0)
+        return out
+
+    def report(self) -> str:
+        s = self.stats()
+        return (
+            f"[INFO] Query cache {self.path.name}: "
+            f"embeddings {s['embeddings_hit']} hit / {s['embeddings_miss']} miss "
+            f"({s['embeddings_size']} stored), "
+            f"answers {s['answers_hit']} hit / {s['answers_miss']} miss "
+            f"({s['answers_size']} stored)"
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.close()
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Token-aware, structure-aware chunker shared by the indexers.
+
+  for chunk in chunk_file("Nursing Fundamentals 2e.txt", max_tokens=350):
+      chunk -> {"text": ..., "tokens": 312,
+                "chapter": "Chapter 3 Safety", "section": "3.2 Basic Concepts"}
+
+The file is read line by line and chunks are yielded as soon as they are
+complete, so a large book is never split in memory all at once. Chunks:
+
+  - are filled with whole paragraphs up to ``max_tokens``; a paragraph that
+    is too long is split at sentence boundaries (and a run-on sentence at
+    word boundaries), never mid-word
+  - never span a chapter or section heading; the current chapter/section
+    titles (OpenStax "Chapter 3 ..." / "3.2 ..." lines) are recorded on
+    every chunk
+  - start with up to ``overlap_tokens`` of trailing sentences from the
+    previous chunk in the same section, so facts on a boundary stay findable
+
+Tokens are counted with tiktoken (cl100k_base) when it is installed and its
+encoding is available offline; otherwise a words * 4/3 estimate is used.
+Either way the count only steers chunk sizes.
+"""
+
+import re
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional
+
+DEFAULT_MAX_TOKENS = 350
+DEFAULT_OVERLAP_TOKENS = 40
+
+# OpenStax-style headings: "Chapter 3 Safety", "CHAPTER 3", "3.2 Basic Concepts"
+CHAPTER_RE = re.compile(r"^(chapter|unit)\s+\d+\b.{0,100}$", re.IGNORECASE)
+SECTION_RE = re.compile(r"^\d{1,2}\.\d{1,2}\s+[A-Z].{0,100}$")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])[\"')\]]*\s+(?=[\"'(\[]?[A-Z0-9])")
+
+
+# ---------------------------------------------------------------------
+# Token counting
+# ---------------------------------------------------------------------
+
+def _load_tiktoken() -> Optional[Callable[[str], int]]:
+    try:
+        import tiktoken
+
+        enc = tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # Not installed, or the BPE file cannot be fetched (offline box)
+        return None
+    return lambda text: len(enc.encode(text, disallowed_special=()))
+
+
+def _estimate_tokens(text: str) -> int:
+    return (len(text.split()) * 4 + 2) // 3
+
+
+_tiktoken_count = _load_tiktoken()
+count_tokens: Callable[[str], int] = _tiktoken_count or _estimate_tokens
+TOKENIZER = "tiktoken/cl100k_base" if _tiktoken_count else "estimate"
+
+
+# ---------------------------------------------------------------------
+# Splitting
+# ---------------------------------------------------------------------
+
+def iter_paragraphs(lines: Iterable[str]) -> Iterator[str]:
+    """
+    Blank-line separated paragraphs (line breaks inside are kept).
+    A heading line is always its own paragraph, even without blank lines.
+    """
+    buf: List[str] = []
+    for line in lines:
+        s = line.strip()
+        if not s:
+            if buf:
+                yield "\n".join(buf)
+                buf = []
+            continue
+        if heading_kind(s):
+            if buf:
+                yield "\n".join(buf)
+                buf = []
+            yield s
+            continue
+        buf.append(s)
+    if buf:
+        yield "\n".join(buf)
+
+
+def heading_kind(paragraph: str) -> Optional[str]:
+    """
+    "chapter", "section" or None for a one-line paragraph.
+    """
+    if len(paragraph) > 120 or paragraph.endswith((".", ",", ";", ":")):
+        return None
+    if CHAPTER_RE.match(paragraph):
+        return "chapter"
+    if SECTION_RE.match(paragraph):
+        return "section"
+    return None
+
+
+def split_sentences(paragraph: str) -> List[str]:
+    return [s for s in _SENTENCE_RE.split(paragraph) if s.strip()]
+
+
+def _split_words(sentence: str, max_tokens: int) -> List[str]:
+    """
+    Last resort for a sentence longer than a chunk: cut at word boundaries.
+    """
+    parts: List[str] = []
+    words: List[str] = []
+    for w in sentence.split():
+        words.append(w)
+        if count_tokens(" ".join(words)) > max_tokens and len(words) > 1:
+            words.pop()
+            parts.append(" ".join(words))
+            words = [w]
+    if words:
+        parts.append(" ".join(words))
+    return parts
+
+
+# ---------------------------------------------------------------------
+# Chunking
+# ---------------------------------------------------------------------
+
+def chunk_lines(
+    lines: Iterable[str],
+    max_tokens: int = DEFAULT_MAX_TOKENS,
+    overlap_tokens: int = DEFAULT_OVERLAP_TOKENS,
+) -> Iterator[dict]:
+    """
+    Yield chunk dicts ({"text", "tokens", "chapter", "section"}) from an
+    iterable of text lines (an open file works).
+    """
+    chapter: Optional[str] = None
+    section: Optional[str] = None
+    # (text, tokens, joiner) pieces of the chunk being filled; paragraphs
+    # are joined with a blank line, sentences of one paragraph with a space
+    pieces: List[tuple] = []
+    used = 0
+    fresh = 0  # tokens that are not overlap from the previous chunk
+
+    def emit() -> Optional[dict]:
+        if not fresh:
+            return None
+        text = "".join((j if i else "") + t for i, (t, _, j) in enumerate(pieces))
+        return {"text": text, "tokens": used, "chapter": chapter, "section": section}
+
+    def overlap_tail() -> List[tuple]:
+        tail: List[tuple] = []
+        n = 0
+        for t, k, _ in reversed(pieces):
+            for sent in reversed(split_sentences(t)):
+                sk = count_tokens(sent)
+                if n + sk > overlap_tokens:
+                    return tail
+                tail.insert(0, (sent, sk, " "))
+                n += sk
+        return tail
+
+    for para in iter_paragraphs(lines):
+        kind = heading_kind(para)
+        if kind:
+            chunk = emit()
+            if chunk:
+                yield chunk
+            pieces, used, fresh = [], 0, 0
+            if kind == "chapter":
+                chapter, section = para, None
+            else:
+                section = para
+            continue
+
+        ptok = count_tokens(para)
+        if ptok <= max_tokens:
+            units = [(para, ptok, "\n\n")]
+        else:
+            units = []
+            for i, sent in enumerate(split_sentences(para)):
+                joiner = "\n\n" if i == 0 else " "
+                stok = count_tokens(sent)
+                if stok <= max_tokens:
+                    units.append((sent, stok, joiner))
+                else:
+                    units.extend(
+                        (w, count_tokens(w), joiner if j == 0 else " ")
+                        for j, w in enumerate(_split_words(sent, max_tokens))
+                    )
+
+        for text, tok, joiner in units:
+            if pieces and used + tok > max_tokens:
+                chunk = emit()
+                if chunk:
+                    yield chunk
+                pieces = overlap_tail() if overlap_tokens > 0 else []
+                used = sum(k for _, k, _ in pieces)
+                fresh = 0
+                if used + tok > max_tokens:
+                    pieces, used = [], 0
+            pieces.append((text, tok, joiner))
+            used += tok
+            fresh += tok
+
+    chunk = emit()
+    if chunk:
+        yield chunk
+
+
+def chunk_file(
+    path: Path,
+    max_tokens: int = DEFAULT_MAX_TOKENS,
+    overlap_tokens: int = DEFAULT_OVERLAP_TOKENS,
+) -> Iterator[dict]:
+    """
+    chunk_lines() over a UTF-8 text file, read lazily.
+    """
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        yield from chunk_lines(f, max_tokens, overlap_tokens)
+
+
+def add_chunker_args(parser, max_tokens: int = DEFAULT_MAX_TOKENS) -> None:
+    """
+    Add the shared --max-tokens / --overlap-tokens flags to an indexer.
+    """
+    parser.add_argument(
+        "--max-tokens",
+        type=int,
+        default=max_tokens,
+        help=f"Target chunk size in tokens (default: {max_tokens})",
+    )
+    parser.add_argument(
+        "--overlap-tokens",
+        type=int,
+        default=DEFAULT_OVERLAP_TOKENS,
+        help=f"Trailing sentences carried into the next chunk (default: {DEFAULT_OVERLAP_TOKENS} tokens)",
+    )
@@ -0,0 +1,851 @@
+#!/usr/bin/env python3
+"""
+Compact on-disk corpus format shared by the indexers and the query tools.
+
+Each corpus <name> lives in an index directory as:
+  <name>.emb.npy        - (N, D) float32/float16/int8 matrix, rows
+                          L2-normalized at build time, opened with
+                          np.load(mmap_mode="r")
+  <name>.scale.npy      - (N,) float32 per-row scales of an int8 matrix
+  <name>.full.npy       - optional float32 copy of a float16/int8 matrix,
+                          only used to re-rank the top hits (citl_quant.py)
+  <name>.chunks.jsonl   - one JSON per line: {"id": int, "text": str, ...}
+  <name>.offsets.npy    - (N + 1,) int64 byte offsets into the .jsonl, so a
+                          chunk is only read (and parsed) when it is a hit
+  <name>.embcache.sqlite - content-hashed embedding cache used by rebuilds
+  <name>.manifest.json  - build metadata: embed model, dim, chunk count,
+                          dtype, build hash, source (see citl_registry.py)
+  <name>.ivf.npz        - optional IVF ANN index (see citl_vector_index.py)
+  <name>.bm25.npz       - BM25 inverted index for hybrid search (citl_bm25.py)
+
+Files are written to a temporary name and swapped in with os.replace, so a
+reader never sees a half-written file. Large sources are written
+incrementally by CorpusWriter: vectors and chunks are appended to
+*.partial files batch by batch, and <name>.progress.json records the last
+committed batch so an interrupted build resumes from there.
+
+Opening a corpus costs a couple of mmap calls regardless of its size.
+"""
+
+import os
+import json
+import time
+import shutil
+import struct
+import hashlib
+import threading
+from pathlib import Path
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from citl_quant import FULL_SUFFIX, RERANK, SCALE_SUFFIX, Int8Matrix, quantize_int8, rerank, rerank_depth
+
+ROOT = Path(__file__).resolve().parent
+INDEX_DIR = ROOT / "index"
+
+EMB_SUFFIX = ".emb.npy"
+CHUNKS_SUFFIX = ".chunks.jsonl"
+OFFSETS_SUFFIX = ".offsets.npy"
+CACHE_SUFFIX = ".embcache.sqlite"
+PARTIAL_SUFFIX = ".partial"
+PROGRESS_SUFFIX = ".progress.json"
+MANIFEST_SUFFIX = ".manifest.json"
+MANIFEST_FORMAT = 1
+
+DTYPES = ("float32", "float16", "int8")
+
+
+def corpus_paths(index_dir: Path, name: str) -> Tuple[Path, Path, Path]:
+    """
+    Return (embeddings, chunks, offsets) paths for a corpus name.
+    """
+    index_dir = Path(index_dir)
+    return (
+        index_dir / f"{name}{EMB_SUFFIX}",
+        index_dir / f"{name}{CHUNKS_SUFFIX}",
+        index_dir / f"{name}{OFFSETS_SUFFIX}",
+    )
+
+
+def quant_paths(index_dir: Path, name: str) -> Tuple[Path, Path]:
+    """
+    Return (int8 scales, float32 re-rank copy) paths for a corpus name.
+    """
+    index_dir = Path(index_dir)
+    return index_dir / f"{name}{SCALE_SUFFIX}", index_dir / f"{name}{FULL_SUFFIX}"
+
+
+def manifest_path(index_dir: Path, name: str) -> Path:
+    return Path(index_dir) / f"{name}{MANIFEST_SUFFIX}"
+
+
+def cache_path(index_dir: Path, name: str) -> Path:
+    return Path(index_dir) / f"{name}{CACHE_SUFFIX}"
+
+
+def corpus_exists(index_dir: Path, name: str) -> bool:
+    emb_path, ch_path, _ = corpus_paths(index_dir, name)
+    return emb_path.exists() and ch_path.exists()
+
+
+# ---------------------------------------------------------------------
+# Writing
+# ---------------------------------------------------------------------
+
+def _tmp_path(path: Path) -> Path:
+    return path.with_name(path.name + ".tmp")
+
+
+def save_npy_atomic(path: Path, arr: np.ndarray) -> None:
+    tmp = _tmp_path(path)
+    with open(tmp, "wb") as f:
+        np.save(f, arr)
+    os.replace(tmp, path)
+
+
+def write_chunks(path: Path, chunks: Iterable[dict]) -> np.ndarray:
+    """
+    Write chunks as JSONL and return the (N + 1,) byte offsets of each line.
+    The caller is responsible for moving the file into place.
+    """
+    offsets = [0]
+    with open(path, "wb") as f:
+        for c in chunks:
+            line = (json.dumps(c, ensure_ascii=False) + "\n").encode("utf-8")
+            f.write(line)
+            offsets.append(offsets[-1] + len(line))
+    return np.asarray(offsets, dtype=np.int64)
+
+
+def scan_offsets(path: Path) -> np.ndarray:
+    """
+    Rebuild line offsets for a chunks .jsonl written without an offsets file.
+    Blank lines are skipped so row i always matches embedding row i.
+    """
+    starts: List[int] = []
+    pos = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if line.strip():
+                starts.append(pos)
+            pos += len(line)
+    # Chunk i is read as [offsets[i], offsets[i + 1]) and stripped, so any
+    # blank lines between records are harmless.
+    return np.asarray(starts + [pos], dtype=np.int64)
+
+
+def write_corpus(
+    index_dir: Path,
+    name: str,
+    emb: np.ndarray,
+    chunks: Sequence[dict],
+    dtype: str = "float32",
+    keep_full: bool = False,
+    meta: Optional[dict] = None,
+) -> Tuple[Path, Path, Path]:
+    """
+    Normalize and save a corpus in the binary layout. Returns its paths.
+    With ``keep_full`` a float16/int8 corpus also keeps a float32 copy for
+    re-ranking. ``meta`` ({"model": ..., "src": ...}) goes into the manifest.
+    """
+    if dtype not in DTYPES:
+        raise ValueError(f"Unsupported dtype {dtype!r}; choose from {DTYPES}")
+    if emb.ndim != 2 or emb.shape[0] != len(chunks):
+        raise ValueError(
+            f"Embeddings shape {emb.shape} does not match {len(chunks)} chunks"
+        )
+
+    index_dir = Path(index_dir)
+    index_dir.mkdir(parents=True, exist_ok=True)
+    emb_path, ch_path, off_path = corpus_paths(index_dir, name)
+    scale_path, full_path = quant_paths(index_dir, name)
+
+    emb = np.asarray(emb, dtype=np.float32)
+    emb = emb / (np.linalg.norm(emb, axis=1, keepdims=True) + 1e-8)
+
+    ch_tmp = _tmp_path(ch_path)
+    offsets = write_chunks(ch_tmp, chunks)
+
+    # Chunks + offsets first, embeddings last: open_corpus checks the row
+    # counts agree, so a reader racing the swap fails loudly, not silently.
+    os.replace(ch_tmp, ch_path)
+    save_npy_atomic(off_path, offsets)
+    if dtype == "int8":
+        codes, scale = quantize_int8(emb)
+        save_npy_atomic(scale_path, scale)
+    else:
+        codes = emb.astype(dtype)
+        _unlink(scale_path)
+    if keep_full and dtype != "float32":
+        save_npy_atomic(full_path, emb)
+    else:
+        _unlink(full_path)
+    save_npy_atomic(emb_path, codes)
+    write_manifest(
+        index_dir, name, meta, emb.shape[0], emb.shape[1], dtype, keep_full and dtype != "float32"
+    )
+    return emb_path, ch_path, off_path
+
+
+def _unlink(path: Path) -> None:
+    if path.exists():
+        path.unlink()
+
+
+# ---------------------------------------------------------------------
+# Manifest
+# ---------------------------------------------------------------------
+
+def build_hash(chunks_path: Path, meta: dict) -> str:
+    """
+    Content hash of a build: the chunk texts plus everything that shapes
+    their vectors (model, dtype, chunking).
+    """
+    h = hashlib.sha256(json.dumps(meta, sort_keys=True).encode("utf-8"))
+    with open(chunks_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()[:16]
+
+
+def write_manifest(
+    index_dir: Path,
+    name: str,
+    meta: Optional[dict],
+    count: int,
+    dim: Optional[int],
+    dtype: str,
+    full: bool,
+) -> dict:
+    """
+    Record what a finished corpus was built from. Written last, after the
+    data files are in place.
+    """
+    meta = dict(meta or {})
+    manifest = {
+        "format": MANIFEST_FORMAT,
+        "name": name,
+        "model": meta.pop("model", None),
+        "dim": dim,
+        "chunks": count,
+        "dtype": dtype,
+        "full": full,
+        "build": build_hash(corpus_paths(index_dir, name)[1], dict(meta, dtype=dtype)),
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "meta": meta,
+    }
+    path = manifest_path(index_dir, name)
+    tmp = _tmp_path(path)
+    tmp.write_text(json.dumps(manifest, indent=2, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, path)
+    return manifest
+
+
+def read_manifest(index_dir: Path, name: str) -> Optional[dict]:
+    """
+    A corpus manifest, or None for corpora built before manifests existed.
+    """
+    path = manifest_path(index_dir, name)
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return None
+    except ValueError as e:
+        raise RuntimeError(f"Corrupt manifest {path}: {e}")
+
+
+# ---------------------------------------------------------------------
+# Incremental writing
+# ---------------------------------------------------------------------
+
+# Fixed .npy header size for growable matrices: room for any row count, so
+# the real shape can be patched in place once the build is done.
+NPY_HEADER_BYTES = 128
+
+
+def npy_header(dtype: str, rows: int, dim: Optional[int]) -> bytes:
+    """
+    A version 1.0 .npy header for a C-order (rows, dim) matrix, or a (rows,)
+    vector when ``dim`` is None, padded to exactly NPY_HEADER_BYTES.
+    """
+    shape = "(%d,)" % rows if dim is None else "(%d, %d)" % (rows, dim)
+    desc = "{'descr': '%s', 'fortran_order': False, 'shape': %s, }" % (
+        np.dtype(dtype).str, shape,
+    )
+    hlen = NPY_HEADER_BYTES - 10
+    if len(desc) + 1 > hlen:
+        raise ValueError(f"shape {shape} does not fit the reserved .npy header")
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", hlen) + (desc.ljust(hlen - 1) + "\n").encode("latin1")
+
+
+class CorpusWriter:
+    """
+    Append-only corpus builder with bounded memory and resumable progress.
+
+    writer = CorpusWriter(index_dir, "nursing", meta={...})
+    for chunks, vecs in batches[writer.count:]:
+        writer.append(chunks, vecs)     # durable once this returns
+    writer.finish()                     # swap the finished files in
+
+    ``meta`` describes the build (source file, chunking, model...). A new
+    writer with the same meta, dtype and ``keep_full`` picks up after the
+    last committed batch; anything else starts over.
+
+    With ``extend`` a finished corpus is continued instead of replaced: its
+    files are copied to the partial files and new batches go after its
+    rows, so adding to a corpus costs embedding only the new chunks.
+    Readers keep the old version until finish().
+    """
+
+    def __init__(
+        self,
+        index_dir: Path,
+        name: str,
+        dtype: str = "float32",
+        meta: Optional[dict] = None,
+        resume: bool = True,
+        keep_full: bool = False,
+        extend: bool = False,
+    ):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported dtype {dtype!r}; choose from {DTYPES}")
+        self.index_dir = Path(index_dir)
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        self.name = name
+        self.dtype = dtype
+        self.keep_full = keep_full and dtype != "float32"
+        self.meta = dict(meta or {}, dtype=dtype, keep_full=self.keep_full)
+
+        self.paths = corpus_paths(self.index_dir, name)
+        self.emb_part, self.ch_part, self.off_part = (
+            p.with_name(p.name + PARTIAL_SUFFIX) for p in self.paths
+        )
+        self.quant_paths = quant_paths(self.index_dir, name)
+        self.scale_part, self.full_part = (
+            p.with_name(p.name + PARTIAL_SUFFIX) for p in self.quant_paths
+        )
+        self.progress_path = self.index_dir / f"{name}{PROGRESS_SUFFIX}"
+
+        # Growable .npy files: (partial path, dtype, is a (rows,) vector)
+        self._arrays = [(self.emb_part, dtype, False)]
+        if dtype == "int8":
+            self._arrays.append((self.scale_part, "float32", True))
+        if self.keep_full:
+            self._arrays.append((self.full_part, "float32", False))
+
+        state = self._load_progress() if resume else None
+        if state is None:
+            for p in (self.emb_part, self.ch_part, self.off_part, self.scale_part,
+                      self.full_part, self.progress_path):
+                _unlink(p)
+            if extend:
+                state = self._seed_from_corpus()
+        if state is None:
+            self.count, self.dim, self.ch_bytes = 0, None, 0
+            with open(self.off_part, "wb") as f:
+                f.write(np.int64(0).tobytes())
+        else:
+            self.count, self.dim, self.ch_bytes = state["chunks"], state["dim"], state["chunks_bytes"]
+            # Drop anything written after the last commit
+            if self.dim is not None:
+                for path, dt, vector in self._arrays:
+                    self._truncate(path, self._offset(dt, vector, self.count))
+            self._truncate(self.ch_part, self.ch_bytes)
+            self._truncate(self.off_part, (self.count + 1) * 8)
+
+        self._files = [
+            open(path, "r+b" if path.exists() else "w+b") for path, _, _ in self._arrays
+        ]
+        self._ch = open(self.ch_part, "ab")
+        self._off = open(self.off_part, "ab")
+
+    @property
+    def resumed(self) -> bool:
+        return self.count > 0
+
+    def _offset(self, dtype: str, vector: bool, row: int) -> int:
+        width = 1 if vector else self.dim
+        return NPY_HEADER_BYTES + row * width * np.dtype(dtype).itemsize
+
+    @staticmethod
+    def _truncate(path: Path, size: int) -> None:
+        with open(path, "r+b") as f:
+            f.truncate(size)
+
+    def _load_progress(self) -> Optional[dict]:
+        if not self.progress_path.exists():
+            return None
+        try:
+            state = json.loads(self.progress_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if state.get("meta") != self.meta:
+            return None
+        if not all(p.exists() for p in (self.ch_part, self.off_part)):
+            return None
+        if state.get("dim") is not None and not all(p.exists() for p, _, _ in self._arrays):
+            return None
+        return state
+
+    def _seed_from_corpus(self) -> Optional[dict]:
+        """
+        Copy the finished corpus into the partial files; returns its progress
+        state, or None if there is no corpus yet.
+        """
+        emb_path, ch_path, off_path = self.paths
+        if not emb_path.exists() or not ch_path.exists():
+            return None
+        finals = dict(zip((self.emb_part, self.scale_part, self.full_part), (emb_path, *self.quant_paths)))
+        rows, dim = None, None
+        copies = [(ch_path, self.ch_part)]
+        for part, dt, vector in self._arrays:
+            final = finals[part]
+            try:
+                with open(final, "rb") as f:
+                    version = np.lib.format.read_magic(f)
+                    shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+                    header = f.tell()
+            except (OSError, ValueError) as e:
+                raise ValueError(f"Cannot extend corpus '{self.name}': {e}") from None
+            if version != (1, 0) or header != NPY_HEADER_BYTES or fortran or dtype != np.dtype(dt):
+                raise ValueError(
+                    f"Cannot extend corpus '{self.name}': {final.name} was not written by "
+                    f"CorpusWriter as {dt}; rebuild it"
+                )
+            if rows is not None and shape[0] != rows:
+                raise ValueError(f"Cannot extend corpus '{self.name}': {final.name} has {shape[0]} rows, not {rows}")
+            rows = shape[0]
+            if not vector:
+                dim = shape[1]
+            copies.append((final, part))
+
+        if not rows:
+            return None
+        offsets = np.load(off_path) if off_path.exists() else scan_offsets(ch_path)
+        if offsets.shape[0] - 1 != rows:
+            raise ValueError(
+                f"Cannot extend corpus '{self.name}': {rows} vectors but {offsets.shape[0] - 1} chunks"
+            )
+        for src, dst in copies:
+            shutil.copyfile(src, dst)
+        with open(self.off_part, "wb") as f:
+            f.write(offsets.astype(np.int64).tobytes())
+        return {"chunks": int(rows), "dim": int(dim), "chunks_bytes": int(offsets[-1])}
+
+    def _commit(self) -> None:
+        for f in (*self._files, self._ch, self._off):
+            f.flush()
+            os.fsync(f.fileno())
+        state = {
+            "meta": self.meta,
+            "chunks": self.count,
+            "dim": self.dim,
+            "chunks_bytes": self.ch_bytes,
+        }
+        tmp = _tmp_path(self.progress_path)
+        tmp.write_text(json.dumps(state), encoding="utf-8")
+        os.replace(tmp, self.progress_path)
+
+    def _write_headers(self, rows: int) -> None:
+        for f, (_, dt, vector) in zip(self._files, self._arrays):
+            f.seek(0)
+            f.write(npy_header(dt, rows, None if vector else (self.dim or 0)))
+
+    def append(self, chunks: Sequence[dict], vecs: np.ndarray) -> None:
+        """
+        Append one batch (normalized, and quantized for int8, here) and
+        commit it.
+        """
+        vecs = np.asarray(vecs, dtype=np.float32)
+        if vecs.ndim != 2 or vecs.shape[0] != len(chunks):
+            raise ValueError(f"Embeddings shape {vecs.shape} does not match {len(chunks)} chunks")
+        if not len(chunks):
+            return
+        if self.dim is None:
+            self.dim = int(vecs.shape[1])
+            self._write_headers(0)
+        elif vecs.shape[1] != self.dim:
+            raise ValueError(f"Embedding dim changed from {self.dim} to {vecs.shape[1]}")
+
+        vecs = vecs / (np.linalg.norm(vecs, axis=1, keepdims=True) + 1e-8)
+        if self.dtype == "int8":
+            blocks = list(quantize_int8(vecs))
+        else:
+            blocks = [vecs.astype(self.dtype)]
+        if self.keep_full:
+            blocks.append(vecs)
+        for f, (_, dt, vector), block in zip(self._files, self._arrays, blocks):
+            f.seek(self._offset(dt, vector, self.count))
+            f.write(np.ascontiguousarray(block, dtype=dt).tobytes())
+
+        ends = []
+        for c in chunks:
+            line = (json.dumps(c, ensure_ascii=False) + "\n").encode("utf-8")
+            self._ch.write(line)
+            self.ch_bytes += len(line)
+            ends.append(self.ch_bytes)
+        self._off.write(np.asarray(ends, dtype=np.int64).tobytes())
+
+        self.count += len(chunks)
+        self._commit()
+
+    def close(self) -> None:
+        """
+        Close the partial files, keeping them (and the progress file) for
+        a later resume.
+        """
+        for f in (*self._files, self._ch, self._off):
+            f.close()
+
+    def finish(self) -> Tuple[Path, Path, Path]:
+        """
+        Patch the real row count into the .npy headers and swap the files
+        in (chunks + offsets first, embeddings last, as in write_corpus).
+        """
+        self._write_headers(self.count)
+        self._commit()
+        self.close()
+
+        emb_path, ch_path, off_path = self.paths
+        offsets = np.fromfile(self.off_part, dtype=np.int64)
+        os.replace(self.ch_part, ch_path)
+        save_npy_atomic(off_path, offsets)
+        for part, final in zip((self.scale_part, self.full_part), self.quant_paths):
+            if any(part == p for p, _, _ in self._arrays):
+                os.replace(part, final)
+            else:
+                _unlink(final)
+        os.replace(self.emb_part, emb_path)
+        meta = {k: v for k, v in self.meta.items() if k not in ("dtype", "keep_full")}
+        write_manifest(self.index_dir, self.name, meta, self.count, self.dim, self.dtype, self.keep_full)
+        self.off_part.unlink()
+        self.progress_path.unlink()
+        return self.paths
+
+
+# ---------------------------------------------------------------------
+# Reading
+# ---------------------------------------------------------------------
+
+class ChunkStore:
+    """
+    Lazy, list-like view over a chunks .jsonl file.
+
+    store[i] seeks to the i-th line and parses only that chunk, so existing
+    code written against a list of dicts (chunks[i]["text"]) keeps working.
+    With ``preload`` the raw file is read into memory once and no handle
+    stays open, so an indexer can replace the file underneath (Windows
+    refuses to replace a file that is open).
+    """
+
+    def __init__(self, path: Path, offsets: np.ndarray, preload: bool = False):
+        self.path = Path(path)
+        self.offsets = offsets
+        self._fh = None
+        self._data = self.path.read_bytes() if preload else None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return max(0, len(self.offsets) - 1)
+
+    def __getitem__(self, i: int) -> dict:
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(f"chunk index {i} out of range")
+        lo, hi = int(self.offsets[i]), int(self.offsets[i + 1])
+        if self._data is not None:
+            return json.loads(self._data[lo:hi].decode("utf-8").strip())
+        with self._lock:
+            if self._fh is None:
+                self._fh = open(self.path, "rb")
+            self._fh.seek(lo)
+            raw = self._fh.read(hi - lo)
+        return json.loads(raw.decode("utf-8").strip())
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def texts(self, idx: Iterable[int]) -> List[str]:
+        return [self[int(i)]["text"] for i in idx]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+
+
+class FileChangedError(RuntimeError):
+    """
+    A file read on demand was replaced since the corpus was opened.
+    """
+
+
+class NpyRows:
+    """
+    Rows of a 2-D .npy file read on demand: rows[ids] opens the file, reads
+    just those rows and closes it again.
+
+    Used for the float32 re-rank copy of a corpus opened without mmap: only
+    a few dozen rows are read per query, loading it would cost more RAM
+    than the quantized matrix it backs, and holding no handle lets an
+    indexer replace the file. Reads raise FileChangedError once it has
+    been replaced.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+            if fortran or len(shape) != 2:
+                raise ValueError(f"{self.path.name} is not a C-ordered 2-D array")
+            self.header = f.tell()
+            st = os.fstat(f.fileno())
+        self.shape = tuple(shape)
+        self.dtype = dtype
+        self.ndim = 2
+        self.row_bytes = shape[1] * dtype.itemsize
+        self._sig = (st.st_size, st.st_mtime_ns)
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __getitem__(self, ids) -> np.ndarray:
+        ids = np.atleast_1d(np.asarray(ids, dtype=np.int64))
+        out = np.empty((ids.shape[0], self.shape[1]), dtype=self.dtype)
+        with open(self.path, "rb") as f:
+            st = os.fstat(f.fileno())
+            if (st.st_size, st.st_mtime_ns) != self._sig:
+                raise FileChangedError(f"{self.path.name} changed since it was opened")
+            for j, i in enumerate(ids.tolist()):
+                if not 0 <= i < self.shape[0]:
+                    raise IndexError(f"row {i} out of range")
+                f.seek(self.header + i * self.row_bytes)
+                out[j] = np.frombuffer(f.read(self.row_bytes), dtype=self.dtype)
+        return out
+
+
+class Corpus:
+    """
+    An opened corpus: memory-mapped embeddings plus a lazy chunk store.
+
+    ``index`` is the vector search backend (IVF if one was built, else
+    flat) and ``lexical`` the BM25 index (None without one); both are
+    opened on first use. search() fuses the two when given the query text.
+    ``emb`` may be float16 or an Int8Matrix; ``full`` is then the
+    memory-mapped float32 copy (if one was kept) that re-ranks the top hits,
+    or an NpyRows reader of it for a corpus opened without mmap.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        emb: np.ndarray,
+        chunks: ChunkStore,
+        index_dir: Optional[Path] = None,
+        full: Optional[np.ndarray] = None,
+        manifest: Optional[dict] = None,
+    ):
+        self.name = name
+        self.emb = emb
+        self.chunks = chunks
+        self.index_dir = index_dir
+        self.full = full
+        self.manifest = manifest
+        self._index = None
+        self._lexical = False
+
+    def __len__(self) -> int:
+        return self.emb.shape[0]
+
+    @property
+    def index(self):
+        if self._index is None:
+            from citl_vector_index import FlatIndex, open_index
+
+            if self.index_dir is None:
+                self._index = FlatIndex(self.emb)
+            else:
+                self._index = open_index(self.index_dir, self.name, self.emb)
+        return self._index
+
+    @property
+    def lexical(self):
+        if self._lexical is False:
+            from citl_bm25 import bm25_path, load_bm25
+
+            self._lexical = None
+            if self.index_dir is not None:
+                ch_path = corpus_paths(self.index_dir, self.name)[1]
+                self._lexical = load_bm25(bm25_path(self.index_dir, self.name), ch_path)
+        return self._lexical
+
+    @property
+    def reranks(self) -> bool:
+        return self.full is not None and RERANK
+
+    def rerank(self, qvec: np.ndarray, ids: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Re-score candidate rows at full precision and keep the best k.
+        """
+        try:
+            return rerank(self.full, ids, qvec, k)
+        except FileChangedError:
+            # Rebuilt under a resident server: stored precision until it reloads
+            return rerank(self.emb, ids, qvec, k)
+
+    def vector_search(self, qvec: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        if not self.reranks:
+            return self.index.search(qvec, k)
+        ids, _ = self.index.search(qvec, rerank_depth(k))
+        return self.rerank(qvec, ids, k)
+
+    def search(self, qvec: np.ndarray, k: int, text: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k rows for a query vector; with ``text`` and a BM25 index
+        (and CITL_HYBRID not "0") vector and BM25 rankings are fused with
+        RRF. Returns (rows, scores), best first.
+        """
+        from citl_bm25 import FUSE_DEPTH, HYBRID, rrf_fuse
+
+        if text is None or not HYBRID or self.lexical is None:
+            return self.vector_search(qvec, k)
+        depth = max(k, FUSE_DEPTH)
+        vec_ids, _ = self.vector_search(qvec, depth)
+        lex_ids, _ = self.lexical.search(text, depth)
+        return rrf_fuse([vec_ids, lex_ids], k)
+
+    def search_batch(
+        self, qmat: np.ndarray, k: int, texts: Optional[Sequence[str]] = None
+    ) -> List[np.ndarray]:
+        """
+        search() for many queries: one Q @ E.T for the vector side, then a
+        per-query BM25 lookup and fusion. Returns best-first rows per query.
+        """
+        from citl_bm25 import FUSE_DEPTH, HYBRID, rrf_fuse
+
+        hybrid = texts is not None and HYBRID and self.lexical is not None
+        depth = max(k, FUSE_DEPTH) if hybrid else k
+        if self.reranks:
+            cand, _ = self.index.search_batch(qmat, rerank_depth(depth))
+            vec_ids = [self.rerank(q, ids, depth)[0] for q, ids in zip(qmat, cand)]
+        else:
+            vec_ids, _ = self.index.search_batch(qmat, depth)
+        if not hybrid:
+            return [np.asarray(ids) for ids in vec_ids]
+        return [
+            rrf_fuse([np.asarray(ids), self.lexical.search(text, depth)[0]], k)[0]
+            for ids, text in zip(vec_ids, texts)
+        ]
+
+    def close(self) -> None:
+        self.chunks.close()
+
+
+def open_corpus(index_dir: Path, name: str, mmap: bool = True) -> Corpus:
+    """
+    Open a corpus written by write_corpus (or by an older indexer that
+    only wrote .emb.npy + .chunks.jsonl; offsets are then rebuilt by a scan).
+    With ``mmap`` False the files are read into RAM (the float32 re-rank
+    copy excepted: its rows are read on demand) and no file is left open or
+    mapped, so they can be rebuilt while the corpus is in use.
+    """
+    emb_path, ch_path, off_path = corpus_paths(index_dir, name)
+    if not emb_path.exists() or not ch_path.exists():
+        raise FileNotFoundError(
+            f"Corpus files not found for '{name}': {emb_path}, {ch_path}"
+        )
+
+    mode = "r" if mmap else None
+    emb = np.load(emb_path, mmap_mode=mode)
+    scale_path, full_path = quant_paths(index_dir, name)
+    if emb.dtype == np.int8:
+        if not scale_path.exists():
+            raise RuntimeError(f"Corpus '{name}' is int8 but {scale_path.name} is missing")
+        emb = Int8Matrix(emb, np.load(scale_path, mmap_mode=mode))
+    # The float32 copy is only read for re-ranked rows: mapped, or read row
+    # by row when nothing may stay open (never loaded whole)
+    full = None
+    if emb.dtype != np.float32 and full_path.exists():
+        full = np.load(full_path, mmap_mode="r") if mmap else NpyRows(full_path)
+        if full.shape != emb.shape:
+            print(f"[WARN] {full_path.name} does not match {emb_path.name}; not re-ranking")
+            full = None
+
+    if off_path.exists():
+        offsets = np.load(off_path)
+    else:
+        offsets = scan_offsets(ch_path)
+
+    chunks = ChunkStore(ch_path, offsets, preload=not mmap)
+    if len(chunks) != emb.shape[0]:
+        raise RuntimeError(
+            f"Corpus '{name}' is inconsistent: {emb.shape[0]} vectors "
+            f"but {len(chunks)} chunks"
+        )
+    return Corpus(name, emb, chunks, Path(index_dir), full, read_manifest(index_dir, name))
+
+
+# ---------------------------------------------------------------------
+# Legacy JSON conversion
+# ---------------------------------------------------------------------
+
+def convert_json(
+    json_path: Path,
+    index_dir: Path,
+    name: Optional[str] = None,
+    dtype: str = "float32",
+    keep_full: bool = False,
+    model: Optional[str] = None,
+) -> Tuple[Path, Path, Path]:
+    """
+    Convert a legacy *_embeddings.json file ({"embeddings": [...],
+    "chunks": [...]}) to the binary layout. The JSON does not record its
+    embedding model, so pass the one it was built with as ``model``.
+    """
+    json_path = Path(json_path)
+    if name is None:
+        name = legacy_name(json_path)
+
+    data = json.loads(json_path.read_text(encoding="utf-8"))
+    emb = np.asarray(data["embeddings"], dtype=np.float32)
+    chunks = data["chunks"]
+    meta = {"model": model, "src": str(json_path.resolve())}
+    return write_corpus(index_dir, name, emb, chunks, dtype=dtype, keep_full=keep_full, meta=meta)
+
+
+def legacy_name(json_path: Path) -> str:
+    """
+    'nursing_embeddings.json' -> 'nursing'
+    """
+    stem = Path(json_path).stem
+    if stem.endswith("_embeddings"):
+        stem = stem[: -len("_embeddings")]
+    return stem
+
+
+def add_storage_args(parser) -> None:
+    """
+    Add the shared --dtype / --no-full flags to an indexer.
+    """
+    parser.add_argument(
+        "--dtype",
+        choices=DTYPES,
+        default="float32",
+        help="On-disk vector dtype: float32, float16 (2x smaller) or int8 "
+        "with per-vector scales (4x smaller) (default: float32)",
+    )
+    parser.add_argument(
+        "--no-full",
+        action="store_true",
+        help="With --dtype float16/int8: skip the float32 copy used to "
+        "re-rank the top hits (halves disk use, ranking becomes approximate)",
+    )
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Shared batched embedding engine for the CITL indexers.
+
+Sends many chunks per Ollama /api/embed request (the "input" field accepts a
+list) and keeps a bounded number of requests in flight on a thread pool.
+Results always come back in input order as row-normalized float32 vectors.
+
+With an EmbedCache, every chunk is keyed by sha256(model + text) and only
+new or changed chunks are sent to Ollama, so small edits rebuild quickly.
+
+Tuning knobs (CLI flags on the indexers override these):
+  CITL_EMBED_BATCH    - chunks per request (default: 32)
+  CITL_EMBED_WORKERS  - concurrent requests in flight (default: 4)
+  FACTBOOK_EMBED      - embed model for all corpora (default: nomic-embed-text)
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, Optional, Sequence, Tuple
+
+import numpy as np
+
+from citl_ollama import OllamaClient, get_client
+
+# The one embed model of every indexer and query tool: corpora embedded
+# with another model are refused at query time (see citl_registry.py)
+EMBED_MODEL = os.environ.get("FACTBOOK_EMBED", "nomic-embed-text")
+
+DEFAULT_BATCH = int(os.environ.get("CITL_EMBED_BATCH", "32"))
+DEFAULT_WORKERS = int(os.environ.get("CITL_EMBED_WORKERS", "4"))
+
+
+# ---------------------------------------------------------------------
+# Persistent embedding cache
+# ---------------------------------------------------------------------
+
+def chunk_key(model: str, text: str) -> str:
+    """
+    Content hash identifying one chunk's embedding under one model.
+    """
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbedCache:
+    """
+    SQLite store of normalized float32 vectors keyed by chunk_key().
+
+    One cache file per corpus (e.g. index/nursing.embcache.sqlite), so
+    prune() after a build drops exactly the chunks that no longer exist.
+    """
+
+    _LOOKUP_BATCH = 500
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.path))
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, dim INTEGER NOT NULL, vec BLOB NOT NULL)"
+        )
+        self.conn.commit()
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, np.ndarray]:
+        found: Dict[str, np.ndarray] = {}
+        uniq = list(dict.fromkeys(keys))
+        for i in range(0, len(uniq), self._LOOKUP_BATCH):
+            part = uniq[i : i + self._LOOKUP_BATCH]
+            marks = ",".join("?" * len(part))
+            rows = self.conn.execute(
+                f"SELECT key, dim, vec FROM embeddings WHERE key IN ({marks})", part
+            )
+            for key, dim, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32, count=dim)
+        return found
+
+    def put_many(self, items: Iterable[Tuple[str, np.ndarray]]) -> None:
+        rows = [
+            (key, int(vec.shape[0]), np.asarray(vec, dtype=np.float32).tobytes())
+            for key, vec in items
+        ]
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, dim, vec) VALUES (?, ?, ?)", rows
+        )
+        self.conn.commit()
+
+    def prune(self, keep: Iterable[str]) -> int:
+        """
+        Delete every entry whose key is not in ``keep``. Returns the count.
+        """
+        cur = self.conn.cursor()
+        cur.execute("CREATE TEMP TABLE IF NOT EXISTS keep_keys (key TEXT PRIMARY KEY)")
+        cur.execute("DELETE FROM keep_keys")
+        cur.executemany(
+            "INSERT OR IGNORE INTO keep_keys (key) VALUES (?)", ((k,) for k in keep)
+        )
+        cur.execute("DELETE FROM embeddings WHERE key NOT IN (SELECT key FROM keep_keys)")
+        dropped = cur.rowcount
+        self.conn.commit()
+        return dropped
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+# ---------------------------------------------------------------------
+# Engine
+# ---------------------------------------------------------------------
+
+class EmbedEngine:
+    """
+    Batched, concurrent embedder.
+
+    engine = EmbedEngine(batch_size=64, workers=4)
+    emb = engine.embed(texts)       # (N, D) float32, rows normalized
+    print(engine.report())          # throughput in chunks/sec
+    """
+
+    def __init__(
+        self,
+        model: str = EMBED_MODEL,
+        batch_size: int = DEFAULT_BATCH,
+        workers: int = DEFAULT_WORKERS,
+        timeout: float = 300.0,
+        client: Optional[OllamaClient] = None,
+    ):
+        self.model = model
+        self.client = client or get_client()
+        self.batch_size = max(1, int(batch_size))
+        self.workers = max(1, int(workers))
+        self.timeout = timeout
+
+        self.chunks_done = 0
+        self.requests_done = 0
+        self.seconds = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    # -- single request ------------------------------------------------
+
+    def embed_batch(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        Embed one batch with a single HTTP request. Returns (len(texts), D).
+        """
+        return self.client.embed(texts, self.model, self.timeout)
+
+    # -- pipelined ------------------------------------------------------
+
+    def embed_batches(
+        self,
+        batches: Iterable[Sequence[str]],
+        on_batch: Optional[Callable[[int], None]] = None,
+    ) -> Iterator[np.ndarray]:
+        """
+        Embed an iterable of batches, yielding one (n, D) array per batch in
+        input order. At most ``workers`` requests are in flight, and the
+        input iterable is consumed lazily, so it may be a generator.
+        """
+        # Time accumulates across calls (ingestion embeds group by group)
+        t0 = time.perf_counter() - self.seconds
+        pending: deque = deque()
+        it = iter(batches)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            try:
+                while True:
+                    while len(pending) < self.workers:
+                        batch = next(it, None)
+                        if batch is None:
+                            break
+                        pending.append((len(batch), pool.submit(self.embed_batch, batch)))
+                    if not pending:
+                        break
+
+                    n, fut = pending.popleft()
+                    arr = fut.result()
+                    self.chunks_done += n
+                    self.requests_done += 1
+                    self.seconds = time.perf_counter() - t0
+                    if on_batch is not None:
+                        on_batch(n)
+                    yield arr
+            finally:
+                for _, fut in pending:
+                    fut.cancel()
+
+    def embed(
+        self,
+        texts: Sequence[str],
+        on_batch: Optional[Callable[[int], None]] = None,
+        cache: Optional[EmbedCache] = None,
+    ) -> np.ndarray:
+        """
+        Embed every text and return a single (N, D) float32 matrix.
+
+        With a cache, only texts whose chunk_key() is missing are sent to
+        Ollama (each distinct text once); the new vectors are stored back.
+        """
+        if cache is not None:
+            return self._embed_cached(texts, on_batch, cache)
+
+        batches = (
+            texts[i : i + self.batch_size] for i in range(0, len(texts), self.batch_size)
+        )
+        parts = list(self.embed_batches(batches, on_batch=on_batch))
+        if not parts:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.concatenate(parts, axis=0)
+
+    def _embed_cached(
+        self,
+        texts: Sequence[str],
+        on_batch: Optional[Callable[[int], None]],
+        cache: EmbedCache,
+    ) -> np.ndarray:
+        keys = [chunk_key(self.model, t) for t in texts]
+        found = cache.get_many(keys)
+
+        todo: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in todo:
+                todo[key] = text
+
+        # Repeated texts are embedded once and count as reused
+        reused = len(texts) - len(todo)
+        self.cache_hits += reused
+        self.cache_misses += len(todo)
+        if on_batch is not None and reused:
+            on_batch(reused)
+
+        if todo:
+            todo_keys = list(todo)
+            fresh = self.embed([todo[k] for k in todo_keys], on_batch=on_batch)
+            cache.put_many(zip(todo_keys, fresh))
+            found.update(zip(todo_keys, fresh))
+
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([found[k] for k in keys], axis=0).astype(np.float32, copy=False)
+
+    # -- reporting -----------------------------------------------------
+
+    @property
+    def rate(self) -> float:
+        return self.chunks_done / self.seconds if self.seconds > 0 else 0.0
+
+    def report(self) -> str:
+        msg = (
+            f"[INFO] Embedded {self.chunks_done} chunks in {self.seconds:.1f}s "
+            f"({self.rate:.1f} chunks/sec, {self.requests_done} requests, "
+            f"batch={self.batch_size}, workers={self.workers})"
+        )
+        if self.cache_hits or self.cache_misses:
+            msg += f"; cache: {self.cache_hits} reused, {self.cache_misses} new"
+        return msg
+
+
+def add_engine_args(parser) -> None:
+    """
+    Add the shared --batch-size / --workers / --no-cache flags to an indexer.
+    """
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH,
+        help=f"Chunks per /api/embed request (default: {DEFAULT_BATCH})",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f"Embedding requests kept in flight (default: {DEFAULT_WORKERS})",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Ignore the per-corpus embedding cache and re-embed every chunk",
+    )
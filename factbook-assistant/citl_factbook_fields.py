@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Country -> section -> field index over factbook.txt.
+
+Parsed once (build_factbook_index.py writes index/factbook.fields.json), so
+shortcut queries like capital:laos or "life expectancy:mexico" become a
+dictionary lookup plus one seek into factbook.txt instead of a DOTALL regex
+scan of the whole file. Each field records its byte span in factbook.txt;
+values are read from the text only when asked for.
+
+Expected layout (CIA World Factbook text export):
+
+  Laos
+  Introduction
+  Background: ...
+  Geography
+  Location: Southeastern Asia, northeast of Thailand, west of Vietnam
+  Area: total: 236,800 sq km
+  land: 230,800 sq km
+  Capital
+  name: Vientiane
+
+A country starts at a line without a colon that is followed by a section
+heading. Capitalized "Label: value" lines (or bare "Label" lines) start a
+field; lower-case "sub: value" lines and wrapped text continue it.
+"""
+
+import re
+import json
+import difflib
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+ROOT = Path(__file__).resolve().parent
+TXT_PATH = ROOT / "factbook.txt"
+FIELDS_PATH = ROOT / "index" / "factbook.fields.json"
+
+SECTIONS = {
+    "introduction",
+    "geography",
+    "people and society",
+    "environment",
+    "government",
+    "economy",
+    "energy",
+    "communications",
+    "transportation",
+    "military and security",
+    "space",
+    "terrorism",
+    "transnational issues",
+}
+
+# Shortcut field key -> Factbook field labels to try, in order. A label
+# ending in "*" matches any field that starts with it.
+FIELD_LABELS: Dict[str, List[str]] = {
+    "capital": ["capital"],
+    "population": ["population"],
+    "gdp": ["real gdp (purchasing power parity)", "gdp (purchasing power parity)", "gdp*", "real gdp*"],
+    "internet code": ["internet country code"],
+    "currency": ["currency*", "exchange rates"],
+    "neighbors": ["land boundaries", "border countries*"],
+    "languages": ["languages", "language*"],
+    "religion": ["religions", "religion*"],
+    "area": ["area"],
+    "government": ["government type"],
+    "location": ["location"],
+    "life expectancy": ["life expectancy at birth", "life expectancy*"],
+}
+
+COUNTRY_ALIASES = {
+    "usa": "united states",
+    "us": "united states",
+    "u.s.": "united states",
+    "america": "united states",
+    "uk": "united kingdom",
+    "britain": "united kingdom",
+    "great britain": "united kingdom",
+    "north korea": "korea, north",
+    "south korea": "korea, south",
+    "myanmar": "burma",
+    "ivory coast": "cote d'ivoire",
+    "czech republic": "czechia",
+}
+
+_FIELD_RE = re.compile(r"^([A-Z][^:]{0,80}):(.*)$")
+_SUBFIELD_RE = re.compile(r"^[a-z][^:]{0,80}:")
+
+
+def normalize_name(name: str) -> str:
+    return re.sub(r"\s+", " ", re.sub(r"[^\w\s,'.()-]", " ", name.lower())).strip()
+
+
+# ---------------------------------------------------------------------
+# Parsing
+# ---------------------------------------------------------------------
+
+def _lines_with_offsets(raw: bytes):
+    pos = 0
+    for line in raw.splitlines(keepends=True):
+        text = line.decode("utf-8", errors="ignore").rstrip("\r\n")
+        yield text, pos, pos + len(line)
+        pos += len(line)
+
+
+def parse_factbook(path: Path = TXT_PATH) -> Tuple[Dict[str, Dict[str, Dict[str, list]]], Dict[str, str]]:
+    """
+    Parse factbook.txt into ({country: {section: {field: [start, end]}}},
+    {country: display name}) where [start, end) is the field's byte span
+    (label included). Country, section and field keys are lower case.
+    """
+    raw = Path(path).read_bytes()
+    lines = list(_lines_with_offsets(raw))
+
+    def next_nonblank(i: int) -> str:
+        for j in range(i + 1, min(i + 4, len(lines))):
+            if lines[j][0].strip():
+                return lines[j][0].strip()
+        return ""
+
+    countries: Dict[str, Dict[str, Dict[str, list]]] = {}
+    names: Dict[str, str] = {}
+    country: Optional[Dict[str, Dict[str, list]]] = None
+    section: Optional[str] = None
+    field: Optional[list] = None
+
+    for i, (text, start, end) in enumerate(lines):
+        s = text.strip()
+        if not s:
+            continue
+        low = s.lower()
+
+        if low in SECTIONS:
+            if country is not None:
+                section = low
+                country.setdefault(section, {})
+                field = None
+            continue
+
+        # A colon-free line right before a section heading starts a new
+        # country, unless it is wrapped text before the next section of the
+        # current one (then the heading would be one we have not seen yet).
+        nxt = next_nonblank(i).lower()
+        if ":" not in s and len(s) <= 80 and nxt in SECTIONS:
+            if country is None or nxt == "introduction" or nxt in country:
+                key = normalize_name(s)
+                country = countries.setdefault(key, {})
+                names.setdefault(key, s)
+                section = None
+                field = None
+                continue
+
+        if country is None or section is None:
+            continue
+
+        m = _FIELD_RE.match(s)
+        starts_field = m is not None and not _SUBFIELD_RE.match(s)
+        bare_label = (
+            m is None
+            and s[:1].isupper()
+            and len(s) <= 60
+            and _SUBFIELD_RE.match(next_nonblank(i)) is not None
+        )
+
+        if starts_field or bare_label:
+            label = (m.group(1) if m else s).strip().lower()
+            field = [start, end]
+            country[section].setdefault(label, field)
+        elif field is not None:
+            # sub-field ("land: ...") or wrapped text: extend current field
+            field[1] = end
+
+    return countries, names
+
+
+def build_field_index(txt_path: Path = TXT_PATH, out_path: Path = FIELDS_PATH) -> dict:
+    """
+    Parse factbook.txt and write the field index JSON next to the embeddings.
+    """
+    st = Path(txt_path).stat()
+    countries, names = parse_factbook(txt_path)
+    data = {
+        "source_size": st.st_size,
+        "source_mtime_ns": st.st_mtime_ns,
+        "countries": countries,
+        "names": names,
+    }
+    out_path = Path(out_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out_path.with_name(out_path.name + ".tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    tmp.replace(out_path)
+    return data
+
+
+# ---------------------------------------------------------------------
+# Lookup
+# ---------------------------------------------------------------------
+
+class FieldIndex:
+    """
+    Loaded field index with fuzzy country matching and lazy value reads.
+    """
+
+    def __init__(self, data: dict, txt_path: Path = TXT_PATH):
+        self.countries: Dict[str, Dict[str, Dict[str, list]]] = data["countries"]
+        self.names: Dict[str, str] = data.get("names", {})
+        self.txt_path = Path(txt_path)
+        # token-set keys so "korea south" finds "korea, south"
+        self._token_keys = {self._tokens(k): k for k in self.countries}
+
+    @staticmethod
+    def _tokens(name: str) -> str:
+        return " ".join(sorted(re.findall(r"\w+", name)))
+
+    @classmethod
+    def load(
+        cls,
+        path: Path = FIELDS_PATH,
+        txt_path: Path = TXT_PATH,
+        rebuild_if_stale: bool = True,
+    ) -> Optional["FieldIndex"]:
+        """
+        Load the index, rebuilding it if factbook.txt changed since it was
+        written. Returns None if factbook.txt is missing.
+        """
+        path, txt_path = Path(path), Path(txt_path)
+        if not txt_path.exists():
+            return None
+        st = txt_path.stat()
+        data = None
+        if path.exists():
+            data = json.loads(path.read_text(encoding="utf-8"))
+            if (data.get("source_size"), data.get("source_mtime_ns")) != (st.st_size, st.st_mtime_ns):
+                data = None
+        if data is None:
+            if not rebuild_if_stale:
+                return None
+            data = build_field_index(txt_path, path)
+        return cls(data, txt_path)
+
+    def match_country(self, name: str) -> Optional[str]:
+        key = normalize_name(name)
+        key = COUNTRY_ALIASES.get(key, key)
+        if key in self.countries:
+            return key
+        tok = self._tokens(key)
+        if tok in self._token_keys:
+            return self._token_keys[tok]
+        close = difflib.get_close_matches(key, list(self.countries), n=1, cutoff=0.8)
+        return close[0] if close else None
+
+    def find(self, country_key: str, field: str) -> List[Tuple[str, str, list]]:
+        """
+        Return [(section, label, span)] for a shortcut field key.
+        """
+        sections = self.countries.get(country_key, {})
+        wanted = FIELD_LABELS.get(field, [field])
+        for want in wanted:
+            hits = []
+            for section, fields in sections.items():
+                for label, span in fields.items():
+                    if label == want or (want.endswith("*") and label.startswith(want[:-1])):
+                        hits.append((section, label, span))
+            if hits:
+                return hits
+        return []
+
+    def read(self, span: list) -> str:
+        with open(self.txt_path, "rb") as f:
+            f.seek(span[0])
+            return f.read(span[1] - span[0]).decode("utf-8", errors="ignore").strip()
+
+    def lookup(self, field: str, country: str) -> List[str]:
+        """
+        Snippets for e.g. lookup("capital", "laos"), each prefixed with the
+        country's display name. Empty if the country or field is unknown.
+        """
+        key = self.match_country(country)
+        if key is None:
+            return []
+        display = self.names.get(key, key)
+        return [f"{display} ({section}):\n{self.read(span)}" for section, _, span in self.find(key, field)]
+
+
+def main() -> None:
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Build or query the Factbook field index.")
+    ap.add_argument("lookup", nargs="*", help="Optional: FIELD COUNTRY, e.g. capital laos")
+    args = ap.parse_args()
+
+    if not args.lookup:
+        data = build_field_index()
+        print(f"Indexed {len(data['countries'])} countries -> {FIELDS_PATH}")
+        return
+
+    idx = FieldIndex.load()
+    if idx is None:
+        raise SystemExit(f"ERROR: {TXT_PATH} not found.")
+    for snippet in idx.lookup(args.lookup[0], " ".join(args.lookup[1:])):
+        print(snippet)
+        print("---")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Streaming, constant-memory ingestion shared by the indexers.
+
+  read file -> chunk (citl_chunker) -> embed in batches (citl_embed)
+            -> append to the on-disk matrix + chunk store (CorpusWriter)
+
+Only one group of chunks (batch size x workers) is held in memory at a
+time, however big the source is. Every group is committed to disk before
+the next one is read, so an interrupted build (Ctrl+C, crash, reboot)
+picks up after the last committed group when it is run again with the same
+source and settings. Use --restart to throw the partial build away.
+"""
+
+import itertools
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional
+
+from citl_chunker import chunk_file
+from citl_corpus import CorpusWriter, open_corpus
+from citl_embed import EmbedCache, EmbedEngine, chunk_key
+
+
+def _groups(items: Iterator[dict], size: int) -> Iterator[List[dict]]:
+    while True:
+        group = list(itertools.islice(items, size))
+        if not group:
+            return
+        yield group
+
+
+def ingest_file(
+    src: Path,
+    index_dir: Path,
+    name: str,
+    engine: EmbedEngine,
+    cache: Optional[EmbedCache] = None,
+    max_tokens: int = 350,
+    overlap_tokens: int = 40,
+    dtype: str = "float32",
+    keep_full: bool = False,
+    resume: bool = True,
+    on_batch: Optional[Callable[[int], None]] = None,
+) -> int:
+    """
+    Chunk, embed and write ``src`` as corpus ``name``. Returns the number
+    of chunks. With a cache, cached chunks are reused and the cache is
+    pruned to the chunks of the finished corpus.
+    """
+    src = Path(src)
+    st = src.stat()
+    meta = {
+        "src": str(src.resolve()),
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "max_tokens": max_tokens,
+        "overlap_tokens": overlap_tokens,
+        "model": engine.model,
+    }
+    writer = CorpusWriter(index_dir, name, dtype=dtype, meta=meta, resume=resume, keep_full=keep_full)
+    if writer.resumed:
+        print(f"[INFO] Resuming '{name}' after {writer.count} committed chunks")
+        if on_batch is not None:
+            on_batch(writer.count)
+
+    # Chunking is deterministic, so skipping the committed prefix lines the
+    # stream up with what is already on disk.
+    chunks = (
+        {"id": i, **c}
+        for i, c in enumerate(chunk_file(src, max_tokens, overlap_tokens))
+    )
+    chunks = itertools.islice(chunks, writer.count, None)
+
+    group_size = engine.batch_size * engine.workers
+    try:
+        for group in _groups(chunks, group_size):
+            vecs = engine.embed([c["text"] for c in group], on_batch=on_batch, cache=cache)
+            writer.append(group, vecs)
+    except BaseException:
+        writer.close()
+        print(
+            f"[WARN] Build of '{name}' stopped after {writer.count} committed chunks; "
+            "run the same command again to resume."
+        )
+        raise
+
+    writer.finish()
+
+    if cache is not None:
+        corpus = open_corpus(index_dir, name)
+        dropped = cache.prune(chunk_key(engine.model, c["text"]) for c in corpus.chunks)
+        corpus.close()
+        print(f"Dropped {dropped} stale cached chunks")
+    return writer.count
+
+
+def add_ingest_args(parser) -> None:
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="Discard an interrupted build instead of resuming it",
+    )
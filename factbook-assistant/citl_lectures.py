@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+Index recorded lectures as the "lectures" RAG corpus.
+
+Picks up the lecture_*.txt transcripts that citl_transcribe_lecture.py
+writes ("[hh:mm:ss] text" lines), chunks them along the timestamps, embeds
+the chunks in batches and appends them to the corpus (CorpusWriter with
+extend=True): only new lectures are embedded and tokenized for BM25, and
+their rows join the existing IVF lists without re-training k-means.
+Every chunk keeps its lecture, WAV file and start/end time, so a hit says
+where to jump in the recording:
+
+  python citl_lectures.py                   # index new lectures once
+  python citl_lectures.py --watch 60        # keep indexing as they appear
+  python citl_lectures.py --search "What is osmosis?"
+  python citl_multi_rag.py --source lectures "What is osmosis?"
+
+A transcript is indexed once it has not changed for --settle seconds (live
+transcription appends to it while recording). A transcript that changes
+after it was indexed is reported; --rebuild re-indexes everything (from
+the embedding cache, so unchanged chunks are not re-embedded).
+
+Environment:
+  CITL_LECTURE_DIR - transcript folder (default: ~/Documents/CITL Transcripts)
+"""
+
+import os
+import re
+import sys
+import time
+import argparse
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import citl_bm25
+import citl_ollama
+from citl_chunker import DEFAULT_OVERLAP_TOKENS, count_tokens
+from citl_corpus import INDEX_DIR, CorpusWriter, cache_path, corpus_exists, open_corpus, read_manifest
+from citl_embed import EMBED_MODEL, EmbedCache, EmbedEngine, add_engine_args
+from citl_registry import ModelMismatchError, check_model
+from citl_vector_index import add_ann_args, append_for_corpus
+from citl_whisper import fmt_time
+
+CORPUS = "lectures"
+LECTURE_DIR = Path(os.environ.get("CITL_LECTURE_DIR", str(Path.home() / "Documents" / "CITL Transcripts")))
+# Smaller than book chunks: a hit should point at a moment, not a quarter hour
+MAX_TOKENS = 200
+SETTLE_S = 60.0
+# Recorded in the manifest, so a model mismatch names the right command
+REBUILD_CMD = "python citl_lectures.py --rebuild"
+
+_LINE_RE = re.compile(r"^\[(\d{2}):(\d{2}):(\d{2})\]\s*(.*)$")
+_STEM_RE = re.compile(r"^lecture_(\d{4})(\d{2})(\d{2})_(\d{2})(\d{2})\d{2}$")
+
+# Changed transcripts already reported (once per process, not per --watch poll)
+_warned = set()
+
+
+# ---------------------------------------------------------------------
+# Transcripts
+# ---------------------------------------------------------------------
+
+def lecture_title(stem: str) -> str:
+    """
+    "lecture_20250114_101500" -> "Lecture 2025-01-14 10:15"
+    """
+    m = _STEM_RE.match(stem)
+    if m is None:
+        return stem
+    y, mo, d, h, mi = m.groups()
+    return f"Lecture {y}-{mo}-{d} {h}:{mi}"
+
+
+def read_transcript(path: Path) -> List[Tuple[Optional[float], str]]:
+    """
+    (seconds, text) per non-empty line; seconds is None for lines without
+    a "[hh:mm:ss]" stamp (older plain-text transcripts).
+    """
+    out: List[Tuple[Optional[float], str]] = []
+    for line in path.read_text(encoding="utf-8").splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        m = _LINE_RE.match(line)
+        if m is None:
+            out.append((None, line))
+        elif m.group(4):
+            h, mi, s = (int(g) for g in m.groups()[:3])
+            out.append((float(h * 3600 + mi * 60 + s), m.group(4)))
+    return out
+
+
+def chunk_lecture(
+    path: Path,
+    max_tokens: int = MAX_TOKENS,
+    overlap_tokens: int = DEFAULT_OVERLAP_TOKENS,
+) -> List[dict]:
+    """
+    Chunks of whole transcript lines, each starting with up to
+    ``overlap_tokens`` of the previous chunk's last lines, with
+    {"text", "tokens", "lecture", "wav", "start", "end", "chapter", "section"}.
+    "chapter"/"section" (lecture title, time range) are what citl_multi_rag
+    prints in its "Source:" headers.
+    """
+    lines = read_transcript(path)
+    wav = path.with_suffix(".wav")
+    title = lecture_title(path.stem)
+    chunks: List[dict] = []
+    current: List[Tuple[Optional[float], str, int]] = []
+    used = 0
+    fresh = 0
+
+    def emit() -> None:
+        stamps = [t for t, _, _ in current if t is not None]
+        start = stamps[0] if stamps else None
+        end = stamps[-1] if stamps else None
+        chunks.append(
+            {
+                "text": " ".join(text for _, text, _ in current),
+                "tokens": used,
+                "lecture": path.stem,
+                "wav": wav.name if wav.exists() else None,
+                "start": start,
+                "end": end,
+                "chapter": title,
+                "section": f"{fmt_time(start)}-{fmt_time(end)}" if stamps else None,
+            }
+        )
+
+    for t, text in lines:
+        k = count_tokens(text)
+        if current and used + k > max_tokens and fresh:
+            emit()
+            tail: List[Tuple[Optional[float], str, int]] = []
+            n = 0
+            for item in reversed(current):
+                if n + item[2] > overlap_tokens:
+                    break
+                tail.insert(0, item)
+                n += item[2]
+            current, used, fresh = tail, n, 0
+        current.append((t, text, k))
+        used += k
+        fresh += k
+    if fresh:
+        emit()
+    return chunks
+
+
+def _signature(path: Path) -> dict:
+    st = path.stat()
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+# ---------------------------------------------------------------------
+# Indexing
+# ---------------------------------------------------------------------
+
+def index_new(
+    lecture_dir: Path,
+    index_dir: Path,
+    engine: EmbedEngine,
+    cache: Optional[EmbedCache] = None,
+    max_tokens: int = MAX_TOKENS,
+    overlap_tokens: int = DEFAULT_OVERLAP_TOKENS,
+    settle_s: float = SETTLE_S,
+    rebuild: bool = False,
+    ann: str = "auto",
+) -> int:
+    """
+    Append every settled, not yet indexed lecture in ``lecture_dir`` to the
+    lectures corpus. Returns the number of lectures added.
+    """
+    manifest = None if rebuild or not corpus_exists(index_dir, CORPUS) else read_manifest(index_dir, CORPUS)
+    settings = {"max_tokens": max_tokens, "overlap_tokens": overlap_tokens, "model": engine.model}
+    indexed: dict = {}
+    if manifest is not None:
+        meta = manifest.get("meta") or {}
+        old = {"max_tokens": meta.get("max_tokens"), "overlap_tokens": meta.get("overlap_tokens"),
+               "model": manifest.get("model")}
+        if old != settings:
+            raise ValueError(
+                f"The {CORPUS} corpus was built with {old}, not {settings}; run with --rebuild"
+            )
+        indexed = dict(meta.get("lectures") or {})
+
+    now = time.time()
+    new: List[Path] = []
+    for path in sorted(Path(lecture_dir).glob("lecture_*.txt")):
+        if path.name.endswith(".summary.txt"):
+            continue
+        sig = _signature(path)
+        if path.name in indexed:
+            if {k: indexed[path.name].get(k) for k in sig} != sig and path.name not in _warned:
+                _warned.add(path.name)
+                print(f"[WARN] {path.name} changed after it was indexed; run with --rebuild to re-index it")
+            continue
+        if now - sig["mtime_ns"] / 1e9 < settle_s:
+            continue  # still being written
+        new.append(path)
+    if not new:
+        return 0
+
+    # New lectures are small: chunk them up front so the meta is final
+    batches = [(path, chunk_lecture(path, max_tokens, overlap_tokens)) for path in new]
+    meta = dict(settings, rebuild=REBUILD_CMD, lectures=dict(indexed))
+    for path, chunks in batches:
+        meta["lectures"][path.name] = dict(_signature(path), chunks=len(chunks))
+
+    # An interrupted run is not resumed: the next one starts again from the
+    # finished corpus, and the embedding cache has the vectors it made
+    writer = CorpusWriter(index_dir, CORPUS, meta=meta, resume=False, extend=not rebuild)
+    start = writer.count
+    group_size = engine.batch_size * engine.workers
+    try:
+        for path, chunks in batches:
+            for lo in range(0, len(chunks), group_size):
+                group = chunks[lo : lo + group_size]
+                for i, c in enumerate(group):
+                    c["id"] = writer.count + i
+                writer.append(group, engine.embed([c["text"] for c in group], cache=cache))
+            print(f"[INFO] Indexed {path.name}: {len(chunks)} chunks")
+    except BaseException:
+        writer.close()
+        raise
+    writer.finish()
+    # Only the new rows are added to the IVF and BM25 indexes
+    append_for_corpus(index_dir, CORPUS, start, ann)
+    citl_bm25.append_for_corpus(index_dir, CORPUS, start)
+    return len(new)
+
+
+# ---------------------------------------------------------------------
+# Search
+# ---------------------------------------------------------------------
+
+def search(question: str, k: int = 5, index_dir: Path = INDEX_DIR, lecture_dir: Path = LECTURE_DIR) -> List[dict]:
+    """
+    Top-k lecture moments: {"score", "lecture", "title", "start", "end",
+    "wav" (full path or None), "text"}.
+    """
+    corpus = open_corpus(index_dir, CORPUS)
+    try:
+        check_model(corpus, EMBED_MODEL)
+        qvec = citl_ollama.embed([question], EMBED_MODEL, timeout=120)[0]
+        idx, scores = corpus.search(qvec, k, text=question)
+        hits = []
+        for i, score in zip(idx.tolist(), scores.tolist()):
+            c = corpus.chunks[int(i)]
+            hits.append(
+                {
+                    "score": float(score),
+                    "lecture": c["lecture"],
+                    "title": c.get("chapter"),
+                    "start": c.get("start"),
+                    "end": c.get("end"),
+                    "wav": str(Path(lecture_dir) / c["wav"]) if c.get("wav") else None,
+                    "text": c["text"],
+                }
+            )
+        return hits
+    finally:
+        corpus.close()
+
+
+# ---------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Index recorded lecture transcripts as the 'lectures' corpus.")
+    ap.add_argument("--lecture-dir", default=str(LECTURE_DIR), help=f"Transcript folder (default: {LECTURE_DIR})")
+    ap.add_argument("--index-dir", default=str(INDEX_DIR), help=f"Index directory (default: {INDEX_DIR})")
+    ap.add_argument("--watch", type=float, default=None, metavar="SECONDS", help="Keep checking for new lectures")
+    ap.add_argument(
+        "--settle",
+        type=float,
+        default=SETTLE_S,
+        help=f"Index a transcript once unchanged for this long (default: {SETTLE_S:g}s)",
+    )
+    ap.add_argument("--rebuild", action="store_true", help="Re-index every lecture")
+    ap.add_argument("--max-tokens", type=int, default=MAX_TOKENS, help=f"Tokens per chunk (default: {MAX_TOKENS})")
+    ap.add_argument("--search", metavar="QUESTION", help="Do not index: print the best matching lecture moments")
+    ap.add_argument("-k", "--topk", type=int, default=5, help="Hits for --search (default: 5)")
+    add_engine_args(ap)
+    add_ann_args(ap)
+    args = ap.parse_args()
+    lecture_dir, index_dir = Path(args.lecture_dir), Path(args.index_dir)
+
+    if args.search:
+        if not corpus_exists(index_dir, CORPUS):
+            print(f"[ERROR] No {CORPUS} corpus in {index_dir}; run citl_lectures.py first.")
+            sys.exit(1)
+        try:
+            hits = search(args.search, args.topk, index_dir, lecture_dir)
+        except ModelMismatchError as e:
+            print(f"[ERROR] {e}")
+            sys.exit(1)
+        for hit in hits:
+            when = f"{fmt_time(hit['start'])}-{fmt_time(hit['end'])}" if hit["start"] is not None else "-"
+            print(f"[{hit['score']:.3f}] {hit['title']}  {when}  {hit['wav'] or hit['lecture']}")
+            print(f"    {hit['text'][:200]}")
+        return
+
+    if not lecture_dir.is_dir():
+        print(f"[ERROR] Transcript folder not found: {lecture_dir}")
+        sys.exit(1)
+    engine = EmbedEngine(model=EMBED_MODEL, batch_size=args.batch_size, workers=args.workers)
+    cache = None if args.no_cache else EmbedCache(cache_path(index_dir, CORPUS))
+    rebuild = args.rebuild
+    try:
+        while True:
+            t0 = time.perf_counter()
+            added = index_new(
+                lecture_dir, index_dir, engine, cache, args.max_tokens,
+                settle_s=0.0 if rebuild else args.settle, rebuild=rebuild, ann=args.ann,
+            )
+            rebuild = False
+            if added:
+                print(f"[INFO] Added {added} lecture(s) in {time.perf_counter() - t0:.1f}s")
+                print(engine.report())
+            elif args.watch is None:
+                print("[INFO] No new lectures.")
+            if args.watch is None:
+                break
+            time.sleep(args.watch)
+    except ValueError as e:
+        # Settings differ from the ones the corpus was built with
+        print(f"[ERROR] {e}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        print("\n[INFO] Stopped.")
+    finally:
+        if cache is not None:
+            cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+"""
+Live transcription while recording, in constant memory.
+
+  source (microphone InputStream callback, or a WAV file for testing)
+    -> RingBuffer (a few seconds; the audio callback never blocks)
+    -> writer thread: appends to the WAV on disk as it arrives
+    -> transcriber thread: reads fixed windows (WINDOW_S, overlapping by
+       OVERLAP_S) back from the WAV as they fill and transcribes them
+       with a WhisperEngine (citl_whisper.py)
+
+Audio never accumulates in memory: the WAV file is the buffer between
+recording and transcription. If decoding falls behind, the transcriber
+catches up by taking several windows at once (split at pauses and decoded
+in parallel when the engine has workers), so the transcript is ready a few
+seconds after the recording stops.
+
+Windows overlap so words on a boundary are heard whole by one of them;
+each window keeps the Whisper segments that start in its own half of the
+overlaps, so nothing is emitted twice.
+
+  python citl_live.py --from-wav lecture.wav --realtime   # simulate a mic
+  python citl_live.py --device 3 --minutes 50 --out lecture.wav
+"""
+
+import sys
+import time
+import wave
+import argparse
+import threading
+from pathlib import Path
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from citl_whisper import SAMPLE_RATE, WhisperEngine, add_whisper_args, fmt_time, read_wav
+
+WINDOW_S = 30.0
+OVERLAP_S = 5.0
+RING_S = 30.0
+BLOCK_S = 0.1
+# Slack for segment times that shift slightly between overlapping windows
+EDGE_S = 0.5
+
+SegmentCallback = Callable[[dict], None]
+
+
+# ---------------------------------------------------------------------
+# Ring buffer
+# ---------------------------------------------------------------------
+
+class RingBuffer:
+    """
+    Fixed-size int16 FIFO between the audio callback and the writer.
+
+    write() from a real-time callback must not block: on overflow the
+    oldest unread audio is dropped and counted. A file source can pass
+    block=True to wait for room instead.
+    """
+
+    def __init__(self, capacity: int):
+        self.buf = np.zeros(capacity, dtype=np.int16)
+        self.capacity = capacity
+        self.head = 0  # total samples written
+        self.tail = 0  # total samples read
+        self.dropped = 0
+        self.closed = False
+        self._cond = threading.Condition()
+
+    def write(self, data: np.ndarray, block: bool = False) -> None:
+        data = np.asarray(data, dtype=np.int16).reshape(-1)
+        with self._cond:
+            if block:
+                while self.head - self.tail + data.shape[0] > self.capacity and not self.closed:
+                    self._cond.wait()
+            if data.shape[0] > self.capacity:
+                self.dropped += data.shape[0] - self.capacity
+                data = data[-self.capacity:]
+            over = self.head - self.tail + data.shape[0] - self.capacity
+            if over > 0:
+                self.dropped += over
+                self.tail += over
+            pos = self.head % self.capacity
+            first = min(data.shape[0], self.capacity - pos)
+            self.buf[pos : pos + first] = data[:first]
+            self.buf[: data.shape[0] - first] = data[first:]
+            self.head += data.shape[0]
+            self._cond.notify_all()
+
+    def read(self, timeout: float = 0.5) -> Optional[np.ndarray]:
+        """
+        Everything unread (possibly empty after ``timeout``), or None once
+        closed and drained.
+        """
+        with self._cond:
+            if self.head == self.tail and not self.closed:
+                self._cond.wait(timeout)
+            n = self.head - self.tail
+            if n == 0:
+                return None if self.closed else np.zeros(0, dtype=np.int16)
+            pos = self.tail % self.capacity
+            first = min(n, self.capacity - pos)
+            out = np.concatenate([self.buf[pos : pos + first], self.buf[: n - first]])
+            self.tail += n
+            self._cond.notify_all()
+            return out
+
+    def close(self) -> None:
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+# ---------------------------------------------------------------------
+# Incremental WAV
+# ---------------------------------------------------------------------
+
+class IncrementalWav:
+    """
+    16 kHz mono int16 WAV that is valid on disk after every append (the
+    wave module patches the header sizes on each write) and readable by
+    sample range while it grows.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._f = open(self.path, "wb")
+        self._wf = wave.open(self._f, "wb")
+        self._wf.setnchannels(1)
+        self._wf.setsampwidth(2)
+        self._wf.setframerate(SAMPLE_RATE)
+        self.data_offset: Optional[int] = None
+        self.samples = 0
+        self._cond = threading.Condition()
+        self.closed = False
+
+    def append(self, pcm: np.ndarray) -> None:
+        if pcm.shape[0] == 0:
+            return
+        self._wf.writeframes(pcm.tobytes())
+        self._f.flush()
+        with self._cond:
+            if self.data_offset is None:
+                # The header is written with the first frames
+                self.data_offset = self._f.tell() - pcm.nbytes
+            self.samples += pcm.shape[0]
+            self._cond.notify_all()
+
+    def wait_for(self, samples: int, timeout: float = 0.5) -> int:
+        """
+        Block until ``samples`` are on disk or the file is closed; returns
+        the current sample count.
+        """
+        with self._cond:
+            if self.samples < samples and not self.closed:
+                self._cond.wait(timeout)
+            return self.samples
+
+    def read(self, start: int, end: int) -> np.ndarray:
+        if self.data_offset is None or end <= start:
+            return np.zeros(0, dtype=np.int16)
+        return np.fromfile(self.path, dtype="<i2", count=end - start, offset=self.data_offset + start * 2)
+
+    def close(self) -> None:
+        with self._cond:
+            if not self.closed:
+                self._wf.close()
+                self._f.close()
+                self.closed = True
+            self._cond.notify_all()
+
+
+# ---------------------------------------------------------------------
+# Sources
+# ---------------------------------------------------------------------
+
+class MicSource:
+    """
+    sounddevice InputStream feeding a RingBuffer from its callback.
+    """
+
+    def __init__(self, device: Optional[int], blocksize: int = int(SAMPLE_RATE * BLOCK_S)):
+        self.device = device
+        self.blocksize = blocksize
+        self._stream = None
+
+    def start(self, ring: RingBuffer) -> None:
+        import sounddevice as sd
+
+        def callback(indata, frames, time_info, status):
+            if status:
+                print(f"[WARN] Audio input: {status}", file=sys.stderr)
+            ring.write(indata[:, 0])
+
+        self._stream = sd.InputStream(
+            device=self.device,
+            samplerate=SAMPLE_RATE,
+            channels=1,
+            dtype="int16",
+            blocksize=self.blocksize,
+            callback=callback,
+        )
+        self._stream.start()
+
+    def wait(self, seconds: Optional[float], stop: threading.Event) -> None:
+        stop.wait(seconds)
+
+    def stop(self) -> None:
+        if self._stream is not None:
+            self._stream.stop()
+            self._stream.close()
+            self._stream = None
+
+
+class WavSource:
+    """
+    Plays a WAV file into the ring buffer in BLOCK_S blocks, like a
+    microphone would: at recording speed with ``realtime``, otherwise as
+    fast as the writer takes it.
+    """
+
+    def __init__(self, path: Path, realtime: bool = False):
+        self.pcm = read_wav(Path(path))
+        self.realtime = realtime
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self, ring: RingBuffer) -> None:
+        block = int(SAMPLE_RATE * BLOCK_S)
+
+        def play():
+            t0 = time.perf_counter()
+            for i, lo in enumerate(range(0, self.pcm.shape[0], block)):
+                if self._stop.is_set():
+                    break
+                if self.realtime:
+                    delay = t0 + i * BLOCK_S - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                ring.write(self.pcm[lo : lo + block], block=not self.realtime)
+            self._stop.set()
+
+        self._thread = threading.Thread(target=play, daemon=True)
+        self._thread.start()
+
+    def wait(self, seconds: Optional[float], stop: threading.Event) -> None:
+        deadline = None if seconds is None else time.perf_counter() + seconds
+        while not self._stop.is_set() and not stop.is_set():
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+            self._stop.wait(0.1)
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+# ---------------------------------------------------------------------
+# Live session
+# ---------------------------------------------------------------------
+
+class LiveTranscriber:
+    """
+    Record from ``source`` into ``wav_path`` and transcribe while recording.
+
+    live = LiveTranscriber(engine, WavSource("test.wav"), "out.wav", on_segment=print)
+    live.run(seconds=None)          # until the source ends / Ctrl+C
+    live.segments                   # all segments, recording timestamps
+    """
+
+    def __init__(
+        self,
+        engine: WhisperEngine,
+        source,
+        wav_path: Path,
+        on_segment: Optional[SegmentCallback] = None,
+        window_s: float = WINDOW_S,
+        overlap_s: float = OVERLAP_S,
+    ):
+        if not 0 <= overlap_s < window_s:
+            raise ValueError("overlap must be shorter than the window")
+        self.engine = engine
+        self.source = source
+        self.wav = IncrementalWav(wav_path)
+        self.on_segment = on_segment
+        self.window = int(window_s * SAMPLE_RATE)
+        self.overlap = int(overlap_s * SAMPLE_RATE)
+        self.ring = RingBuffer(int(RING_S * SAMPLE_RATE))
+        self.segments: List[dict] = []
+        self.decode_seconds = 0.0
+        self.windows = 0
+        self.error: Optional[BaseException] = None
+        self._stop = threading.Event()
+
+    # -- threads --------------------------------------------------------
+
+    def _write_loop(self) -> None:
+        while True:
+            block = self.ring.read()
+            if block is None:
+                break
+            self.wav.append(block)
+        self.wav.close()
+
+    def _emit(self, segs: List[dict], lo: float, hi: float) -> None:
+        for s in segs:
+            if lo <= s["start"] < hi:
+                self.segments.append(s)
+                if self.on_segment is not None:
+                    self.on_segment(s)
+
+    def _transcribe_loop(self) -> None:
+        start = 0
+        keep_from = 0.0
+        # While catching up, decode up to this much audio per round (the
+        # engine splits it at pauses and uses all its workers)
+        max_round = self.window * max(1, self.engine.workers)
+        try:
+            while True:
+                have = self.wav.wait_for(start + self.window)
+                final = self.wav.closed and have == self.wav.samples
+                if have < start + self.window and not final:
+                    continue
+                end = min(have, start + max_round)
+                if end <= start:
+                    break  # nothing was recorded
+                pcm = self.wav.read(start, end)
+                t0 = time.perf_counter()
+                result = self.engine.transcribe_pcm(pcm, offset=start / SAMPLE_RATE)
+                self.decode_seconds += time.perf_counter() - t0
+                self.windows += 1
+
+                last = final and end == have
+                # Segments that start in the second half of the overlap, or
+                # run into the end of the window, are left to the next
+                # window, which hears them whole
+                keep_to = float("inf")
+                if not last:
+                    keep_to = (end - self.overlap / 2) / SAMPLE_RATE
+                    next_start = (end - self.overlap) / SAMPLE_RATE
+                    for seg in result.segments:
+                        cut = seg["start"] - EDGE_S
+                        if seg["end"] >= end / SAMPLE_RATE - EDGE_S and next_start <= cut < keep_to:
+                            keep_to = cut
+                self._emit(result.segments, keep_from, keep_to)
+                if last:
+                    break
+                keep_from = keep_to
+                start = end - self.overlap
+        except BaseException as e:
+            self.error = e
+            self._stop.set()
+
+    # -- run ------------------------------------------------------------
+
+    def run(self, seconds: Optional[float] = None) -> None:
+        """
+        Record for ``seconds`` (None: until the source ends), then wait for
+        the transcriber to finish the tail. Ctrl+C stops the recording
+        early; what was recorded is still transcribed.
+        """
+        writer = threading.Thread(target=self._write_loop, daemon=True)
+        transcriber = threading.Thread(target=self._transcribe_loop, daemon=True)
+        writer.start()
+        transcriber.start()
+        self.source.start(self.ring)
+        try:
+            self.source.wait(seconds, self._stop)
+        except KeyboardInterrupt:
+            print("\n[INFO] Recording stopped; finishing the transcript...")
+        finally:
+            self.source.stop()
+            self.ring.close()
+            writer.join()
+        t_stop = time.perf_counter()
+        transcriber.join()
+        self.tail_seconds = time.perf_counter() - t_stop
+        if self.error is not None:
+            raise self.error
+        if self.ring.dropped:
+            print(
+                f"[WARN] {self.ring.dropped / SAMPLE_RATE:.1f}s of audio dropped "
+                "(the disk could not keep up)",
+                file=sys.stderr,
+            )
+
+    @property
+    def audio_seconds(self) -> float:
+        return self.wav.samples / SAMPLE_RATE
+
+    def timestamped(self) -> str:
+        return "\n".join(f"[{fmt_time(s['start'])}] {s['text']}" for s in self.segments)
+
+    def report(self) -> str:
+        rtf = self.decode_seconds / self.audio_seconds if self.audio_seconds else 0.0
+        return (
+            f"[INFO] Recorded {self.audio_seconds / 60:.1f} min, {self.windows} windows decoded "
+            f"(RTF {rtf:.2f}); transcript ready {self.tail_seconds:.1f}s after recording stopped"
+        )
+
+
+def print_segment(seg: dict) -> None:
+    print(f"[{fmt_time(seg['start'])}] {seg['text']}", flush=True)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Record and transcribe at the same time.")
+    src = ap.add_mutually_exclusive_group()
+    src.add_argument("--device", type=int, default=None, help="Input device index (default: system default)")
+    src.add_argument("--from-wav", help="Feed this WAV file instead of a microphone (testing)")
+    ap.add_argument("--realtime", action="store_true", help="With --from-wav: play at recording speed")
+    ap.add_argument("--minutes", type=float, default=None, help="Stop after this long (default: Ctrl+C)")
+    ap.add_argument("--out", default="live.wav", help="Recorded WAV path (default: live.wav)")
+    ap.add_argument("--window", type=float, default=WINDOW_S, help=f"Window seconds (default: {WINDOW_S:g})")
+    ap.add_argument("--overlap", type=float, default=OVERLAP_S, help=f"Overlap seconds (default: {OVERLAP_S:g})")
+    add_whisper_args(ap)
+    ap.set_defaults(workers=1)
+    args = ap.parse_args()
+
+    source = WavSource(Path(args.from_wav), args.realtime) if args.from_wav else MicSource(args.device)
+    with WhisperEngine(args.whisper_model, workers=args.workers) as engine:
+        live = LiveTranscriber(engine, source, Path(args.out), print_segment, args.window, args.overlap)
+        live.run(None if args.minutes is None else args.minutes * 60)
+    print(live.report(), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
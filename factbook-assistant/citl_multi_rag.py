@@ -1,85 +1,88 @@
+import time
+
+# Taken before the imports below so --profile can report what they cost
+_T_IMPORT = time.perf_counter()
+
+import sys
+import contextlib
 import argparse
-import json
-from pathlib import Path
-from typing import Dict, List, Tuple
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
 
 import numpy as np
-import requests
-
-# All files are in the Factbook-Assistant folder
-CORPUS_FILES: Dict[str, Path] = {
-    "factbook": Path("factbook_embeddings.json"),
-    "law": Path("law_embeddings.json"),
-    "nursing": Path("nursing_embeddings.json"),
-    "dictionary": Path("dictionary_embeddings.json"),
-}
-
-EMBED_MODEL = "nomic-embed-text"
-EMBED_URL = "http://localhost:11434/api/embed"
-LLM_MODEL = "mistral:7b-instruct"
-GEN_URL = "http://localhost:11434/api/generate"
 
+import citl_batch
+import citl_bm25
+import citl_ollama
+import citl_quant
+import citl_trace
+from citl_cache import QueryCache
+from citl_corpus import INDEX_DIR, Corpus
+from citl_embed import EMBED_MODEL
+from citl_ollama import TokenCallback, TokenPrinter
+from citl_rag_client import DEFAULT_SERVER, ask_server
+from citl_registry import CorpusRegistry, ModelMismatchError, discover
+from citl_vector_index import FlatIndex, top_rows, query_block
+
+_IMPORTED = time.perf_counter()
 
-def embed(text: str) -> np.ndarray:
-    """
-    Call Ollama /api/embed and return ONE normalized embedding vector.
-    """
-    r = requests.post(EMBED_URL, json={"model": EMBED_MODEL, "input": text})
-    r.raise_for_status()
-    out = r.json()
-
-    vec = None
-    if isinstance(out, dict):
-        vec = out.get("embedding")
-        if vec is None:
-            embs = out.get("embeddings")
-            if isinstance(embs, list) and embs:
-                vec = embs[0]
-    else:
-        raise RuntimeError(f"Unexpected embed response type: {type(out)}: {out}")
+LLM_MODEL = "mistral:7b-instruct"
 
-    if vec is None:
-        raise RuntimeError(f"Could not find 'embedding' in embed response: {out}")
+NO_CONTEXT = "I could not find any relevant context in the selected corpus/corpora."
 
-    v = np.asarray(vec, dtype=np.float32)
-    v /= (np.linalg.norm(v) + 1e-8)
-    return v
+# Corpora are discovered from the manifests in the index folder and opened
+# on first use (see citl_registry.py)
+REGISTRY = CorpusRegistry(INDEX_DIR, EMBED_MODEL)
 
 
-def load_corpus(name: str) -> Tuple[np.ndarray, List[dict]]:
+def embed(text: str, cache: Optional[QueryCache] = None) -> np.ndarray:
     """
-    Load embeddings + chunks for the given corpus name.
+    Call Ollama /api/embed and return ONE normalized embedding vector.
+    With a cache, a repeated question never reaches Ollama.
     """
-    path = CORPUS_FILES[name]
-    if not path.exists():
-        raise FileNotFoundError(f"Corpus file not found for '{name}': {path}")
-
-    data = json.loads(path.read_text(encoding="utf-8"))
-    emb = np.asarray(data["embeddings"], dtype=np.float32)
-    chunks = data["chunks"]
-
-    emb /= (np.linalg.norm(emb, axis=1, keepdims=True) + 1e-8)
-
-    print(f"[INFO] Loaded {len(chunks)} chunks from {name} ({path})")
-    return emb, chunks
+    if cache is not None:
+        hit = cache.get_embedding(text, EMBED_MODEL)
+        if hit is not None:
+            return hit
+
+    v = citl_ollama.embed([text], EMBED_MODEL, timeout=120)[0]
+    if cache is not None:
+        cache.put_embedding(text, EMBED_MODEL, v)
+    return v
 
 
-def top_k(emb: np.ndarray, chunks: List[dict], qvec: np.ndarray, k: int) -> List[str]:
+def load_corpus(name: str) -> Corpus:
     """
-    Return text for top-k most similar chunks.
+    Memory-map embeddings + open the lazy chunk store for the given corpus
+    (once per process), refusing it if it was built with another embed
+    model. Vectors were normalized at build time, so nothing is recomputed.
     """
-    sims = emb @ qvec
-    if len(sims) == 0:
-        return []
-    k = min(k, len(sims))
-    idx = np.argpartition(-sims, k - 1)[:k]
-    idx = idx[np.argsort(-sims[idx])]
-    return [chunks[int(i)]["text"] for i in idx]
-
-
-def generate_answer(question: str, context: str) -> str:
+    try:
+        corpus = REGISTRY.get(name)
+    except FileNotFoundError as e:
+        legacy = INDEX_DIR.parent / f"{name}_embeddings.json"
+        if legacy.exists():
+            raise FileNotFoundError(
+                f"{e} (convert it with: python convert_embeddings_json.py {legacy.name})"
+            ) from None
+        raise
+
+    print(f"[INFO] Loaded {len(corpus)} chunks from {name} ({INDEX_DIR}, {corpus.index.kind} search)")
+    return corpus
+
+
+def generate_answer(
+    question: str,
+    context: str,
+    on_token: Optional[TokenCallback] = None,
+    cache: Optional[QueryCache] = None,
+) -> str:
     """
     Call Ollama /api/generate with Mistral and the provided context.
+
+    With ``on_token`` the answer is streamed token by token; otherwise a
+    single blocking request is made. A cached answer for the same question
+    and context is returned (and "streamed" in one piece) without the LLM.
     """
     system_prompt = (
         "You are CITL Assistant, a college learning and accessibility coach.\n"
@@ -89,37 +92,400 @@ def generate_answer(question: str, context: str) -> str:
         "Use short paragraphs or bullet points. Do not invent citations or sources.\n"
     )
 
+    options = {"temperature": 0.1}
     payload = {
         "model": LLM_MODEL,
         "system": system_prompt,
         "prompt": f"Context:\n{context}\n\nQuestion: {question}\nAnswer:",
-        "stream": False,
-        "options": {"temperature": 0.1},
+        "options": options,
     }
 
-    r = requests.post(GEN_URL, json=payload, timeout=600)
-    r.raise_for_status()
-    data = r.json()
-    answer = data.get("response", "")
-    return answer.strip()
+    cache_opts = {"system": system_prompt, **options}
+    if cache is not None:
+        hit = cache.get_answer(question, context, LLM_MODEL, cache_opts)
+        if hit is not None:
+            citl_trace.note(cached=True)
+            if on_token is not None:
+                on_token(hit)
+            return hit
+
+    answer = citl_ollama.generate(payload, on_token=on_token, timeout=600).text
+    if cache is not None and answer:
+        cache.put_answer(question, context, LLM_MODEL, cache_opts, answer)
+    return answer
+
+
+def resolve_corpora(source: str) -> List[str]:
+    return REGISTRY.resolve(source)
+
+
+# ---------------------------------------------------------------------
+# Unified retrieval across corpora
+# ---------------------------------------------------------------------
+
+# (score, corpus name, row in that corpus)
+Hit = Tuple[float, str, int]
+
+
+class MergedCorpora:
+    """
+    Several corpora searched as one: their embedding matrices are stacked
+    into a single (sum N, D) matrix (``starts`` maps rows back), so a question
+    costs one GEMV instead of one per corpus, and hits from every corpus
+    compete on the same cosine score.
+
+    Corpora with an IVF index are not stacked (that would throw the index
+    away); they are searched through it and merged by score instead.
+    """
+
+    def __init__(self, corpora: Sequence[Corpus]):
+        self.corpora = list(corpora)
+        self.names = [c.name for c in self.corpora]
+        flat = [c for c in self.corpora if isinstance(c.index, FlatIndex)]
+        self.ann = [c for c in self.corpora if not isinstance(c.index, FlatIndex)]
+
+        sizes = [len(c) for c in flat]
+        self.flat_names = [c.name for c in flat]
+        self.starts = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+        if len(flat) == 1:
+            # A single corpus is used in place (mmap stays an mmap)
+            self.emb = flat[0].emb
+        elif flat:
+            self.emb = citl_quant.stack([c.emb for c in flat])
+        else:
+            self.emb = None
+
+    def candidates_batch(
+        self,
+        qmat: np.ndarray,
+        k: int,
+        min_per_corpus: int = 0,
+        max_per_corpus: Optional[int] = None,
+        texts: Optional[Sequence[str]] = None,
+    ) -> List[Dict[str, List[Hit]]]:
+        """
+        Best hits per corpus for every row of ``qmat``, best first. Each
+        corpus contributes at most max(k, min_per_corpus) (capped by
+        max_per_corpus), which is all the global selection can ever use.
+
+        With the question ``texts`` and at least one BM25 index, every
+        corpus list is re-ranked by RRF of its vector and BM25 rankings,
+        so the fused scores stay comparable across corpora.
+        """
+        per = max(k, min_per_corpus)
+        if max_per_corpus is not None:
+            per = min(per, max_per_corpus)
+        out: List[Dict[str, List[Hit]]] = [{} for _ in range(qmat.shape[0])]
+        if per <= 0:
+            return out
+
+        hybrid = (
+            texts is not None
+            and citl_bm25.HYBRID
+            and any(c.lexical is not None for c in self.corpora)
+        )
+        final = per
+        if hybrid:
+            per = max(per, citl_bm25.FUSE_DEPTH)
+        # Quantized corpora with a float32 copy hand over a deeper candidate
+        # list, re-scored exactly below
+        rerank = any(c.reranks for c in self.corpora)
+        vec_per = citl_quant.rerank_depth(per) if rerank else per
+
+        if self.emb is not None and self.emb.shape[0]:
+            step = query_block(self.emb.shape[0])
+            for q0 in range(0, qmat.shape[0], step):
+                # One matrix product for the whole block across all corpora
+                sims = citl_quant.score(self.emb, qmat[q0 : q0 + step])
+                for j, name in enumerate(self.flat_names):
+                    lo, hi = int(self.starts[j]), int(self.starts[j + 1])
+                    if hi == lo:
+                        continue
+                    part = sims[:, lo:hi]
+                    top = top_rows(part, vec_per)
+                    scores = np.take_along_axis(part, top, axis=1)
+                    for r in range(top.shape[0]):
+                        out[q0 + r][name] = [
+                            (float(sc), name, int(i)) for i, sc in zip(top[r], scores[r])
+                        ]
+
+        for c in self.ann:
+            ids, scores = c.index.search_batch(qmat, vec_per)
+            for r in range(qmat.shape[0]):
+                out[r][c.name] = [(float(sc), c.name, int(i)) for i, sc in zip(ids[r], scores[r])]
+
+        if rerank:
+            for c in self.corpora:
+                for r in range(qmat.shape[0]):
+                    hits = out[r].get(c.name, [])
+                    if not c.reranks:
+                        out[r][c.name] = hits[:per]
+                        continue
+                    cand = np.asarray([h[2] for h in hits], dtype=np.int64)
+                    ids, scores = c.rerank(qmat[r], cand, per)
+                    out[r][c.name] = [(float(sc), c.name, int(i)) for i, sc in zip(ids, scores)]
+
+        if hybrid:
+            for c in self.corpora:
+                for r, text in enumerate(texts):
+                    vec_ids = np.asarray([h[2] for h in out[r].get(c.name, [])], dtype=np.int64)
+                    rankings = [vec_ids]
+                    if c.lexical is not None:
+                        rankings.append(c.lexical.search(text, per)[0])
+                    ids, scores = citl_bm25.rrf_fuse(rankings, final)
+                    out[r][c.name] = [(float(sc), c.name, int(i)) for i, sc in zip(ids, scores)]
+        return out
+
+    @staticmethod
+    def select(
+        per_corpus: Dict[str, List[Hit]], k: int, min_per_corpus: int = 0, max_per_corpus: Optional[int] = None
+    ) -> List[Hit]:
+        """
+        Global top-k by score. ``min_per_corpus`` reserves slots for every
+        corpus that has hits (so one corpus cannot crowd out the rest);
+        ``max_per_corpus`` caps any single corpus.
+        """
+        chosen: List[Hit] = []
+        for hits in per_corpus.values():
+            chosen.extend(hits[:min_per_corpus])
+
+        taken = {name: min(len(h), min_per_corpus) for name, h in per_corpus.items()}
+        rest = sorted(
+            (h for name, hits in per_corpus.items() for h in hits[taken[name]:]),
+            reverse=True,
+        )
+        for hit in rest:
+            if len(chosen) >= k:
+                break
+            if max_per_corpus is not None and taken[hit[1]] >= max_per_corpus:
+                continue
+            chosen.append(hit)
+            taken[hit[1]] += 1
+
+        chosen.sort(reverse=True)
+        return chosen
+
+    def search_batch(
+        self,
+        qmat: np.ndarray,
+        k: int,
+        min_per_corpus: int = 0,
+        max_per_corpus: Optional[int] = None,
+        texts: Optional[Sequence[str]] = None,
+    ) -> List[List[Hit]]:
+        return [
+            self.select(per_corpus, k, min_per_corpus, max_per_corpus)
+            for per_corpus in self.candidates_batch(qmat, k, min_per_corpus, max_per_corpus, texts)
+        ]
+
+    def search(
+        self,
+        qvec: np.ndarray,
+        k: int,
+        min_per_corpus: int = 0,
+        max_per_corpus: Optional[int] = None,
+        text: Optional[str] = None,
+    ) -> List[Hit]:
+        texts = None if text is None else [text]
+        return self.search_batch(qvec[None, :], k, min_per_corpus, max_per_corpus, texts)[0]
+
+    def chunk(self, hit: Hit) -> dict:
+        corpus = self.corpora[self.names.index(hit[1])]
+        return corpus.chunks[hit[2]]
+
+    def text(self, hit: Hit) -> str:
+        return self.chunk(hit)["text"]
+
+
+_merged: Dict[Tuple[str, ...], Tuple[Tuple[int, ...], MergedCorpora]] = {}
+_merged_lock = threading.Lock()
+
+
+def merged_corpora(corpora: Sequence[Corpus]) -> MergedCorpora:
+    """
+    Reuse the stacked matrix while the loader keeps returning the same
+    Corpus objects (the resident server does until a hot reload).
+    """
+    key = tuple(c.name for c in corpora)
+    ident = tuple(id(c) for c in corpora)
+    with _merged_lock:
+        entry = _merged.get(key)
+        if entry is not None and entry[0] == ident:
+            return entry[1]
+    merged = MergedCorpora(corpora)
+    with _merged_lock:
+        _merged[key] = (ident, merged)
+    return merged
+
+
+def _source_block(hit: Hit, chunk: dict) -> str:
+    """
+    "Source: NURSING (Chapter 3 Safety / 3.2 Basic Concepts)" + the text;
+    the titles come from the chunker's metadata when the corpus has them.
+    """
+    where = " / ".join(t for t in (chunk.get("chapter"), chunk.get("section")) if t)
+    header = f"Source: {hit[1].upper()}" + (f" ({where})" if where else "")
+    return f"{header}\n{chunk['text']}"
+
+
+def pack_context(merged: MergedCorpora, hits: Sequence[Hit], maxctx: int) -> str:
+    """
+    Add hits best-first under "Source:" headers until ``maxctx`` characters
+    are used. A hit that does not fit is skipped (a later, shorter one may
+    still fit), so the best chunks are never cut off by a blind slice. If
+    not even the best hit fits, it is truncated so the LLM gets something.
+    """
+    sep = "\n\n---\n\n"
+    parts: List[str] = []
+    used = 0
+    for hit in hits:
+        block = _source_block(hit, merged.chunk(hit))
+        cost = len(block) + (len(sep) if parts else 0)
+        if used + cost > maxctx:
+            continue
+        parts.append(block)
+        used += cost
+    if not parts and hits:
+        parts.append(_source_block(hits[0], merged.chunk(hits[0]))[:maxctx])
+    return sep.join(parts)
+
+
+def build_context(
+    qvec: np.ndarray,
+    corpora: Sequence[str],
+    k: int,
+    loader: Callable[[str], Corpus] = load_corpus,
+    maxctx: int = 4000,
+    min_per_corpus: int = 0,
+    max_per_corpus: Optional[int] = None,
+    question: Optional[str] = None,
+) -> str:
+    """
+    Retrieve the global top-k chunks across ``corpora`` and pack them by
+    score into at most ``maxctx`` characters. Returns "" when nothing was
+    found. ``loader`` lets the resident server hand in corpora it already
+    holds in memory; with the ``question`` text, BM25 hits are fused in.
+    """
+    opened: List[Corpus] = []
+    with citl_trace.stage("load_corpus"):
+        for name in corpora:
+            try:
+                opened.append(loader(name))
+            except FileNotFoundError as e:
+                print(f"[ERROR] {e}")
+    if not opened:
+        return ""
+
+    with citl_trace.stage("retrieve"):
+        merged = merged_corpora(opened)
+        hits = merged.search(qvec, k, min_per_corpus, max_per_corpus, text=question)
+        return pack_context(merged, hits, maxctx)
+
+
+def answer_question(
+    question: str,
+    corpora: Sequence[str],
+    k: int,
+    maxctx: int,
+    loader: Callable[[str], Corpus] = load_corpus,
+    on_token: Optional[TokenCallback] = None,
+    cache: Optional[QueryCache] = None,
+    min_per_corpus: int = 0,
+    max_per_corpus: Optional[int] = None,
+) -> str:
+    """
+    Full RAG round trip: embed, retrieve, generate (streamed via on_token).
+    """
+    with citl_trace.trace("rag", question):
+        with citl_trace.stage("embed"):
+            qvec = embed(question, cache)
+        ctx = build_context(qvec, corpora, k, loader, maxctx, min_per_corpus, max_per_corpus, question)
+        if not ctx:
+            citl_trace.note(path="no_context")
+            if on_token is not None:
+                on_token(NO_CONTEXT)
+            return NO_CONTEXT
+        with citl_trace.stage("generate"):
+            return generate_answer(question, ctx, on_token=on_token, cache=cache)
+
+
+def answer_batch(
+    records: Sequence[dict],
+    corpora: Sequence[str],
+    k: int,
+    maxctx: int,
+    out,
+    loader: Callable[[str], Corpus] = load_corpus,
+    cache: Optional[QueryCache] = None,
+    min_per_corpus: int = 0,
+    max_per_corpus: Optional[int] = None,
+    workers: int = citl_batch.DEFAULT_GEN_WORKERS,
+) -> int:
+    """
+    --batch mode: embed all questions together, retrieve for all of them
+    with one Q @ E.T per block, then generate through a bounded pool and
+    write answers to ``out`` in order. Returns the number of failures.
+    """
+    questions = [str(r["question"]) for r in records]
+    contexts = [""] * len(records)
+    opened: List[Corpus] = []
+    # Retrieval is shared by the whole batch, so it is traced once; each
+    # answer then gets its own trace (see citl_batch.write_answers)
+    with citl_trace.trace("rag_batch", f"{len(records)} questions"):
+        # Keep stdout clean for the answers JSONL
+        with contextlib.redirect_stdout(sys.stderr), citl_trace.stage("load_corpus"):
+            for name in corpora:
+                try:
+                    opened.append(loader(name))
+                except FileNotFoundError as e:
+                    print(f"[ERROR] {e}")
+
+        if opened and records:
+            with citl_trace.stage("embed"):
+                qmat = citl_batch.embed_questions(questions, EMBED_MODEL, cache)
+            with citl_trace.stage("retrieve"):
+                merged = merged_corpora(opened)
+                batch_hits = merged.search_batch(qmat, k, min_per_corpus, max_per_corpus, questions)
+                for i, hits in enumerate(batch_hits):
+                    contexts[i] = pack_context(merged, hits, maxctx)
+
+    def answer(job: dict) -> str:
+        if not job["context"]:
+            return NO_CONTEXT
+        return generate_answer(job["record"]["question"], job["context"], cache=cache)
+
+    jobs = [{"record": r, "context": c} for r, c in zip(records, contexts)]
+    return citl_batch.write_answers(jobs, answer, out, workers, tool="rag")
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(
-        description="CITL multi-corpus RAG over Factbook, Law, Nursing, Dictionary."
+        description="CITL multi-corpus RAG over the corpora in the index folder."
     )
     parser.add_argument(
         "--source",
-        choices=["factbook", "law", "nursing", "dictionary", "all"],
         default="factbook",
-        help="Which corpus to use (or 'all' to combine).",
+        help="Which corpus to use (or 'all' to combine). "
+        f"Found in {INDEX_DIR.name}/: {', '.join(discover(INDEX_DIR)) or 'none'}.",
     )
     parser.add_argument(
         "-k",
         "--topk",
         type=int,
         default=5,
-        help="Number of chunks per corpus to retrieve.",
+        help="Number of chunks to retrieve (global top-k across the selected corpora).",
+    )
+    parser.add_argument(
+        "--min-per-corpus",
+        type=int,
+        default=0,
+        help="With --source all: always include this many hits from each corpus.",
+    )
+    parser.add_argument(
+        "--max-per-corpus",
+        type=int,
+        default=None,
+        help="With --source all: never take more than this many hits from one corpus.",
     )
     parser.add_argument(
         "--maxctx",
@@ -127,45 +493,131 @@ def main() -> None:
         default=4000,
         help="Maximum characters of context to send to the LLM.",
     )
-    parser.add_argument("question", help="User question.")
+    parser.add_argument(
+        "--server",
+        action="store_true",
+        help=f"Ask a running citl_rag_server.py ({DEFAULT_SERVER}, set CITL_RAG_SERVER "
+        "to change) instead of loading corpora in this process.",
+    )
+    parser.add_argument(
+        "--no-stream",
+        action="store_true",
+        help="Wait for the whole answer instead of printing tokens as they arrive.",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Bypass the query/answer cache (index/query_cache.sqlite).",
+    )
+    parser.add_argument(
+        "--cache-stats",
+        action="store_true",
+        help="Print query cache hit/miss counters after answering.",
+    )
+    citl_batch.add_batch_args(parser)
+    citl_trace.add_profile_args(parser)
+    parser.add_argument("question", nargs="?", help="User question (omit with --batch).")
     args = parser.parse_args()
-
-    if args.source == "all":
-        corpora = ["factbook", "law", "nursing", "dictionary"]
-    else:
-        corpora = [args.source]
-
-    print(f"[INFO] Using corpora: {', '.join(corpora)}")
-
-    qvec = embed(args.question)
-
-    ctx_parts: List[str] = []
-
-    for name in corpora:
+    if not args.batch and not args.question:
+        parser.error("a question is required unless --batch is given")
+    if args.batch and args.server:
+        parser.error("--batch answers locally; it cannot be combined with --server")
+
+    # Resolved even with --server: the local fallback needs real names
+    # (the server gets the raw --source and resolves it itself)
+    try:
+        corpora = resolve_corpora(args.source)
+    except FileNotFoundError as e:
+        parser.error(str(e))
+    print(f"[INFO] Using corpora: {', '.join(corpora)}", file=sys.stderr if args.batch else sys.stdout)
+
+    tracer = citl_trace.enable_from_args(args, import_seconds=_IMPORTED - _T_IMPORT)
+    try:
+        run(args, corpora)
+    except ModelMismatchError as e:
+        print(f"[ERROR] {e}", file=sys.stderr if args.batch else sys.stdout)
+        sys.exit(1)
+    finally:
+        citl_trace.print_summary(tracer)
+
+
+def run(args, corpora: List[str]) -> None:
+    if args.batch:
+        records = citl_batch.read_questions(args.batch)
+        cache = None if args.no_cache else QueryCache()
+        out = citl_batch.open_output(args.out)
+        t0 = time.perf_counter()
         try:
-            emb, chunks = load_corpus(name)
-        except FileNotFoundError as e:
-            print(f"[ERROR] {e}")
-            continue
-
-        hits = top_k(emb, chunks, qvec, args.topk)
-        if not hits:
-            continue
-
-        header = f"Source: {name.upper()}"
-        ctx_parts.append(header)
-        ctx_parts.append("---")
-        ctx_parts.append("\n---\n".join(hits))
-
-    if not ctx_parts:
-        print("I could not find any relevant context in the selected corpus/corpora.")
+            errors = answer_batch(
+                records,
+                corpora,
+                args.topk,
+                args.maxctx,
+                out,
+                cache=cache,
+                min_per_corpus=args.min_per_corpus,
+                max_per_corpus=args.max_per_corpus,
+                workers=args.gen_workers,
+            )
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        print(citl_batch.report(len(records), time.perf_counter() - t0, errors), file=sys.stderr)
+        if cache is not None and args.cache_stats:
+            print(cache.report(), file=sys.stderr)
         return
 
-    full_ctx = "\n\n".join(ctx_parts)
-    full_ctx = full_ctx[: args.maxctx]
-
-    answer = generate_answer(args.question, full_ctx)
-    print(answer)
+    printer = None if args.no_stream else TokenPrinter()
+
+    if args.server:
+        with citl_trace.trace("rag", args.question):
+            citl_trace.note(path="server")
+            with citl_trace.stage("server"):
+                try:
+                    answer = ask_server(
+                        DEFAULT_SERVER,
+                        "/rag",
+                        {
+                            "question": args.question,
+                            "source": args.source,
+                            "topk": args.topk,
+                            "maxctx": args.maxctx,
+                            "min_per_corpus": args.min_per_corpus,
+                            "max_per_corpus": args.max_per_corpus,
+                        },
+                        on_token=printer,
+                    )
+                except RuntimeError as e:
+                    # The server answered with an error (bad source, failed query)
+                    if printer is not None and printer.ttft is not None:
+                        printer.finish()  # end the partial answer's line
+                    print(f"[ERROR] {e}")
+                    sys.exit(1)
+        if answer is not None:
+            if printer is not None:
+                printer.finish(report=True)
+            else:
+                print(answer)
+            return
+        print(f"[WARN] RAG server at {DEFAULT_SERVER} unreachable; answering locally.")
+
+    cache = None if args.no_cache else QueryCache()
+    answer = answer_question(
+        args.question,
+        corpora,
+        args.topk,
+        args.maxctx,
+        on_token=printer,
+        cache=cache,
+        min_per_corpus=args.min_per_corpus,
+        max_per_corpus=args.max_per_corpus,
+    )
+    if printer is not None:
+        printer.finish(report=True)
+    else:
+        print(answer)
+    if cache is not None and args.cache_stats:
+        print(cache.report(), file=sys.stderr)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+"""
+Ollama client shared by the CITL tools.
+
+Every call to Ollama (chunk and query embeddings, answer generation,
+lecture summaries) goes through one OllamaClient:
+
+  - a pooled keep-alive requests.Session, so indexing and batch runs reuse
+    TCP connections instead of opening one per request
+  - per-call timeouts (plus a short connect timeout), and retries with
+    exponential backoff on connection errors and 429/502/503/504
+  - a process-wide limit on requests in flight, so embedding workers,
+    batch generation and server threads cannot pile onto Ollama at once
+  - an optional keep_alive hint so Ollama keeps the models loaded
+  - one parser for both /api/embed and legacy /api/embeddings responses
+
+generate() streams Ollama's NDJSON chunks as they arrive and hands each
+token to ``on_token`` (stdout, the TTS pipe, a server response...), or does
+a single blocking request when no callback is given. Either way the result
+records time-to-first-token and Ollama's own timing fields, which are also
+added to the current query trace when tracing is on (see citl_trace.py).
+
+Environment:
+  OLLAMA_HOST             - server address (default: http://127.0.0.1:11434;
+                            "host:port" without a scheme works too)
+  CITL_OLLAMA_KEEP_ALIVE  - keep_alive sent with every request, e.g. "30m"
+                            or "-1" (default: unset, Ollama's own 5m)
+  CITL_OLLAMA_CONCURRENCY - max requests in flight per process (default: 8)
+  CITL_OLLAMA_RETRIES     - retries per request (default: 3)
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+import contextlib
+from typing import Callable, Iterator, List, Optional, Sequence, TextIO
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+import citl_trace
+
+TokenCallback = Callable[[str], None]
+
+
+def normalize_host(host: str) -> str:
+    """
+    Accept the forms Ollama itself accepts for OLLAMA_HOST ("0.0.0.0",
+    "127.0.0.1:11434", "http://box:11434/") and return a base URL.
+    """
+    host = host.strip().rstrip("/")
+    if "://" in host:
+        # An explicit scheme keeps its own default port, as in Ollama
+        scheme, rest = host.split("://", 1)
+    else:
+        scheme, rest = "http", host
+        netloc, _, path = rest.partition("/")
+        if ":" not in netloc.rsplit("]", 1)[-1]:
+            rest = f"{netloc}:11434" + (f"/{path}" if path else "")
+    if rest.startswith("0.0.0.0"):
+        # A bind-all address on the server side means "this machine" here
+        rest = "127.0.0.1" + rest[len("0.0.0.0"):]
+    return f"{scheme}://{rest}"
+
+
+OLLAMA_HOST = normalize_host(os.environ.get("OLLAMA_HOST", "http://127.0.0.1:11434"))
+KEEP_ALIVE = os.environ.get("CITL_OLLAMA_KEEP_ALIVE") or None
+MAX_INFLIGHT = int(os.environ.get("CITL_OLLAMA_CONCURRENCY", "8"))
+RETRIES = int(os.environ.get("CITL_OLLAMA_RETRIES", "3"))
+BACKOFF = 0.5
+CONNECT_TIMEOUT = 10.0
+RETRY_STATUS = frozenset({429, 502, 503, 504})
+
+
+# ---------------------------------------------------------------------
+# Response parsing
+# ---------------------------------------------------------------------
+
+def parse_embeddings(data) -> List[list]:
+    """
+    Pull every embedding vector out of an Ollama response, in order.
+
+    Handles responses shaped like:
+      {"embeddings": [[...], [...]]}
+      {"embedding": [...]}
+      {"embeddings": [{"embedding": [...]}, ...]}
+      [{"embedding": [...]}, ...]
+      [[...], [...]]
+    """
+    items = None
+    if isinstance(data, dict):
+        if "embeddings" in data:
+            items = data["embeddings"]
+        elif "embedding" in data:
+            items = [data["embedding"]]
+    elif isinstance(data, list):
+        items = data
+
+    if not items:
+        raise RuntimeError(f"Could not find embedding in Ollama response: {data}")
+
+    # A bare vector of floats means a single embedding
+    if not isinstance(items[0], (list, dict)):
+        items = [items]
+
+    vecs: List[list] = []
+    for item in items:
+        if isinstance(item, dict):
+            if "embedding" in item:
+                vecs.append(item["embedding"])
+            elif "embeddings" in item:
+                vecs.extend(parse_embeddings(item))
+            else:
+                raise RuntimeError(f"Could not find embedding in Ollama response: {data}")
+        else:
+            vecs.append(item)
+    return vecs
+
+
+def normalize_rows(mat: np.ndarray) -> np.ndarray:
+    """
+    L2-normalize each row in place (same epsilon the indexers always used).
+    """
+    mat /= (np.linalg.norm(mat, axis=1, keepdims=True) + 1e-8)
+    return mat
+
+
+# ---------------------------------------------------------------------
+# Results
+# ---------------------------------------------------------------------
+
+class Generation:
+    """
+    Result of one /api/generate call.
+
+      text    - full response text (stripped)
+      ttft    - seconds until the first non-empty token (None if blocking)
+      seconds - wall time of the whole call
+      meta    - Ollama's final object (eval_count, eval_duration, ...)
+    """
+
+    def __init__(self, text: str, ttft: Optional[float], seconds: float, meta: dict):
+        self.text = text
+        self.ttft = ttft
+        self.seconds = seconds
+        self.meta = meta
+
+    def timing(self) -> str:
+        if self.ttft is None:
+            return f"[INFO] answer in {self.seconds:.2f}s (blocking)"
+        return f"[INFO] first token after {self.ttft * 1000:.0f} ms, answer in {self.seconds:.2f}s"
+
+
+# ---------------------------------------------------------------------
+# Client
+# ---------------------------------------------------------------------
+
+class OllamaClient:
+    """
+    Pooled, rate-limited HTTP client for one Ollama server. Thread-safe;
+    share one per process (see get_client()).
+    """
+
+    def __init__(
+        self,
+        host: str = OLLAMA_HOST,
+        max_inflight: int = MAX_INFLIGHT,
+        retries: int = RETRIES,
+        backoff: float = BACKOFF,
+        keep_alive: Optional[str] = KEEP_ALIVE,
+    ):
+        self.host = normalize_host(host)
+        self.retries = max(0, int(retries))
+        self.backoff = backoff
+        self.keep_alive = keep_alive
+        self.max_inflight = max(1, int(max_inflight))
+        self._slots = threading.BoundedSemaphore(self.max_inflight)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_inflight)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def url(self, path: str) -> str:
+        return f"{self.host}{path}"
+
+    @contextlib.contextmanager
+    def post(self, path: str, body: dict, timeout: float, stream: bool = False) -> Iterator[requests.Response]:
+        """
+        POST JSON to ``path`` and yield the response once it has a good
+        status. A slot of the concurrency limit is held until the block
+        exits (i.e. for the whole stream).
+        """
+        if self.keep_alive is not None and "keep_alive" not in body:
+            body = dict(body, keep_alive=self.keep_alive)
+        with self._slots:
+            r = self._send(path, body, timeout, stream)
+            try:
+                yield r
+            finally:
+                r.close()
+
+    def _send(self, path: str, body: dict, timeout: float, stream: bool) -> requests.Response:
+        url = self.url(path)
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            try:
+                r = self.session.post(url, json=body, timeout=(CONNECT_TIMEOUT, timeout), stream=stream)
+            except (requests.ConnectionError, requests.ConnectTimeout) as e:
+                # Nothing was generated yet, so the request is safe to repeat
+                if last:
+                    raise
+                reason = type(e).__name__
+            else:
+                if r.status_code not in RETRY_STATUS or last:
+                    if r.status_code >= 400:
+                        _raise_for_status(r)
+                    return r
+                reason = f"HTTP {r.status_code}"
+                r.close()
+            delay = self.backoff * (2 ** attempt)
+            print(f"[WARN] Ollama {path}: {reason}; retrying in {delay:.1f}s", file=sys.stderr)
+            time.sleep(delay)
+        raise AssertionError("unreachable")
+
+    def post_json(self, path: str, body: dict, timeout: float = 120.0) -> dict:
+        with self.post(path, body, timeout) as r:
+            return r.json()
+
+    def embed(self, texts: Sequence[str], model: str, timeout: float = 300.0) -> np.ndarray:
+        """
+        Embed texts with one /api/embed request. Returns (len(texts), D)
+        row-normalized float32 vectors.
+        """
+        data = self.post_json("/api/embed", {"model": model, "input": list(texts)}, timeout)
+        vecs = parse_embeddings(data)
+        if len(vecs) != len(texts):
+            raise RuntimeError(
+                f"Ollama returned {len(vecs)} embeddings for a batch of {len(texts)}"
+            )
+        return normalize_rows(np.asarray(vecs, dtype=np.float32))
+
+    def generate(
+        self,
+        payload: dict,
+        on_token: Optional[TokenCallback] = None,
+        timeout: float = 600.0,
+    ) -> Generation:
+        """
+        POST ``payload`` to /api/generate.
+
+        With ``on_token`` the request is sent with "stream": true and every
+        token is passed to the callback as soon as its NDJSON line arrives.
+        Without it, the old blocking "stream": false request is used.
+        """
+        t0 = time.perf_counter()
+
+        if on_token is None:
+            data = self.post_json("/api/generate", dict(payload, stream=False), timeout)
+            text = str(data.get("response", ""))
+            gen = Generation(text.strip(), None, time.perf_counter() - t0, data)
+            citl_trace.record_generation(gen)
+            return gen
+
+        parts = []
+        ttft = None
+        meta: dict = {}
+        with self.post("/api/generate", dict(payload, stream=True), timeout, stream=True) as r:
+            for line in r.iter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                if data.get("error"):
+                    raise RuntimeError(f"Ollama error: {data['error']}")
+                token = data.get("response", "")
+                if token:
+                    if ttft is None:
+                        ttft = time.perf_counter() - t0
+                    parts.append(token)
+                    on_token(token)
+                if data.get("done"):
+                    meta = data
+                    break
+
+        gen = Generation("".join(parts).strip(), ttft, time.perf_counter() - t0, meta)
+        citl_trace.record_generation(gen)
+        return gen
+
+    def close(self) -> None:
+        self.session.close()
+
+
+def _raise_for_status(r: requests.Response) -> None:
+    """
+    raise_for_status() with Ollama's own error message attached.
+    """
+    try:
+        detail = r.json().get("error")
+    except ValueError:
+        detail = None
+    try:
+        r.raise_for_status()
+    except requests.HTTPError as e:
+        r.close()
+        if detail:
+            raise requests.HTTPError(f"{e} ({detail})", response=r) from None
+        raise
+
+
+_client: Optional[OllamaClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> OllamaClient:
+    """
+    The process-wide client (created on first use).
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = OllamaClient()
+        return _client
+
+
+def embed(texts: Sequence[str], model: str, timeout: float = 300.0) -> np.ndarray:
+    return get_client().embed(texts, model, timeout)
+
+
+def generate(
+    payload: dict,
+    on_token: Optional[TokenCallback] = None,
+    timeout: float = 600.0,
+) -> Generation:
+    return get_client().generate(payload, on_token, timeout)
+
+
+# ---------------------------------------------------------------------
+# Token output
+# ---------------------------------------------------------------------
+
+class TokenPrinter:
+    """
+    on_token callback that writes tokens to a stream as they arrive.
+
+    Leading whitespace is dropped (the blocking path strips it too) and
+    finish() ends the line, so piped output matches the old behavior.
+    The printer also measures time to first token from its creation, i.e.
+    what the user actually waits for (retrieval included).
+    """
+
+    def __init__(self, out: TextIO = sys.stdout):
+        self.out = out
+        self.started = False
+        self.t0 = time.perf_counter()
+        self.ttft: Optional[float] = None
+
+    def __call__(self, token: str) -> None:
+        if not self.started:
+            token = token.lstrip()
+            if not token:
+                return
+            self.started = True
+            self.ttft = time.perf_counter() - self.t0
+        self.out.write(token)
+        self.out.flush()
+
+    def finish(self, report: bool = False) -> None:
+        """
+        End the output line; with ``report`` print the timing to stderr.
+        """
+        self.out.write("\n")
+        self.out.flush()
+        if report and self.ttft is not None:
+            total = time.perf_counter() - self.t0
+            print(
+                f"[INFO] first token after {self.ttft * 1000:.0f} ms, answer in {total:.2f}s",
+                file=sys.stderr,
+            )
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Quantized embedding storage and vectorized scoring.
+
+  float32 - 4 bytes/dim, exact
+  float16 - 2 bytes/dim
+  int8    - 1 byte/dim + one float32 scale per vector: row ~= codes * scale,
+            scale = max|row| / 127 (rows are unit length, so the error is
+            bounded per row)
+
+An int8 corpus is stored as <name>.emb.npy (int8 codes) plus
+<name>.scale.npy. Quantized builds also keep a float32 copy as
+<name>.full.npy (unless --no-full) that is only memory-mapped: the top
+candidates are re-scored against it, so ranking stays exact while the
+resident matrix is 4x smaller.
+
+Scoring works in row blocks, so a float16/int8 matrix is never upcast to
+float32 all at once (numpy would otherwise copy the whole matrix on every
+query). The int8 -> float32 cast is cheap; numpy's float16 cast is not, so
+int8 is both the smaller and the faster option on CPU.
+
+Environment:
+  CITL_RERANK - "1" (default) re-rank quantized hits against <name>.full.npy
+
+Accuracy vs memory vs latency on an existing float32 corpus:
+  python citl_quant.py compare --name nursing -k 10
+"""
+
+import os
+import time
+import argparse
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+
+SCALE_SUFFIX = ".scale.npy"
+FULL_SUFFIX = ".full.npy"
+RERANK = os.environ.get("CITL_RERANK", "1") != "0"
+# Candidates re-scored at full precision per requested hit
+RERANK_FACTOR = 4
+RERANK_MIN = 50
+
+# Rows per block when scoring reduced-precision matrices: small enough
+# that the float32 temporary (3 MB at 768 dims) stays in cache
+BLOCK_ROWS = 1 << 10
+
+
+def quantize_int8(mat: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (N, D) float -> ((N, D) int8 codes, (N,) float32 scales).
+    """
+    mat = np.asarray(mat, dtype=np.float32)
+    scale = np.abs(mat).max(axis=1) / 127.0 if mat.size else np.zeros(mat.shape[0], np.float32)
+    scale = np.maximum(scale, 1e-12).astype(np.float32)
+    codes = np.clip(np.rint(mat / scale[:, None]), -127, 127).astype(np.int8)
+    return codes, scale
+
+
+class Int8Matrix:
+    """
+    Read-only (N, D) matrix stored as int8 codes with per-row scales.
+
+    Indexing returns dequantized float32 rows and ``m @ q`` scores a query
+    vector block by block, so code written for a float matrix (emb[ids],
+    emb[a:b], emb @ qvec) works unchanged.
+    """
+
+    dtype = np.dtype("int8")
+    ndim = 2
+
+    def __init__(self, codes: np.ndarray, scale: np.ndarray):
+        if codes.shape[0] != scale.shape[0]:
+            raise ValueError(f"{codes.shape[0]} int8 rows but {scale.shape[0]} scales")
+        self.codes = codes
+        self.scale = scale
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.codes.shape
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.scale.nbytes
+
+    def __len__(self) -> int:
+        return self.codes.shape[0]
+
+    def __getitem__(self, idx) -> np.ndarray:
+        codes = np.asarray(self.codes[idx], dtype=np.float32)
+        scale = self.scale[idx]
+        if codes.ndim == 1:
+            return codes * scale
+        return codes * scale[:, None]
+
+    def __array__(self, dtype=None, copy=None):
+        out = self[:]
+        return out if dtype is None else out.astype(dtype)
+
+    def __matmul__(self, q: np.ndarray) -> np.ndarray:
+        return score(self, q)
+
+
+def score(emb, qmat: np.ndarray) -> np.ndarray:
+    """
+    emb @ q for one query (D,) -> (N,), or a batch (Q, D) -> (Q, N).
+
+    float32 matrices go straight to BLAS; float16 and int8 ones are upcast
+    one block of rows at a time.
+    """
+    single = qmat.ndim == 1
+    q = np.asarray(qmat, dtype=np.float32).reshape(-1, emb.shape[1])
+    if isinstance(emb, np.ndarray) and emb.dtype == np.float32:
+        out = q @ emb.T
+        return out[0] if single else out
+
+    n = emb.shape[0]
+    out = np.empty((q.shape[0], n), dtype=np.float32)
+    codes = emb.codes if isinstance(emb, Int8Matrix) else emb
+    for lo in range(0, n, BLOCK_ROWS):
+        block = np.asarray(codes[lo : lo + BLOCK_ROWS], dtype=np.float32)
+        out[:, lo : lo + BLOCK_ROWS] = q @ block.T
+    if isinstance(emb, Int8Matrix):
+        out *= emb.scale[None, :]
+    return out[0] if single else out
+
+
+def stack(matrices: List) -> object:
+    """
+    Concatenate corpus matrices for merged search, keeping int8 as int8
+    when every part is int8; otherwise the smallest common float dtype.
+    """
+    if all(isinstance(m, Int8Matrix) for m in matrices):
+        return Int8Matrix(
+            np.concatenate([np.asarray(m.codes) for m in matrices]),
+            np.concatenate([np.asarray(m.scale) for m in matrices]),
+        )
+    dtypes = [np.float16 if isinstance(m, Int8Matrix) else m.dtype for m in matrices]
+    dtype = np.result_type(*dtypes)
+    return np.concatenate([np.asarray(m[:] if isinstance(m, Int8Matrix) else m, dtype=dtype) for m in matrices])
+
+
+def rerank(full: np.ndarray, ids: np.ndarray, qvec: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Re-score candidate rows against the float32 matrix, return the top k.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    if ids.shape[0] == 0:
+        return ids, np.zeros(0, dtype=np.float32)
+    order = np.argsort(ids)
+    exact = np.asarray(full[ids[order]], dtype=np.float32) @ qvec
+    sims = np.empty_like(exact)
+    sims[order] = exact
+    top = np.argsort(-sims, kind="stable")[:k]
+    return ids[top], sims[top]
+
+
+def rerank_depth(k: int) -> int:
+    return max(k * RERANK_FACTOR, RERANK_MIN)
+
+
+# ---------------------------------------------------------------------
+# Comparison report
+# ---------------------------------------------------------------------
+
+def compare(emb32: np.ndarray, queries: np.ndarray, k: int) -> List[dict]:
+    """
+    Recall@k against float32 exact search, resident bytes and mean query
+    latency for float16, int8 and int8 + float32 re-rank.
+    """
+    def run(fn):
+        out, times = [], []
+        for q in queries:
+            t0 = time.perf_counter()
+            out.append(fn(q))
+            times.append(time.perf_counter() - t0)
+        return out, float(np.mean(times) * 1000)
+
+    def top(sims, n):
+        n = min(n, sims.shape[0])
+        idx = np.argpartition(-sims, n - 1)[:n]
+        return idx[np.argsort(-sims[idx])]
+
+    truth, t32 = run(lambda q: top(score(emb32, q), k))
+    emb16 = emb32.astype(np.float16)
+    emb8 = Int8Matrix(*quantize_int8(emb32))
+
+    rows = [("float32", emb32.nbytes, truth, t32)]
+    res, t = run(lambda q: top(score(emb16, q), k))
+    rows.append(("float16", emb16.nbytes, res, t))
+    res, t = run(lambda q: top(score(emb8, q), k))
+    rows.append(("int8", emb8.nbytes, res, t))
+    res, t = run(lambda q: rerank(emb32, top(score(emb8, q), rerank_depth(k)), q, k)[0])
+    rows.append(("int8+rerank", emb8.nbytes, res, t))
+
+    report = []
+    for name, nbytes, res, ms in rows:
+        hits = sum(len(set(a.tolist()) & set(b.tolist())) for a, b in zip(truth, res))
+        report.append({
+            "storage": name,
+            "mb": nbytes / 2**20,
+            "ratio": emb32.nbytes / nbytes,
+            "recall": hits / max(1, len(truth) * k),
+            "mean_ms": ms,
+        })
+    return report
+
+
+def main() -> None:
+    from citl_corpus import INDEX_DIR, open_corpus
+    from citl_vector_index import sample_queries
+
+    ap = argparse.ArgumentParser(description="Compare quantized embedding storage.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    c = sub.add_parser("compare", help="Accuracy vs memory vs latency on a corpus")
+    c.add_argument("--name", required=True)
+    c.add_argument("--index-dir", default=str(INDEX_DIR))
+    c.add_argument("-k", type=int, default=10)
+    c.add_argument("--queries", type=int, default=200)
+    args = ap.parse_args()
+
+    corpus = open_corpus(Path(args.index_dir), args.name)
+    emb32 = np.ascontiguousarray(corpus.full if corpus.full is not None else corpus.emb[:], dtype=np.float32)
+    queries = sample_queries(emb32, args.queries)
+    rows = compare(emb32, queries, args.k)
+
+    print(f"{args.name}: {emb32.shape[0]} chunks x {emb32.shape[1]} dims, "
+          f"{len(queries)} queries, k={args.k}")
+    print(f"{'storage':<13}{'MB':>9}{'smaller':>9}{'recall@k':>10}{'mean ms':>10}")
+    for r in rows:
+        print(f"{r['storage']:<13}{r['mb']:>9.1f}{r['ratio']:>8.1f}x{r['recall']:>10.3f}{r['mean_ms']:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Thin client for citl_rag_server.py.
+
+Uses only the standard library, so asking the resident server costs a
+Python start-up and one local HTTP round trip: no numpy, no corpus loads.
+
+  python citl_rag_client.py --source all "What is a tort?"
+  python citl_rag_client.py --factbook "capital:laos"
+
+The server URL comes from CITL_RAG_SERVER (default: http://127.0.0.1:8765).
+"""
+
+import os
+import sys
+import json
+import argparse
+import urllib.error
+import urllib.request
+from typing import Callable, Optional
+
+DEFAULT_SERVER = os.environ.get("CITL_RAG_SERVER", "http://127.0.0.1:8765")
+
+
+def ask_server(
+    server: str,
+    path: str,
+    payload: dict,
+    timeout: float = 900.0,
+    on_token: Optional[Callable[[str], None]] = None,
+) -> Optional[str]:
+    """
+    POST a query to the server and return its answer text.
+
+    With ``on_token`` the server streams NDJSON ({"token": ...} lines, then
+    {"done": true, "answer": ...}) and each token is passed on as it arrives.
+
+    Returns None when the server cannot be reached so callers can fall back
+    to answering in-process; server-side errors are raised as RuntimeError.
+    """
+    if on_token is not None:
+        payload = dict(payload, stream=True)
+    req = urllib.request.Request(
+        server.rstrip("/") + path,
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    try:
+        resp = urllib.request.urlopen(req, timeout=timeout)
+    except urllib.error.HTTPError as e:
+        detail = e.read().decode("utf-8", errors="replace")
+        raise RuntimeError(f"RAG server error {e.code}: {detail}") from e
+    except (urllib.error.URLError, ConnectionError, TimeoutError):
+        return None
+
+    with resp:
+        if on_token is None:
+            data = json.loads(resp.read().decode("utf-8"))
+            return str(data.get("answer", ""))
+
+        for line in resp:
+            if not line.strip():
+                continue
+            data = json.loads(line.decode("utf-8"))
+            if "error" in data:
+                raise RuntimeError(f"RAG server error: {data['error']}")
+            if data.get("done"):
+                return str(data.get("answer", ""))
+            on_token(str(data.get("token", "")))
+    raise RuntimeError("RAG server closed the stream before the answer was done")
+
+
+def _write_token(token: str) -> None:
+    sys.stdout.write(token)
+    sys.stdout.flush()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Ask a running CITL RAG server.")
+    ap.add_argument("question", help="Question (or Factbook shortcut with --factbook).")
+    ap.add_argument(
+        "--factbook",
+        action="store_true",
+        help="Use query_factbook semantics (shortcuts like capital:laos, --regex).",
+    )
+    ap.add_argument("--regex", action="store_true", help="Raw regex over factbook.txt.")
+    ap.add_argument(
+        "--source",
+        default="factbook",
+        help="Corpus for multi-corpus RAG (factbook, law, nursing, dictionary, all).",
+    )
+    ap.add_argument("-k", "--topk", type=int, default=None)
+    ap.add_argument("--maxctx", type=int, default=None)
+    ap.add_argument("--min-per-corpus", type=int, default=None)
+    ap.add_argument("--max-per-corpus", type=int, default=None)
+    ap.add_argument("--server", default=DEFAULT_SERVER, help="Server URL.")
+    ap.add_argument(
+        "--no-stream",
+        action="store_true",
+        help="Wait for the whole answer instead of printing tokens as they arrive.",
+    )
+    args = ap.parse_args()
+
+    if args.factbook or args.regex:
+        path = "/factbook"
+        payload = {"query": args.question, "regex": args.regex}
+    else:
+        path = "/rag"
+        payload = {"question": args.question, "source": args.source}
+        if args.min_per_corpus is not None:
+            payload["min_per_corpus"] = args.min_per_corpus
+        if args.max_per_corpus is not None:
+            payload["max_per_corpus"] = args.max_per_corpus
+    if args.topk is not None:
+        payload["topk"] = args.topk
+    if args.maxctx is not None:
+        payload["maxctx"] = args.maxctx
+
+    on_token = None if args.no_stream else _write_token
+    try:
+        answer = ask_server(args.server, path, payload, on_token=on_token)
+    except RuntimeError as e:
+        print(f"[ERROR] {e}")
+        sys.exit(1)
+    if answer is None:
+        print(f"[ERROR] RAG server not reachable at {args.server}. Start citl_rag_server.py first.")
+        sys.exit(1)
+    print("" if on_token else answer)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+Resident CITL RAG server.
+
+Loads every corpus in the index folder (or the --corpora given) into memory
+once and answers many concurrent questions over a local HTTP API, so each
+query only pays for embed + matmul + generate. Index files are watched: a
+corpus is hot-reloaded when an indexer rewrites it, and without --corpora a
+newly built one is picked up too.
+
+  python citl_rag_server.py                 # http://127.0.0.1:8765
+  python citl_multi_rag.py --server --source all "What is a tort?"
+  python query_factbook.py --server "capital:laos"
+  python citl_rag_client.py "..."           # stdlib-only thin client
+
+Endpoints:
+  GET  /health    - loaded corpora, chunk counts, load times, cache counters
+  GET  /metrics   - Prometheus histograms: query and per-stage latency,
+                    time to first token, Ollama eval times, token counts
+  POST /rag       - {"question", "source", "topk", "maxctx",
+                     "min_per_corpus", "max_per_corpus"}    -> {"answer"}
+  POST /factbook  - {"query", "regex", "topk", "maxctx"}     -> {"answer"}
+
+Add "stream": true to either POST to get chunked NDJSON tokens as they are
+generated ({"token": ...} lines, then {"done": true, "answer": ...}).
+
+Every query is traced (see citl_trace.py); set CITL_TRACE to also append
+the per-query trace lines to a JSONL file.
+"""
+
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import citl_multi_rag
+import citl_trace
+import query_factbook
+from citl_cache import QueryCache
+from citl_corpus import INDEX_DIR, Corpus, corpus_paths, manifest_path, open_corpus, quant_paths
+from citl_bm25 import bm25_path
+from citl_embed import EMBED_MODEL
+from citl_registry import ModelMismatchError, check_model, discover
+from citl_vector_index import ann_path
+from citl_ollama import TokenCallback, TokenPrinter
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+
+# ---------------------------------------------------------------------
+# Resident corpora with hot reload
+# ---------------------------------------------------------------------
+
+class ResidentCorpora:
+    """
+    Keeps opened corpora in memory and swaps one out when its files change.
+
+    Readers always get a consistent corpus (emb, chunks, ANN index): a reload builds the
+    new corpus fully before replacing the dict entry under the lock.
+    With ``names`` None the corpora are discovered from the index folder on
+    every check. A corpus embedded with another model than the query tools
+    use is refused.
+    """
+
+    def __init__(self, index_dir: Path, names: Optional[Sequence[str]] = None, poll: float = 5.0):
+        self.index_dir = Path(index_dir)
+        self.fixed = names is not None
+        self.names = list(names) if names is not None else discover(self.index_dir)
+        self.poll = poll
+        self._lock = threading.Lock()
+        self._corpora: Dict[str, Corpus] = {}
+        self._sigs: Dict[str, Optional[tuple]] = {}
+        self._loaded_at: Dict[str, float] = {}
+
+    def _signature(self, name: str) -> Optional[tuple]:
+        """
+        (mtime, size) of each index file, or None if the corpus is missing.
+        The offsets, IVF, BM25 and quantization files are optional (older
+        indexes rebuild offsets on open; without IVF the corpus is searched
+        exactly, without BM25 by vectors only).
+        """
+        emb_path, ch_path, off_path = corpus_paths(self.index_dir, name)
+        if not emb_path.exists() or not ch_path.exists():
+            return None
+        sig = []
+        extra = (
+            manifest_path(self.index_dir, name),
+            ann_path(self.index_dir, name),
+            bm25_path(self.index_dir, name),
+            *quant_paths(self.index_dir, name),
+        )
+        for p in (emb_path, ch_path, off_path, *extra):
+            try:
+                st = p.stat()
+                sig.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                sig.append(None)
+        return tuple(sig)
+
+    def _load(self, name: str) -> None:
+        sig = self._signature(name)
+        if sig is None:
+            with self._lock:
+                old = self._corpora.pop(name, None)
+                self._sigs[name] = None
+            if old is not None:
+                old.close()
+            return
+
+        t0 = time.perf_counter()
+        # Read into RAM (no mmap): this process exists to stay warm, and
+        # holding no file open lets the indexers replace the files
+        # (os.replace onto an open or mapped file fails on Windows). The
+        # float32 re-rank copy is not loaded; its rows are read per query.
+        corpus = open_corpus(self.index_dir, name, mmap=False)
+        try:
+            check_model(corpus, EMBED_MODEL)
+        except ModelMismatchError:
+            corpus.close()
+            # Not retried until the files change (i.e. it is rebuilt)
+            with self._lock:
+                self._sigs[name] = sig
+            raise
+        kind = corpus.index.kind
+        if corpus.lexical is not None:
+            kind += "+bm25"
+        if corpus.emb.dtype != "float32":
+            kind += f", {corpus.emb.dtype}" + (" + rerank" if corpus.reranks else "")
+        took = time.perf_counter() - t0
+
+        with self._lock:
+            old = self._corpora.get(name)
+            self._corpora[name] = corpus
+            self._sigs[name] = sig
+            self._loaded_at[name] = time.time()
+        if old is not None:
+            old.close()
+        print(
+            f"[INFO] Loaded {len(corpus)} chunks from {name} ({kind} search) in {took * 1000:.0f} ms",
+            flush=True,
+        )
+
+    def load_all(self) -> None:
+        for name in self.names:
+            try:
+                self._load(name)
+            except (OSError, RuntimeError, ValueError) as e:
+                print(f"[ERROR] Could not load corpus '{name}': {e}", flush=True)
+            if name not in self._corpora:
+                print(f"[WARN] Corpus '{name}' not available in {self.index_dir}", flush=True)
+
+    def get(self, name: str) -> Corpus:
+        with self._lock:
+            entry = self._corpora.get(name)
+        if entry is None:
+            raise FileNotFoundError(f"Corpus index not loaded for '{name}' in {self.index_dir}")
+        return entry
+
+    def resolve(self, source: str) -> List[str]:
+        """
+        "all" -> every resident corpus, otherwise the one (known) name.
+        """
+        with self._lock:
+            loaded = [n for n in self.names if n in self._corpora]
+        if source == "all":
+            return loaded
+        if source not in self.names:
+            raise ValueError(f"unknown source {source!r}; available: {', '.join(loaded) or 'none'}")
+        return [source]
+
+    def check_reload(self) -> None:
+        if not self.fixed:
+            found = discover(self.index_dir)
+            for name in found:
+                if name not in self.names:
+                    print(f"[INFO] New corpus '{name}' found", flush=True)
+            self.names = sorted(set(self.names) | set(found))
+        for name in self.names:
+            sig = self._signature(name)
+            if sig == self._sigs.get(name):
+                continue
+            # Give the indexer a moment to finish swapping all files in
+            time.sleep(0.5)
+            print(f"[INFO] Index files for '{name}' changed; reloading", flush=True)
+            try:
+                self._load(name)
+            except (OSError, RuntimeError, ValueError) as e:
+                # Keep serving the old copy until the files settle
+                print(f"[WARN] Reload of '{name}' failed, keeping old copy: {e}", flush=True)
+
+    def watch(self, stop: threading.Event) -> None:
+        while not stop.wait(self.poll):
+            self.check_reload()
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                name: {
+                    "chunks": int(c.emb.shape[0]),
+                    "dim": int(c.emb.shape[1]) if c.emb.ndim == 2 else 0,
+                    "dtype": str(c.emb.dtype),
+                    "search": c.index.kind,
+                    "bm25": c.lexical is not None,
+                    "loaded_at": self._loaded_at.get(name),
+                }
+                for name, c in self._corpora.items()
+            }
+
+
+# ---------------------------------------------------------------------
+# HTTP API
+# ---------------------------------------------------------------------
+
+class RagHandler(BaseHTTPRequestHandler):
+    server_version = "CITLRag/1.0"
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def corpora(self) -> ResidentCorpora:
+        return self.server.corpora
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+    def _send_json(self, code: int, obj: dict) -> None:
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self) -> dict:
+        n = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(n) if n else b"{}"
+        data = json.loads(raw.decode("utf-8"))
+        if not isinstance(data, dict):
+            raise ValueError("request body must be a JSON object")
+        return data
+
+    def do_GET(self):
+        if self.path == "/health":
+            health = {"status": "ok", "corpora": self.corpora.status()}
+            if self.server.cache is not None:
+                health["cache"] = self.server.cache.stats()
+            self._send_json(200, health)
+        elif self.path == "/metrics":
+            body = self.server.metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send_json(404, {"error": f"unknown path {self.path}"})
+
+    def _send_chunk(self, obj: dict) -> None:
+        line = (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+        self.wfile.flush()
+
+    def do_POST(self):
+        try:
+            req = self._read_json()
+        except (ValueError, UnicodeDecodeError) as e:
+            self._send_json(400, {"error": f"bad request: {e}"})
+            return
+
+        if self.path == "/rag":
+            run = self._rag
+        elif self.path == "/factbook":
+            run = self._factbook
+        else:
+            self._send_json(404, {"error": f"unknown path {self.path}"})
+            return
+
+        if req.get("stream"):
+            self._stream(run, req)
+            return
+
+        t0 = time.perf_counter()
+        try:
+            answer = run(req)
+        except (KeyError, ValueError) as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        except SystemExit as e:
+            # query_factbook reports missing files with SystemExit
+            self._send_json(500, {"error": str(e)})
+            return
+        except Exception as e:
+            self._send_json(500, {"error": f"{type(e).__name__}: {e}"})
+            return
+
+        self._send_json(200, {"answer": answer, "seconds": round(time.perf_counter() - t0, 3)})
+
+    def _stream(self, run, req: dict) -> None:
+        """
+        Stream tokens as chunked NDJSON: {"token": ...} lines as they are
+        generated, then {"done": true, "answer": ...} or {"error": ...}.
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        handler = self
+
+        class _ChunkWriter:
+            def write(self, token: str) -> None:
+                handler._send_chunk({"token": token})
+
+            def flush(self) -> None:
+                pass
+
+        t0 = time.perf_counter()
+        try:
+            answer = run(req, on_token=TokenPrinter(_ChunkWriter()))
+        except SystemExit as e:
+            self._send_chunk({"error": str(e)})
+        except Exception as e:
+            self._send_chunk({"error": f"{type(e).__name__}: {e}"})
+        else:
+            self._send_chunk(
+                {"done": True, "answer": answer, "seconds": round(time.perf_counter() - t0, 3)}
+            )
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _rag(self, req: dict, on_token: Optional[TokenCallback] = None) -> str:
+        question = str(req["question"])
+        source = str(req.get("source", "factbook"))
+        return citl_multi_rag.answer_question(
+            question,
+            self.corpora.resolve(source),
+            int(req.get("topk", 5)),
+            int(req.get("maxctx", 4000)),
+            loader=self.corpora.get,
+            on_token=on_token,
+            cache=self.server.cache,
+            min_per_corpus=int(req.get("min_per_corpus") or 0),
+            max_per_corpus=None if req.get("max_per_corpus") is None else int(req["max_per_corpus"]),
+        )
+
+    def _factbook(self, req: dict, on_token: Optional[TokenCallback] = None) -> str:
+        return query_factbook.answer_query(
+            str(req["query"]),
+            int(req.get("topk", 8)),
+            int(req.get("maxctx", 2400)),
+            use_regex=bool(req.get("regex", False)),
+            index_loader=lambda: self.corpora.get("factbook"),
+            on_token=on_token,
+            cache=self.server.cache,
+        )
+
+
+class RagServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        addr,
+        corpora: ResidentCorpora,
+        cache: Optional[QueryCache] = None,
+        verbose: bool = False,
+    ):
+        super().__init__(addr, RagHandler)
+        self.corpora = corpora
+        self.cache = cache
+        self.verbose = verbose
+        self.metrics = citl_trace.Metrics()
+        tracer = citl_trace.enable(citl_trace.env_path(), keep=False, metrics=self.metrics)
+        if tracer.path is not None:
+            print(f"[INFO] Appending query traces to {tracer.path}")
+
+
+# ---------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------
+
+def main() -> None:
+    ap = argparse.ArgumentParser(
+        description="Resident CITL RAG server (keeps all corpora in memory)."
+    )
+    ap.add_argument("--host", default=DEFAULT_HOST, help=f"Bind address (default: {DEFAULT_HOST})")
+    ap.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port (default: {DEFAULT_PORT})")
+    ap.add_argument(
+        "--index-dir",
+        default=str(INDEX_DIR),
+        help=f"Index directory (default: {INDEX_DIR})",
+    )
+    ap.add_argument(
+        "--corpora",
+        nargs="+",
+        default=None,
+        help="Corpora to keep resident (default: every corpus in --index-dir, "
+        "including ones built while the server runs)",
+    )
+    ap.add_argument(
+        "--poll",
+        type=float,
+        default=5.0,
+        help="Seconds between index file change checks (default: 5)",
+    )
+    ap.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Disable the shared query/answer cache",
+    )
+    ap.add_argument("-v", "--verbose", action="store_true", help="Log every request")
+    args = ap.parse_args()
+
+    corpora = ResidentCorpora(Path(args.index_dir), args.corpora, poll=args.poll)
+    corpora.load_all()
+
+    stop = threading.Event()
+    watcher = threading.Thread(target=corpora.watch, args=(stop,), daemon=True)
+    watcher.start()
+
+    cache = None if args.no_cache else QueryCache()
+    server = RagServer((args.host, args.port), corpora, cache=cache, verbose=args.verbose)
+    print(f"[INFO] CITL RAG server listening on http://{args.host}:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n[INFO] Shutting down.")
+    finally:
+        stop.set()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
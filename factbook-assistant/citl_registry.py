@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Manifest-driven corpus registry.
+
+Every corpus in an index directory carries its own <name>.manifest.json
+(written by the indexers, see citl_corpus.py): embed model, dimension,
+chunk count, dtype and a build hash. The registry
+
+  - discovers corpora from the directory listing, so adding a book is just
+    running build_corpus_index.py --name <book>; no code edits
+  - opens a corpus (memory-mapped) only when a query first asks for it
+  - refuses a corpus whose embed model differs from the query model, since
+    its vectors live in a different space and every hit would be noise
+
+  python citl_registry.py                       # list corpora + manifests
+  python citl_registry.py stamp --name law --model nomic-embed-text
+
+``stamp`` writes a manifest for a corpus built before manifests existed.
+"""
+
+import argparse
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from citl_corpus import (
+    CHUNKS_SUFFIX,
+    EMB_SUFFIX,
+    INDEX_DIR,
+    MANIFEST_SUFFIX,
+    Corpus,
+    corpus_exists,
+    open_corpus,
+    read_manifest,
+    write_manifest,
+)
+
+
+class ModelMismatchError(RuntimeError):
+    """
+    The corpus was embedded with a different model than the query.
+    """
+
+
+def discover(index_dir: Path = INDEX_DIR) -> List[str]:
+    """
+    Names of the complete corpora in ``index_dir`` (sorted). Only the
+    directory listing is read; no corpus file is opened.
+    """
+    index_dir = Path(index_dir)
+    if not index_dir.is_dir():
+        return []
+    files = {p.name for p in index_dir.iterdir()}
+    names = set()
+    for f in files:
+        for suffix in (MANIFEST_SUFFIX, EMB_SUFFIX):
+            if f.endswith(suffix):
+                name = f[: -len(suffix)]
+                # A manifest without data (or a half-swapped build) is skipped
+                if f"{name}{EMB_SUFFIX}" in files and f"{name}{CHUNKS_SUFFIX}" in files:
+                    names.add(name)
+    return sorted(names)
+
+
+def rebuild_hint(name: str, manifest: Optional[dict]) -> str:
+    meta = (manifest or {}).get("meta") or {}
+    src = meta.get("src")
+    if meta.get("rebuild"):
+        # Indexers that are not build_corpus_index.py record their own command
+        return meta["rebuild"]
+    if name == "factbook":
+        return "python build_factbook_index.py"
+    if src and not src.endswith(".json"):
+        return f'python build_corpus_index.py --src "{src}" --name {name}'
+    return f"python build_corpus_index.py --src <source.txt> --name {name}"
+
+
+def check_model(corpus: Corpus, model: str) -> None:
+    """
+    Raise ModelMismatchError if the corpus manifest names another embed
+    model. Corpora without a manifest (or without a recorded model) pass
+    with a warning.
+    """
+    manifest = corpus.manifest
+    built = (manifest or {}).get("model")
+    if built is None:
+        print(
+            f"[WARN] Corpus '{corpus.name}' has no recorded embed model; assuming {model}. "
+            f"Record it with: python citl_registry.py stamp --name {corpus.name} --model {model}"
+        )
+        return
+    if built != model:
+        raise ModelMismatchError(
+            f"Corpus '{corpus.name}' was embedded with '{built}' but queries use '{model}'. "
+            f"Rebuild it with the query model ({rebuild_hint(corpus.name, manifest)}) "
+            f"or set FACTBOOK_EMBED={built} to query with that model."
+        )
+    if manifest.get("chunks") not in (None, len(corpus)):
+        print(
+            f"[WARN] Manifest of '{corpus.name}' lists {manifest['chunks']} chunks "
+            f"but the index has {len(corpus)}; it was rewritten without a manifest"
+        )
+
+
+class CorpusRegistry:
+    """
+    Lazily opened corpora of one index directory for one query model.
+
+    registry = CorpusRegistry(INDEX_DIR, "nomic-embed-text")
+    registry.names()            # discovered, nothing opened
+    registry.get("nursing")     # opened + model-checked on first use
+    """
+
+    def __init__(self, index_dir: Path = INDEX_DIR, model: Optional[str] = None, mmap: bool = True):
+        self.index_dir = Path(index_dir)
+        self.model = model
+        self.mmap = mmap
+        self._open: Dict[str, Corpus] = {}
+        self._lock = threading.Lock()
+
+    def names(self) -> List[str]:
+        return discover(self.index_dir)
+
+    def resolve(self, source: str) -> List[str]:
+        """
+        "all" -> every discovered corpus, otherwise the one name.
+        """
+        if source != "all":
+            return [source]
+        names = self.names()
+        if not names:
+            raise FileNotFoundError(f"No corpora found in {self.index_dir}")
+        return names
+
+    def get(self, name: str) -> Corpus:
+        with self._lock:
+            corpus = self._open.get(name)
+            if corpus is not None:
+                return corpus
+            if not corpus_exists(self.index_dir, name):
+                known = ", ".join(self.names()) or "none"
+                raise FileNotFoundError(
+                    f"Corpus index not found for '{name}' in {self.index_dir} (available: {known})"
+                )
+            corpus = open_corpus(self.index_dir, name, mmap=self.mmap)
+            if self.model is not None:
+                try:
+                    check_model(corpus, self.model)
+                except ModelMismatchError:
+                    corpus.close()
+                    raise
+            self._open[name] = corpus
+            return corpus
+
+    def close(self) -> None:
+        with self._lock:
+            for corpus in self._open.values():
+                corpus.close()
+            self._open.clear()
+
+
+# ---------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="List corpora or stamp a manifest on a legacy one.")
+    ap.add_argument("--index-dir", default=str(INDEX_DIR))
+    sub = ap.add_subparsers(dest="cmd")
+    st = sub.add_parser("stamp", help="Write a manifest for a corpus built without one")
+    st.add_argument("--name", required=True)
+    st.add_argument("--model", required=True, help="Embed model the corpus was built with")
+    args = ap.parse_args()
+
+    index_dir = Path(args.index_dir)
+    if args.cmd == "stamp":
+        corpus = open_corpus(index_dir, args.name)
+        corpus.close()
+        full = corpus.full is not None
+        meta = dict((corpus.manifest or {}).get("meta", {}), model=args.model)
+        manifest = write_manifest(
+            index_dir, args.name, meta, len(corpus), corpus.emb.shape[1], str(corpus.emb.dtype), full
+        )
+        print(f"[INFO] {args.name}: model={manifest['model']} build={manifest['build']}")
+        return
+
+    names = discover(index_dir)
+    if not names:
+        print(f"No corpora in {index_dir}")
+        return
+    print(f"{'name':<16}{'chunks':>9}{'dim':>6}  {'dtype':<11}{'model':<24}{'build':<18}built")
+    for name in names:
+        m = read_manifest(index_dir, name)
+        if m is None:
+            print(f"{name:<16}{'?':>9}{'?':>6}  {'?':<11}{'(no manifest)':<24}")
+            continue
+        dtype = m["dtype"] + ("+full" if m.get("full") else "")
+        print(
+            f"{name:<16}{m['chunks']:>9}{m['dim'] or 0:>6}  {dtype:<11}"
+            f"{m.get('model') or '?':<24}{m['build']:<18}{m.get('built_at', '')}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Map-reduce summarization for transcripts longer than one prompt.
+
+  map:    the transcript is split into token-bounded segments of whole
+          lines (Whisper "[hh:mm:ss] text" lines keep their timestamps)
+          and each segment is condensed into notes, CITL_GEN_WORKERS
+          requests at a time
+  reduce: notes are merged in groups that fit one prompt, level by level,
+          until they fit the final prompt
+  final:  the final prompt (the student-facing summary by default, or any
+          --prompt) runs once over the merged notes, streamed
+
+Segment notes and merges are stored in the query cache (citl_cache.py)
+keyed by their input text, model and options, so summarizing the same
+transcript again, e.g. with a different final prompt, only pays for the
+final request. End-to-end time grows with segments / workers instead of
+with one prompt evaluation over the whole lecture.
+
+  python citl_summarize.py "lecture_20250101_100000.txt"
+  python citl_summarize.py lecture.txt --prompt "List every term defined, with its definition."
+"""
+
+import re
+import sys
+import time
+import argparse
+import threading
+from pathlib import Path
+from typing import Callable, List, Optional
+
+import citl_trace
+from citl_batch import DEFAULT_GEN_WORKERS, run_ordered
+from citl_cache import QueryCache
+from citl_chunker import count_tokens, split_sentences
+from citl_ollama import Generation, TokenPrinter, generate
+
+LLM_MODEL = "mistral:7b-instruct"
+OPTIONS = {"temperature": 0.2}
+# Segment and merge inputs, in tokens: with the instructions and ~400
+# tokens of notes they stay inside Ollama's default 2048-token context
+SEGMENT_TOKENS = 1200
+
+SYSTEM = (
+    "You are CITL Assistant, a college learning and accessibility coach. "
+    "You summarize lecture transcripts clearly and concisely for community college students. "
+    "Use short paragraphs and bullet points, and highlight key terms."
+)
+MAP_TASK = (
+    "Task: Write concise study notes for this part of a lecture transcript: main ideas, "
+    "definitions, examples and any procedures or steps, as bullet points. "
+    "Keep the key terms and the timestamps of important moments."
+)
+REDUCE_TASK = (
+    "Task: Merge these consecutive study notes from one lecture into a single set of notes. "
+    "Remove repetition, keep the order, all key terms and definitions."
+)
+FINAL_TASK = (
+    "Task: Summarize this transcript for a student who missed part of the lecture. "
+    "Focus on the main ideas, definitions, and any procedures or steps mentioned."
+)
+
+_STAMP_RE = re.compile(r"^\[(\d{2}:\d{2}:\d{2})\]")
+
+
+# ---------------------------------------------------------------------
+# Splitting
+# ---------------------------------------------------------------------
+
+def _units(text: str, max_tokens: int) -> List[str]:
+    """
+    Lines, with any line longer than a segment cut into sentences and a
+    sentence longer than a segment into word runs.
+    """
+    out: List[str] = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if count_tokens(line) <= max_tokens:
+            out.append(line)
+            continue
+        for sent in split_sentences(line):
+            words = sent.split()
+            # ~3/4 word per token leaves room for tokenizer variance
+            step = max(1, max_tokens * 3 // 4)
+            out.extend(" ".join(words[i : i + step]) for i in range(0, len(words), step))
+    return out
+
+
+def split_transcript(transcript: str, max_tokens: int = SEGMENT_TOKENS) -> List[dict]:
+    """
+    Consecutive segments {"text", "tokens", "start", "end"} of at most
+    ``max_tokens``; start/end are the first and last "[hh:mm:ss]" stamps
+    in the segment (None for a plain-text transcript).
+    """
+    segments: List[dict] = []
+    lines: List[str] = []
+    used = 0
+
+    def emit() -> None:
+        stamps = [m.group(1) for m in map(_STAMP_RE.match, lines) if m]
+        segments.append(
+            {
+                "text": "\n".join(lines),
+                "tokens": used,
+                "start": stamps[0] if stamps else None,
+                "end": stamps[-1] if stamps else None,
+            }
+        )
+
+    for unit in _units(transcript, max_tokens):
+        k = count_tokens(unit)
+        if lines and used + k > max_tokens:
+            emit()
+            lines, used = [], 0
+        lines.append(unit)
+        used += k
+    if lines:
+        emit()
+    return segments
+
+
+def group_notes(notes: List[str], max_tokens: int) -> List[List[str]]:
+    """
+    Consecutive groups of notes that fit ``max_tokens`` together (at least
+    two per group, so every reduce level shrinks the list).
+    """
+    groups: List[List[str]] = []
+    current: List[str] = []
+    used = 0
+    for note in notes:
+        k = count_tokens(note)
+        if len(current) >= 2 and used + k > max_tokens:
+            groups.append(current)
+            current, used = [], 0
+        current.append(note)
+        used += k
+    if current:
+        if len(current) == 1 and groups:
+            groups[-1].append(current[0])
+        else:
+            groups.append(current)
+    return groups
+
+
+# ---------------------------------------------------------------------
+# Map / reduce
+# ---------------------------------------------------------------------
+
+class Summarizer:
+    """
+    summarizer = Summarizer(cache=QueryCache())
+    text = summarizer.summarize(transcript, on_token=TokenPrinter())
+    print(summarizer.report())
+    print(summarizer.last.timing())     # the final, streamed request
+    """
+
+    def __init__(
+        self,
+        model: str = LLM_MODEL,
+        workers: int = DEFAULT_GEN_WORKERS,
+        segment_tokens: int = SEGMENT_TOKENS,
+        cache: Optional[QueryCache] = None,
+        options: Optional[dict] = None,
+    ):
+        self.model = model
+        self.workers = max(1, int(workers))
+        self.segment_tokens = segment_tokens
+        self.cache = cache
+        self.options = dict(OPTIONS if options is None else options)
+        self.calls = 0
+        self.cached = 0
+        self.levels = 0
+        self.segments = 0
+        self.seconds = 0.0
+        self.last: Optional[Generation] = None
+        self._lock = threading.Lock()
+
+    def _complete(self, task: str, text: str, label: str) -> str:
+        """
+        One non-streamed request (task over text), through the cache.
+        """
+        if self.cache is not None:
+            hit = self.cache.get_answer(task, text, self.model, self.options)
+            if hit is not None:
+                with self._lock:
+                    self.cached += 1
+                return hit
+        payload = {
+            "model": self.model,
+            "system": SYSTEM,
+            "prompt": f"{label}:\n{text}\n\n{task}",
+            "options": self.options,
+        }
+        gen = generate(payload, timeout=600)
+        with self._lock:
+            self.calls += 1
+        if self.cache is not None and gen.text:
+            self.cache.put_answer(task, text, self.model, self.options, gen.text)
+        return gen.text
+
+    def _map(self, segments: List[dict]) -> List[str]:
+        def note(seg: dict) -> str:
+            text = self._complete(MAP_TASK, seg["text"], "Transcript excerpt")
+            if seg["start"]:
+                return f"[{seg['start']} - {seg['end']}]\n{text}"
+            return text
+
+        return [n for _, n in run_ordered(segments, note, self.workers)]
+
+    def _reduce(self, notes: List[str]) -> List[str]:
+        while len(notes) > 1 and sum(count_tokens(n) for n in notes) > self.segment_tokens:
+            groups = group_notes(notes, self.segment_tokens)
+            self.levels += 1
+            print(f"[INFO] Merging {len(notes)} notes into {len(groups)} (level {self.levels})", file=sys.stderr)
+            notes = [
+                merged
+                for _, merged in run_ordered(
+                    groups, lambda g: self._complete(REDUCE_TASK, "\n\n".join(g), "Notes"), self.workers
+                )
+            ]
+        return notes
+
+    def summarize(
+        self,
+        transcript: str,
+        final_task: str = FINAL_TASK,
+        on_token: Optional[Callable[[str], None]] = None,
+    ) -> str:
+        """
+        Summary of ``transcript`` following ``final_task``. A transcript
+        that fits one segment goes straight to the final prompt, as before.
+        """
+        t0 = time.perf_counter()
+        segments = split_transcript(transcript, self.segment_tokens)
+        self.segments = len(segments)
+        with citl_trace.trace("summarize", final_task):
+            if len(segments) <= 1:
+                label, text = "Transcript", transcript
+            else:
+                print(
+                    f"[INFO] Transcript is {sum(s['tokens'] for s in segments)} tokens: "
+                    f"summarizing {len(segments)} segments, {self.workers} at a time",
+                    file=sys.stderr,
+                )
+                with citl_trace.stage("map"):
+                    notes = self._map(segments)
+                with citl_trace.stage("reduce"):
+                    notes = self._reduce(notes)
+                label, text = "Lecture notes", "\n\n".join(notes)
+
+            payload = {
+                "model": self.model,
+                "system": SYSTEM,
+                "prompt": f"{label}:\n{text}\n\n{final_task}",
+                "options": self.options,
+            }
+            with citl_trace.stage("final"):
+                gen = generate(payload, on_token=on_token, timeout=600)
+            self.calls += 1
+            self.last = gen
+        self.seconds = time.perf_counter() - t0
+        return gen.text
+
+    def report(self) -> str:
+        return (
+            f"[INFO] Summarized {self.segments} segment(s) in {self.seconds:.1f}s: "
+            f"{self.calls} LLM call(s), {self.cached} cached, {self.levels} merge level(s)"
+        )
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Summarize a (long) lecture transcript with the local LLM.")
+    ap.add_argument("transcript", help="Transcript text file (e.g. lecture_*.txt)")
+    ap.add_argument("--prompt", default=FINAL_TASK, help="Final instruction (default: student summary)")
+    ap.add_argument("--model", default=LLM_MODEL, help=f"Ollama model (default: {LLM_MODEL})")
+    ap.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_GEN_WORKERS,
+        help=f"Concurrent segment requests (default: {DEFAULT_GEN_WORKERS}, env CITL_GEN_WORKERS)",
+    )
+    ap.add_argument(
+        "--segment-tokens",
+        type=int,
+        default=SEGMENT_TOKENS,
+        help=f"Tokens per segment and merge (default: {SEGMENT_TOKENS})",
+    )
+    ap.add_argument("--no-cache", action="store_true", help="Do not reuse or store segment notes")
+    ap.add_argument("--out", help="Also write the summary to this file")
+    citl_trace.add_profile_args(ap)
+    args = ap.parse_args()
+    tracer = citl_trace.enable_from_args(args)
+
+    transcript = Path(args.transcript).read_text(encoding="utf-8")
+    cache = None if args.no_cache else QueryCache()
+    summarizer = Summarizer(args.model, args.workers, args.segment_tokens, cache)
+    printer = TokenPrinter()
+    summary = summarizer.summarize(transcript, args.prompt, on_token=printer)
+    printer.finish()
+    print(summarizer.report(), file=sys.stderr)
+    print(summarizer.last.timing(), file=sys.stderr)
+    if args.out:
+        Path(args.out).write_text(summary, encoding="utf-8")
+    citl_trace.print_summary(tracer)
+
+
+if __name__ == "__main__":
+    main()
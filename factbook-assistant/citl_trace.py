@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+"""
+Opt-in per-stage latency tracing for the query tools.
+
+  python query_factbook.py --profile "What is the capital of Laos?"
+  CITL_TRACE=1 python citl_multi_rag.py --source all --batch faq.jsonl
+  python citl_trace.py summary index/traces.jsonl
+
+Each query gets a Trace holding the wall time of its stages (import,
+shortcut, load_index, embed, retrieve, generate) and what Ollama reported
+for the answer: prompt/response token counts and its prompt_eval_duration,
+eval_duration and load_duration, plus time-to-first-token. A finished
+trace is appended as one JSON line to the trace file, and the CLIs print a
+summary table (stderr) when they exit.
+
+Stages are recorded by the code that runs them (``with stage("embed"):``)
+through a context variable, so nothing threads a trace object through the
+call chain; with tracing off, stage() is a shared no-op context.
+
+The resident server always traces (a few perf_counter calls per query) and
+serves the numbers as Prometheus histograms on GET /metrics; with
+CITL_TRACE set it writes the JSONL lines too.
+
+Environment:
+  CITL_TRACE - trace file to append to ("1" = index/traces.jsonl);
+               unset or "0" leaves tracing off unless --profile is given
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import contextlib
+import contextvars
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+ROOT = Path(__file__).resolve().parent
+DEFAULT_TRACE_PATH = ROOT / "index" / "traces.jsonl"
+TRACE_ENV = os.environ.get("CITL_TRACE", "")
+
+# Display order of the summary table; unknown stages follow
+STAGES = ("import", "shortcut", "load_index", "load_corpus", "embed", "retrieve", "generate")
+
+_current: contextvars.ContextVar = contextvars.ContextVar("citl_trace", default=None)
+_NULL = contextlib.nullcontext()
+
+
+class Trace:
+    """
+    Stage timings and generation stats of one query. Thread-safe, so
+    stages run on worker threads can add to the same trace.
+    """
+
+    def __init__(self, tool: str, query: str = ""):
+        self.tool = tool
+        self.query = query
+        self.stages: Dict[str, float] = {}
+        self.fields: dict = {}
+        self.t0 = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t0)
+
+    def note(self, **fields) -> None:
+        with self._lock:
+            self.fields.update(fields)
+
+    def generation(self, gen) -> None:
+        """
+        Record a citl_ollama.Generation; several generations in one trace
+        add up.
+        """
+        meta = gen.meta or {}
+        with self._lock:
+            f = self.fields
+            if gen.ttft is not None and "ttft" not in f:
+                f["ttft"] = gen.ttft
+            f["prompt_tokens"] = f.get("prompt_tokens", 0) + int(meta.get("prompt_eval_count") or 0)
+            f["response_tokens"] = f.get("response_tokens", 0) + int(meta.get("eval_count") or 0)
+            ollama = f.setdefault("ollama", {})
+            for key in ("prompt_eval_duration", "eval_duration", "load_duration", "total_duration"):
+                if meta.get(key) is not None:
+                    ollama[key] = ollama.get(key, 0) + int(meta[key])
+
+    def record(self, error: Optional[str] = None) -> dict:
+        with self._lock:
+            # "import" ran before the trace started but is part of the wait
+            total = time.perf_counter() - self.t0 + self.stages.get("import", 0.0)
+            rec = {
+                "ts": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "tool": self.tool,
+                "query": self.query,
+                "total_ms": round(total * 1000, 3),
+                "stages": {k: round(v * 1000, 3) for k, v in self.stages.items()},
+            }
+            fields = dict(self.fields)
+        if "ttft" in fields:
+            rec["ttft_ms"] = round(fields.pop("ttft") * 1000, 3)
+        if "ollama" in fields:
+            # Ollama reports nanoseconds
+            rec["ollama"] = {
+                k.replace("_duration", "_ms"): round(v / 1e6, 3) for k, v in fields.pop("ollama").items()
+            }
+        rec.update(fields)
+        if error is not None:
+            rec["error"] = error
+        return rec
+
+
+# ---------------------------------------------------------------------
+# Recording
+# ---------------------------------------------------------------------
+
+class Tracer:
+    """
+    Collects finished traces: appends them to ``path`` (JSONL), keeps
+    them for the end-of-run summary (``keep``) and/or feeds histograms.
+    """
+
+    def __init__(
+        self,
+        path: Optional[Path] = None,
+        keep: bool = True,
+        metrics: Optional["Metrics"] = None,
+        import_seconds: Optional[float] = None,
+    ):
+        self.path = Path(path) if path else None
+        self.keep = keep
+        self.metrics = metrics
+        self.records: List[dict] = []
+        self._import = import_seconds
+        self._lock = threading.Lock()
+        if self.path is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def start(self, tool: str, query: str) -> Trace:
+        t = Trace(tool, query)
+        with self._lock:
+            # The one-off import cost belongs to the first query of the run
+            if self._import is not None:
+                t.add("import", self._import)
+                self._import = None
+        return t
+
+    def finish(self, trace: Trace, error: Optional[str] = None) -> dict:
+        rec = trace.record(error)
+        if self.metrics is not None:
+            self.metrics.observe(rec)
+        line = json.dumps(rec, ensure_ascii=False) + "\n"
+        with self._lock:
+            if self.keep:
+                self.records.append(rec)
+            if self.path is not None:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+        return rec
+
+    def summary(self) -> str:
+        return summary_table(self.records)
+
+
+_tracer: Optional[Tracer] = None
+
+
+def enable(
+    path: Optional[Path] = None,
+    keep: bool = True,
+    metrics: Optional["Metrics"] = None,
+    import_seconds: Optional[float] = None,
+) -> Tracer:
+    """
+    Turn tracing on for this process.
+    """
+    global _tracer
+    _tracer = Tracer(path, keep, metrics, import_seconds)
+    return _tracer
+
+
+def get_tracer() -> Optional[Tracer]:
+    return _tracer
+
+
+def env_path() -> Optional[Path]:
+    """
+    The trace file named by CITL_TRACE, or None when it is unset/"0".
+    """
+    if TRACE_ENV in ("", "0"):
+        return None
+    return DEFAULT_TRACE_PATH if TRACE_ENV == "1" else Path(TRACE_ENV)
+
+
+@contextlib.contextmanager
+def trace(tool: str, query: str = "") -> Iterator[Optional[Trace]]:
+    """
+    Trace one query (no-op while tracing is off). Nested calls join the
+    enclosing trace.
+    """
+    tracer = _tracer
+    if tracer is None or _current.get() is not None:
+        yield _current.get()
+        return
+    t = tracer.start(tool, query)
+    token = _current.set(t)
+    try:
+        yield t
+    except BaseException as e:
+        tracer.finish(t, error=f"{type(e).__name__}: {e}")
+        raise
+    else:
+        tracer.finish(t)
+    finally:
+        _current.reset(token)
+
+
+def stage(name: str):
+    t = _current.get()
+    return _NULL if t is None else t.stage(name)
+
+
+def note(**fields) -> None:
+    t = _current.get()
+    if t is not None:
+        t.note(**fields)
+
+
+def record_generation(gen) -> None:
+    t = _current.get()
+    if t is not None:
+        t.generation(gen)
+
+
+# ---------------------------------------------------------------------
+# Summary table
+# ---------------------------------------------------------------------
+
+def _pct(values: Sequence[float], q: float) -> float:
+    s = sorted(values)
+    if not s:
+        return 0.0
+    pos = (len(s) - 1) * q / 100
+    lo = int(pos)
+    hi = min(lo + 1, len(s) - 1)
+    return s[lo] + (s[hi] - s[lo]) * (pos - lo)
+
+
+def summary_table(records: Sequence[dict]) -> str:
+    """
+    Per-stage count / mean / p50 / p90 / max (ms) over traces, then the
+    token and Ollama timing averages.
+    """
+    if not records:
+        return "[INFO] No traces recorded"
+    columns: Dict[str, List[float]] = {}
+    for rec in records:
+        for name, ms in rec.get("stages", {}).items():
+            columns.setdefault(name, []).append(ms)
+    order = [s for s in STAGES if s in columns] + sorted(s for s in columns if s not in STAGES)
+    rows: List[Tuple[str, List[float]]] = [(s, columns[s]) for s in order]
+    rows.append(("total", [r["total_ms"] for r in records]))
+    ttft = [r["ttft_ms"] for r in records if "ttft_ms" in r]
+    if ttft:
+        rows.append(("first token", ttft))
+
+    lines = [f"{'stage':<13}{'n':>6}{'mean ms':>11}{'p50 ms':>11}{'p90 ms':>11}{'max ms':>11}"]
+    for name, vals in rows:
+        lines.append(
+            f"{name:<13}{len(vals):>6}{sum(vals) / len(vals):>11.1f}"
+            f"{_pct(vals, 50):>11.1f}{_pct(vals, 90):>11.1f}{max(vals):>11.1f}"
+        )
+
+    gens = [r for r in records if r.get("response_tokens")]
+    if gens:
+        prompt = sum(r.get("prompt_tokens", 0) for r in gens) / len(gens)
+        resp = sum(r["response_tokens"] for r in gens) / len(gens)
+        lines.append(f"tokens: {prompt:.0f} prompt / {resp:.0f} response per answer ({len(gens)} answers)")
+        ollama = [r["ollama"] for r in gens if "ollama" in r]
+        if ollama:
+            pe = sum(o.get("prompt_eval_ms", 0) for o in ollama) / len(ollama)
+            ev = sum(o.get("eval_ms", 0) for o in ollama) / len(ollama)
+            ld = sum(o.get("load_ms", 0) for o in ollama) / len(ollama)
+            rate = resp / (ev / 1000) if ev > 0 else 0.0
+            lines.append(
+                f"ollama: prompt_eval {pe:.0f} ms, eval {ev:.0f} ms ({rate:.1f} tokens/s), load {ld:.0f} ms"
+            )
+    cached = sum(1 for r in records if r.get("cached"))
+    errors = sum(1 for r in records if r.get("error"))
+    if cached or errors:
+        lines.append(f"{cached} answered from cache, {errors} failed")
+    return "\n".join(lines)
+
+
+# ---------------------------------------------------------------------
+# Prometheus histograms
+# ---------------------------------------------------------------------
+
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram with labels, rendered in the Prometheus
+    text exposition format.
+    """
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str], buckets: Sequence[float]):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        with self._lock:
+            # [bucket counts..., +Inf count, sum]
+            s = self._series.setdefault(label_values, [0] * (len(self.buckets) + 1) + [0.0])
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    s[i] += 1
+            s[len(self.buckets)] += 1
+            s[-1] += value
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted(self._series.items())
+        for values, s in series:
+            base = ",".join(f'{k}="{v}"' for k, v in zip(self.labels, values))
+            sep = "," if base else ""
+            for b, n in zip(self.buckets, s):
+                out.append(f'{self.name}_bucket{{{base}{sep}le="{b:g}"}} {n}')
+            out.append(f'{self.name}_bucket{{{base}{sep}le="+Inf"}} {s[len(self.buckets)]}')
+            out.append(f"{self.name}_sum{{{base}}} {s[-1]:.6f}")
+            out.append(f"{self.name}_count{{{base}}} {s[len(self.buckets)]}")
+        return out
+
+
+class Metrics:
+    """
+    The server's histograms, fed one trace record at a time.
+    """
+
+    def __init__(self):
+        self.query = Histogram(
+            "citl_query_seconds", "Wall time per query.", ("tool", "status"), SECONDS_BUCKETS
+        )
+        self.stage = Histogram(
+            "citl_stage_seconds", "Wall time per query stage.", ("tool", "stage"), SECONDS_BUCKETS
+        )
+        self.ttft = Histogram(
+            "citl_first_token_seconds", "Time to the first generated token.", ("tool",), SECONDS_BUCKETS
+        )
+        self.ollama = Histogram(
+            "citl_ollama_seconds",
+            "Ollama-reported durations (prompt_eval, eval, load).",
+            ("tool", "phase"),
+            SECONDS_BUCKETS,
+        )
+        self.tokens = Histogram(
+            "citl_tokens", "Prompt and response tokens per answer.", ("tool", "kind"), TOKEN_BUCKETS
+        )
+
+    def observe(self, rec: dict) -> None:
+        tool = rec["tool"]
+        self.query.observe(rec["total_ms"] / 1000, tool, "error" if rec.get("error") else "ok")
+        for name, ms in rec.get("stages", {}).items():
+            self.stage.observe(ms / 1000, tool, name)
+        if "ttft_ms" in rec:
+            self.ttft.observe(rec["ttft_ms"] / 1000, tool)
+        for key, ms in rec.get("ollama", {}).items():
+            if key != "total_ms":
+                self.ollama.observe(ms / 1000, tool, key[: -len("_ms")])
+        if rec.get("response_tokens"):
+            self.tokens.observe(rec.get("prompt_tokens", 0), tool, "prompt")
+            self.tokens.observe(rec["response_tokens"], tool, "response")
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for h in (self.query, self.stage, self.ttft, self.ollama, self.tokens):
+            lines.extend(h.render())
+        return "\n".join(lines) + "\n"
+
+
+# ---------------------------------------------------------------------
+# CLI integration
+# ---------------------------------------------------------------------
+
+def add_profile_args(parser) -> None:
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const=str(DEFAULT_TRACE_PATH),
+        default=None,
+        metavar="TRACE_JSONL",
+        help="Time every stage of each query, append traces to TRACE_JSONL "
+        f"(default: {DEFAULT_TRACE_PATH}) and print a summary (also: CITL_TRACE)",
+    )
+
+
+def enable_from_args(args, import_seconds: Optional[float] = None) -> Optional[Tracer]:
+    """
+    Enable tracing for --profile or CITL_TRACE; None when neither is set.
+    """
+    path = Path(args.profile) if args.profile else env_path()
+    if path is None:
+        return None
+    return enable(path, import_seconds=import_seconds)
+
+
+def print_summary(tracer: Optional[Tracer]) -> None:
+    if tracer is None:
+        return
+    print(tracer.summary(), file=sys.stderr)
+    if tracer.path is not None:
+        print(f"[INFO] Traces appended to {tracer.path}", file=sys.stderr)
+
+
+def read_traces(path: Path) -> List[dict]:
+    out = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                out.append(json.loads(line))
+    return out
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Summarize query traces.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    s = sub.add_parser("summary", help="Stage timing table for a trace file")
+    s.add_argument("path", nargs="?", default=str(DEFAULT_TRACE_PATH))
+    s.add_argument("--tool", help="Only traces of this tool (factbook, rag, ...)")
+    s.add_argument("--last", type=int, default=None, help="Only the last N traces")
+    args = ap.parse_args()
+
+    records = read_traces(Path(args.path))
+    if args.tool:
+        records = [r for r in records if r.get("tool") == args.tool]
+    if args.last:
+        records = records[-args.last:]
+    print(summary_table(records))
+
+
+if __name__ == "__main__":
+    main()
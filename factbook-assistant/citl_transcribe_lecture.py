@@ -6,14 +6,18 @@ import wave
 
 import sounddevice as sd
 import numpy as np
-import whisper
-import requests
+
+from citl_cache import QueryCache
+from citl_ollama import TokenPrinter
+from citl_live import LiveTranscriber, MicSource, WavSource
+from citl_summarize import Summarizer
+from citl_whisper import DEFAULT_WORKERS, WhisperEngine, add_whisper_args, fmt_time
+from citl_whisper_server import DEFAULT_SERVER, ask_whisper_server, format_timing
 
 # ---- Paths / constants ----
 
 DOCS_DIR = Path.home() / "Documents"
 TRANSCRIPT_DIR_NAME = "CITL Transcripts"
-OLLAMA_URL = "http://localhost:11434/api/generate"
 LLM_MODEL = "mistral:7b-instruct"
 
 
@@ -84,46 +88,79 @@ def save_wav(audio: np.ndarray, path: Path, samplerate: int = 16000):
     print(f"Saved WAV to: {path}")
 
 
-def transcribe_with_whisper(wav_path: Path, model_size: str = "base") -> str:
-    """Run Whisper on the given WAV file and return transcript text."""
-    print(f"\nLoading Whisper model '{model_size}' (this may take a bit the first time)...")
-    model = whisper.load_model(model_size)
-    print(f"Transcribing: {wav_path}")
-    result = model.transcribe(str(wav_path), language="en")  # change language if needed
-    text = result.get("text", "").strip()
+def transcribe_with_whisper(
+    wav_path: Path, model_size: str = "base", workers: int = DEFAULT_WORKERS, server: bool = False
+) -> str:
+    """Run Whisper on the given WAV file and return the transcript as
+    "[hh:mm:ss] text" lines.
+
+    The audio is split at pauses and the pieces are transcribed in parallel
+    (see citl_whisper.py); the realtime factor is printed at the end. With
+    server=True a running citl_whisper_server.py (model already loaded) is
+    asked first.
+    """
+    if server:
+        print(f"\nTranscribing on the Whisper server: {wav_path}")
+        result = ask_whisper_server(DEFAULT_SERVER, wav_path, model_size, language="en")
+        if result is not None:
+            print(format_timing(result["timing"]))
+            return "\n".join(f"[{fmt_time(s['start'])}] {s['text']}" for s in result["segments"])
+        print(f"[WARN] Whisper server at {DEFAULT_SERVER} unreachable; transcribing locally.")
+    print(f"\nLoading Whisper model '{model_size}' in {workers} worker(s) "
+          "(this may take a bit the first time)...")
+    with WhisperEngine(model_size, workers=workers, language="en") as engine:  # change language if needed
+        print(f"Transcribing: {wav_path}")
+        result = engine.transcribe(wav_path)
     print("Transcription finished.")
-    return text
-
-
-def summarize_with_citl_llm(transcript: str) -> str:
-    """Send transcript to local CITL LLM (mistral via Ollama) for summary."""
-    system = (
-        "You are CITL Assistant, a college learning and accessibility coach. "
-        "You summarize lecture transcripts clearly and concisely for community college students. "
-        "Use short paragraphs and bullet points, and highlight key terms."
-    )
-
-    prompt = (
-        f"Transcript:\n{transcript}\n\n"
-        "Task: Summarize this transcript for a student who missed part of the lecture. "
-        "Focus on the main ideas, definitions, and any procedures or steps mentioned."
-    )
-
-    payload = {
-        "model": LLM_MODEL,
-        "system": system,
-        "prompt": prompt,
-        "stream": False,
-        "options": {"temperature": 0.2},
-    }
-
+    print(result.report())
+    return result.timestamped()
+
+
+def record_and_transcribe_live(
+    source, duration_sec: float, wav_path: Path, txt_path: Path, model_size: str = "base", workers: int = 1
+) -> str:
+    """Record to wav_path while transcribing 30 s windows; lines are appended to txt_path as they arrive."""
+    engine = WhisperEngine(model_size, workers=workers, language="en")  # same as transcribe_with_whisper
+    with engine, open(txt_path, "w", encoding="utf-8") as out:
+
+        def on_segment(seg: dict) -> None:
+            line = f"[{fmt_time(seg['start'])}] {seg['text']}"
+            print(line, flush=True)
+            out.write(line + "\n")
+            out.flush()
+
+        print(f"Recording and transcribing live for up to {duration_sec/60:.1f} minutes (Ctrl+C to stop)...")
+        live = LiveTranscriber(engine, source, wav_path, on_segment=on_segment)
+        live.run(duration_sec)
+    print(live.report())
+    print(f"Saved audio to: {wav_path}")
+    return live.timestamped()
+
+
+def summarize_with_citl_llm(transcript: str, stream: bool = True) -> str:
+    """Send transcript to local CITL LLM (mistral via Ollama) for summary.
+
+    Long transcripts are summarized in segments that are merged before the
+    final summary (see citl_summarize.py); segment notes are cached, so a
+    re-run only pays for the final request. By default the summary is
+    printed token by token as it is generated; stream=False waits for it.
+    """
+    summarizer = Summarizer(model=LLM_MODEL, cache=QueryCache())
     print("\nSending transcript to CITL LLM for summarization...")
-    r = requests.post(OLLAMA_URL, json=payload, timeout=600)
-    r.raise_for_status()
-    data = r.json()
-    summary = data.get("response", "").strip()
+    if not stream:
+        text = summarizer.summarize(transcript)
+        print("LLM summarization complete.")
+        print(summarizer.report())
+        return text
+
+    print()
+    printer = TokenPrinter()
+    text = summarizer.summarize(transcript, on_token=printer)
+    printer.finish()
     print("LLM summarization complete.")
-    return summary
+    print(summarizer.report())
+    print(summarizer.last.timing())
+    return text
 
 
 # ---- Main CLI ----
@@ -139,22 +176,42 @@ def main():
         default=10.0,
         help="Recording duration in minutes (default: 10).",
     )
-    parser.add_argument(
-        "--whisper-model",
-        type=str,
-        default="base",
-        help="Whisper model size (tiny | base | small | medium | large). Default: base.",
-    )
+    add_whisper_args(parser)
     parser.add_argument(
         "--no-summary",
         action="store_true",
         help="Skip LLM summarization step.",
     )
+    parser.add_argument(
+        "--no-stream",
+        action="store_true",
+        help="Wait for the whole summary instead of printing it as it is generated.",
+    )
+    parser.add_argument(
+        "--server",
+        action="store_true",
+        help=f"Transcribe on a running citl_whisper_server.py ({DEFAULT_SERVER}, set "
+        "CITL_WHISPER_SERVER to change), which keeps the model loaded between recordings.",
+    )
+    parser.add_argument(
+        "--live",
+        action="store_true",
+        help="Transcribe while recording; the transcript is ready seconds after recording stops.",
+    )
+    parser.add_argument(
+        "--from-wav",
+        metavar="WAV",
+        help="With --live: feed this WAV file instead of the microphone (for testing).",
+    )
 
     args = parser.parse_args()
+    if args.from_wav and not args.live:
+        parser.error("--from-wav requires --live")
+    if args.live and args.server:
+        parser.error("--live transcribes in this process; it cannot be combined with --server")
 
     # 1) Choose mic
-    dev_idx = choose_microphone()
+    dev_idx = None if args.from_wav else choose_microphone()
 
     # 2) Prepare transcript folder under Documents
     target_dir = prepare_transcript_folder()
@@ -165,22 +222,31 @@ def main():
     txt_path = target_dir / f"lecture_{ts}.txt"
     summary_path = target_dir / f"lecture_{ts}.summary.txt"
 
-    # 4) Record audio
     duration_sec = args.minutes * 60.0
-    audio = record_audio(dev_idx, duration_sec=duration_sec, samplerate=16000)
-
-    # 5) Save WAV
-    save_wav(audio, wav_path, samplerate=16000)
-
-    # 6) Transcribe
-    transcript = transcribe_with_whisper(wav_path, model_size=args.whisper_model)
-
-    # 7) Save transcript text
-    txt_path.write_text(transcript, encoding="utf-8")
+    if args.live:
+        # 4-7) Record, save and transcribe at the same time
+        source = WavSource(Path(args.from_wav), realtime=True) if args.from_wav else MicSource(dev_idx)
+        transcript = record_and_transcribe_live(
+            source, duration_sec, wav_path, txt_path, model_size=args.whisper_model, workers=args.workers
+        )
+    else:
+        # 4) Record audio
+        audio = record_audio(dev_idx, duration_sec=duration_sec, samplerate=16000)
+
+        # 5) Save WAV
+        save_wav(audio, wav_path, samplerate=16000)
+
+        # 6) Transcribe
+        transcript = transcribe_with_whisper(
+            wav_path, model_size=args.whisper_model, workers=args.workers, server=args.server
+        )
+
+        # 7) Save transcript text
+        txt_path.write_text(transcript, encoding="utf-8")
     print(f"Saved transcript to: {txt_path}")
 
     # 8) Optional summary with CITL LLM
-    if args.no-summary:
+    if args.no_summary:
         print("\nSkipping LLM summarization (per --no-summary).")
         return
 
@@ -190,7 +256,7 @@ def main():
         return
 
     try:
-        summary = summarize_with_citl_llm(transcript)
+        summary = summarize_with_citl_llm(transcript, stream=not args.no_stream)
     except Exception as e:
         print(f"[ERROR] LLM summarization failed: {e}")
         return
@@ -1,8 +1,238 @@
+"""
+CITL text-to-speech helper (local, using pyttsx3).
+
+  python citl_tts.py "Hello there."
+  python citl_multi_rag.py "What is a tort?" | python citl_tts.py
+  python citl_multi_rag.py "What is a tort?" | python citl_tts.py --save answer.wav
+  python citl_tts.py --batch chapters/ --out-dir audio/    # see citl_tts_batch.py
+
+Piped text is read as it arrives and spoken sentence by sentence: the
+first sentence plays while the LLM is still generating the rest. With
+--save the sentences are rendered offline (engine.save_to_file) into one
+WAV instead. Time to first audio is reported on stderr.
+"""
+
+import time
+
+# Time to first audio is measured from here, so it includes start-up and
+# waiting for the text
+_T_START = time.perf_counter()
+
 import argparse
+import codecs
+import os
+import queue
+import re
 import sys
+import threading
+import wave
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, TextIO
 
 import pyttsx3
 
+# End of a sentence: punctuation (plus closing quotes/brackets) and
+# whitespace, or a blank line. Only cut once the next word has started, so
+# "3.14" or a token boundary after "Dr." never splits early.
+_BOUNDARY_RE = re.compile(r"(?<=[.!?])[\"')\]]*\s+(?=\S)|\n\s*\n(?=\S)")
+# Shorter pieces are joined to the next one ("Dr.", "e.g.", list numbers)
+MIN_SENTENCE_CHARS = 20
+READ_BYTES = 4096
+
+
+# ---- Input ----
+
+def iter_text(stream: TextIO) -> Iterator[str]:
+    """Yield text from a stream as soon as it arrives (not line by line)."""
+    try:
+        fd = stream.fileno()
+    except (AttributeError, OSError):
+        # Not a real file (e.g. StringIO in tests)
+        yield stream.read()
+        return
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    while True:
+        data = os.read(fd, READ_BYTES)
+        if not data:
+            break
+        text = decoder.decode(data)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def iter_sentences(pieces: Iterable[str], min_chars: int = MIN_SENTENCE_CHARS) -> Iterator[str]:
+    """Split streamed text into sentences, yielding each once it is complete."""
+    buf = ""
+    for piece in pieces:
+        buf += piece
+        start = 0
+        for m in _BOUNDARY_RE.finditer(buf):
+            sentence = buf[start : m.start()].strip()
+            if len(sentence) < min_chars:
+                continue
+            yield " ".join(sentence.split())
+            start = m.end()
+        buf = buf[start:]
+    rest = " ".join(buf.split())
+    if rest:
+        yield rest
+
+
+# ---- Engine ----
+
+def make_engine(rate: int = 180, volume: float = 1.0, voice: Optional[str] = None):
+    """A pyttsx3 engine with rate/volume (and voice id or name) applied."""
+    engine = pyttsx3.init()
+    engine.setProperty("rate", rate)
+    engine.setProperty("volume", volume)
+    if voice:
+        engine.setProperty("voice", find_voice(engine, voice))
+    return engine
+
+
+def find_voice(engine, voice: str) -> str:
+    """Voice id for an id, an index or a (part of a) name."""
+    voices = engine.getProperty("voices") or []
+    for v in voices:
+        if voice == v.id:
+            return v.id
+    if voice.isdigit() and int(voice) < len(voices):
+        return voices[int(voice)].id
+    for v in voices:
+        if voice.lower() in (v.name or "").lower():
+            return v.id
+    raise ValueError(f"unknown voice {voice!r}; see --list-voices")
+
+
+def join_wavs(parts: List[Path], out: Path) -> bool:
+    """Concatenate WAV files with the same format into out; False if they differ."""
+    params = None
+    with wave.open(str(out), "wb") as w:
+        for part in parts:
+            with wave.open(str(part), "rb") as r:
+                p = r.getparams()
+                if params is None:
+                    params = p
+                    w.setparams(p)
+                elif p[:3] != params[:3]:
+                    return False
+                w.writeframes(r.readframes(r.getnframes()))
+    return True
+
+
+# ---- Streaming speaker ----
+
+class SentenceSpeaker:
+    """Speaks (or renders) queued sentences on its own thread.
+
+    pyttsx3 engines must stay on the thread that created them, so the
+    engine is built and driven here; the caller only put()s sentences.
+    With save_dir, each sentence is rendered to part_NNNN.wav instead.
+    """
+
+    def __init__(self, rate: int, volume: float, voice: Optional[str] = None, save_dir: Optional[Path] = None):
+        self.rate, self.volume, self.voice = rate, volume, voice
+        self.save_dir = save_dir
+        self.parts: List[Path] = []
+        self.sentences = 0
+        self.t0 = _T_START
+        self.first_text: Optional[float] = None
+        self.first_audio: Optional[float] = None
+        self.error: Optional[BaseException] = None
+        self._queue: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def put(self, sentence: str) -> None:
+        if self.first_text is None:
+            self.first_text = time.perf_counter() - self.t0
+        self._queue.put(sentence)
+
+    def _mark_audio(self, *_args) -> None:
+        if self.first_audio is None:
+            self.first_audio = time.perf_counter() - self.t0
+
+    def _run(self) -> None:
+        try:
+            engine = make_engine(self.rate, self.volume, self.voice)
+            if self.save_dir is None:
+                engine.connect("started-utterance", self._mark_audio)
+            while True:
+                sentence = self._queue.get()
+                if sentence is None:
+                    break
+                if self.save_dir is None:
+                    engine.say(sentence)
+                    engine.runAndWait()
+                else:
+                    part = self.save_dir / f"part_{len(self.parts) + 1:04d}.wav"
+                    engine.save_to_file(sentence, str(part))
+                    engine.runAndWait()
+                    self.parts.append(part)
+                    self._mark_audio()
+                self.sentences += 1
+        except BaseException as e:
+            self.error = e
+            # Keep draining so put() never blocks a reader on a dead speaker
+            while self._queue.get() is not None:
+                pass
+
+    def close(self) -> None:
+        """Wait until everything queued has been spoken."""
+        self._queue.put(None)
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def report(self) -> str:
+        if self.first_audio is None:
+            return "[INFO] No audio produced."
+        what = "rendered" if self.save_dir is not None else "spoken"
+        since_text = self.first_audio - (self.first_text or 0.0)
+        return (
+            f"[INFO] {self.sentences} sentence(s) {what}; first audio {self.first_audio:.2f}s after start "
+            f"({since_text:.2f}s after the first sentence arrived), done in {time.perf_counter() - self.t0:.2f}s"
+        )
+
+
+def speak_stream(
+    pieces: Iterable[str],
+    rate: int,
+    volume: float,
+    voice: Optional[str] = None,
+    save: Optional[Path] = None,
+) -> SentenceSpeaker:
+    """Feed sentences from pieces to a SentenceSpeaker as they complete."""
+    save_dir = None
+    if save is not None:
+        save_dir = save.with_name(save.stem + "_parts")
+        save_dir.mkdir(parents=True, exist_ok=True)
+    speaker = SentenceSpeaker(rate, volume, voice, save_dir)
+    try:
+        for sentence in iter_sentences(pieces):
+            speaker.put(sentence)
+    finally:
+        speaker.close()
+
+    if save is not None and speaker.parts:
+        try:
+            joined = join_wavs(speaker.parts, save)
+        except (wave.Error, EOFError):
+            # Engines that write AIFF (macOS) leave the parts as they are
+            joined = False
+        if joined:
+            for part in speaker.parts:
+                part.unlink()
+            save_dir.rmdir()
+            print(f"Saved audio to: {save}", file=sys.stderr)
+        else:
+            save.unlink(missing_ok=True)
+            print(f"[WARN] Could not join the parts; they are in {save_dir}", file=sys.stderr)
+    return speaker
+
 
 def main():
     parser = argparse.ArgumentParser(
@@ -25,33 +255,99 @@ def main():
         default=1.0,
         help="Volume (0.0 to 1.0, default: 1.0).",
     )
+    parser.add_argument(
+        "--voice",
+        default=None,
+        help="Voice id, index or part of its name (see --list-voices).",
+    )
+    parser.add_argument(
+        "--list-voices",
+        action="store_true",
+        help="List the installed voices and exit.",
+    )
+    parser.add_argument(
+        "--save",
+        metavar="WAV",
+        default=None,
+        help="Render to this WAV file instead of speaking.",
+    )
+    parser.add_argument(
+        "--no-stream",
+        action="store_true",
+        help="Read all of stdin before speaking (the old behaviour).",
+    )
+    parser.add_argument(
+        "--batch",
+        metavar="PATH",
+        default=None,
+        help="Render a folder of .txt files or a JSONL of texts to audio files.",
+    )
+    parser.add_argument(
+        "--out-dir",
+        default="tts_out",
+        help="With --batch: output folder (default: tts_out).",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["wav", "ogg"],
+        default="wav",
+        help="With --batch: audio format (ogg needs ffmpeg; default: wav).",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=None,
+        help="With --batch: worker processes, one engine each (default: half the cores, max 4).",
+    )
 
     args = parser.parse_args()
 
-    if args.text:
-        text = " ".join(args.text)
-    else:
-        # Read from stdin (e.g., piped from citl_multi_rag)
-        text = sys.stdin.read()
+    if args.batch:
+        import citl_tts_batch
 
-    text = text.strip()
-    if not text:
-        print("[WARN] No text provided to TTS.")
+        try:
+            stats = citl_tts_batch.run_batch(
+                Path(args.batch),
+                Path(args.out_dir),
+                args.rate,
+                args.volume,
+                args.voice,
+                args.format,
+                args.jobs or citl_tts_batch.DEFAULT_JOBS,
+            )
+        except (OSError, RuntimeError, ValueError) as e:
+            print(f"[ERROR] {e}")
+            sys.exit(1)
+        print(citl_tts_batch.report(stats), file=sys.stderr)
+        print(f"Saved audio to: {args.out_dir}", file=sys.stderr)
+        if stats["errors"]:
+            sys.exit(1)
         return
 
-    engine = pyttsx3.init()
-    engine.setProperty("rate", args.rate)
-    engine.setProperty("volume", args.volume)
+    if args.list_voices:
+        engine = pyttsx3.init()
+        for i, v in enumerate(engine.getProperty("voices") or []):
+            print(i, v.name, v.id)
+        return
 
-    # You could list/change voices here if you want:
-    # voices = engine.getProperty("voices")
-    # for i, v in enumerate(voices):
-    #     print(i, v.name)
-    # engine.setProperty("voice", voices[0].id)
+    if args.text:
+        pieces = [" ".join(args.text)]
+    elif args.no_stream:
+        # Read from stdin (e.g., piped from citl_multi_rag)
+        pieces = [sys.stdin.read()]
+    else:
+        pieces = iter_text(sys.stdin)
 
-    engine.say(text)
-    engine.runAndWait()
+    try:
+        speaker = speak_stream(pieces, args.rate, args.volume, args.voice, Path(args.save) if args.save else None)
+    except ValueError as e:
+        print(f"[ERROR] {e}")
+        sys.exit(1)
+    if speaker.sentences == 0:
+        print("[WARN] No text provided to TTS.")
+        return
+    print(speaker.report(), file=sys.stderr)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
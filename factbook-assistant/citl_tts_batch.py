@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Batch text-to-speech: many texts to audio files, in parallel, cached.
+
+  python citl_tts.py --batch chapters/ --out-dir audio/            # *.txt
+  python citl_tts.py --batch answers.jsonl --out-dir faq_audio/ --format ogg
+
+JSONL input is one record per line with "text" (or "answer", so the output
+of citl_multi_rag.py --batch works as is) and an optional "id" that names
+the file; a plain JSON string per line works too. Texts are rendered by a
+pool of worker processes, each holding its own pyttsx3 engine.
+
+Every rendering is cached under a hash of (text, rate, volume, voice,
+format) in CITL_TTS_CACHE (default: index/tts_cache), with its duration in
+<key>.json next to it, so re-running a batch after editing a few texts only
+synthesizes those. The output folder gets
+<id>.wav/.ogg plus index.jsonl ({"id", "file", "seconds", "cached"}).
+OGG needs ffmpeg on the PATH.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import wave
+import shutil
+import hashlib
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+ROOT = Path(__file__).resolve().parent
+CACHE_DIR = Path(os.environ.get("CITL_TTS_CACHE", str(ROOT / "index" / "tts_cache")))
+DEFAULT_JOBS = max(1, min(4, (os.cpu_count() or 1) // 2))
+FORMATS = ("wav", "ogg")
+
+_SAFE_RE = re.compile(r"[^A-Za-z0-9._-]+")
+
+
+# ---------------------------------------------------------------------
+# Input
+# ---------------------------------------------------------------------
+
+def _safe_id(value: str) -> str:
+    return _SAFE_RE.sub("_", value).strip("._") or "item"
+
+
+def read_items(path: Path) -> List[dict]:
+    """
+    [{"id", "text"}] from a folder of .txt files or a JSONL file. Ids are
+    made file-name safe and unique.
+    """
+    path = Path(path)
+    items: List[dict] = []
+    if path.is_dir():
+        for p in sorted(path.rglob("*.txt")):
+            rel = p.relative_to(path).with_suffix("")
+            items.append({"id": "__".join(rel.parts), "text": p.read_text(encoding="utf-8")})
+    else:
+        with open(path, encoding="utf-8") as f:
+            for lineno, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                rec = json.loads(line)
+                if isinstance(rec, str):
+                    rec = {"text": rec}
+                text = rec.get("text") or rec.get("answer")
+                if not isinstance(text, str):
+                    raise ValueError(f"{path}:{lineno}: no \"text\" or \"answer\" field")
+                items.append({"id": str(rec.get("id", lineno)), "text": text})
+
+    seen = set()
+    for item in items:
+        base = _safe_id(item["id"])
+        name, n = base, 1
+        while name in seen:
+            n += 1
+            name = f"{base}_{n}"
+        seen.add(name)
+        item["id"] = name
+        item["text"] = " ".join(item["text"].split())
+    return [i for i in items if i["text"]]
+
+
+def cache_key(text: str, rate: int, volume: float, voice: Optional[str], fmt: str) -> str:
+    raw = json.dumps([text, rate, round(volume, 3), voice, fmt], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def cache_file(cache_dir: Path, key: str, fmt: str) -> Path:
+    return cache_dir / key[:2] / f"{key}.{fmt}"
+
+
+def seconds_file(cache_dir: Path, key: str) -> Path:
+    return cache_dir / key[:2] / f"{key}.json"
+
+
+def cached_seconds(cache_dir: Path, key: str) -> Optional[float]:
+    """
+    Duration recorded when the entry was rendered, or None if there is no
+    record (entries cached before durations were stored).
+    """
+    try:
+        with open(seconds_file(cache_dir, key), encoding="utf-8") as f:
+            return float(json.load(f)["seconds"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def audio_seconds(path: Path) -> float:
+    """
+    Duration of a WAV file, or 0.0 for anything wave cannot read (OGG,
+    AIFF from macOS voices).
+    """
+    try:
+        with wave.open(str(path), "rb") as w:
+            return w.getnframes() / float(w.getframerate())
+    except (wave.Error, EOFError, OSError):
+        return 0.0
+
+
+# ---------------------------------------------------------------------
+# Workers
+# ---------------------------------------------------------------------
+
+_engine = None
+
+
+def _init_worker(rate: int, volume: float, voice: Optional[str]) -> None:
+    global _engine
+    from citl_tts import make_engine
+
+    _engine = make_engine(rate, volume, voice)
+
+
+def _render(job: Tuple[str, str, str, str]) -> Tuple[str, float]:
+    """
+    (key, text, target, fmt) -> (key, seconds). The file is written next
+    to its cache path and renamed in, so an interrupted batch leaves no
+    half-written cache entries. The duration is measured on the WAV
+    (before any OGG encoding) and stored in <key>.json for cache hits.
+    """
+    key, text, target, fmt = job
+    target = Path(target)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    wav_tmp = target.with_name(f"{key}.{os.getpid()}.tmp.wav")
+    ogg_tmp = target.with_name(f"{key}.{os.getpid()}.tmp.ogg")
+    meta_tmp = target.with_name(f"{key}.{os.getpid()}.tmp.json")
+    try:
+        _engine.save_to_file(text, str(wav_tmp))
+        _engine.runAndWait()
+        seconds = audio_seconds(wav_tmp)
+        if fmt == "ogg":
+            subprocess.run(
+                ["ffmpeg", "-v", "error", "-y", "-i", str(wav_tmp), "-c:a", "libvorbis", str(ogg_tmp)],
+                check=True,
+            )
+            os.replace(ogg_tmp, target)
+        else:
+            os.replace(wav_tmp, target)
+        # Written after the audio: a present .json always has its audio file
+        meta_tmp.write_text(json.dumps({"seconds": round(seconds, 3)}), encoding="utf-8")
+        os.replace(meta_tmp, target.with_name(f"{key}.json"))
+    finally:
+        # A failed render or encode must not leave temporaries in the
+        # shared cache; after success only the WAV of an OGG job is left
+        for tmp in (wav_tmp, ogg_tmp, meta_tmp):
+            tmp.unlink(missing_ok=True)
+    return key, seconds
+
+
+def _place(src: Path, dst: Path) -> None:
+    """
+    Put a cached rendering in the output folder (hard link when possible).
+    """
+    if dst.exists():
+        dst.unlink()
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+# ---------------------------------------------------------------------
+# Batch
+# ---------------------------------------------------------------------
+
+def run_batch(
+    src: Path,
+    out_dir: Path,
+    rate: int = 180,
+    volume: float = 1.0,
+    voice: Optional[str] = None,
+    fmt: str = "wav",
+    jobs: int = DEFAULT_JOBS,
+    cache_dir: Path = CACHE_DIR,
+) -> dict:
+    """
+    Render every text in ``src`` to ``out_dir``; returns the totals that
+    report() prints.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"unsupported format {fmt!r}; choose from {FORMATS}")
+    if fmt == "ogg" and shutil.which("ffmpeg") is None:
+        raise RuntimeError("OGG output needs ffmpeg on the PATH (or use --format wav)")
+    t0 = time.perf_counter()
+    items = read_items(src)
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    cache_dir = Path(cache_dir)
+
+    if voice:
+        # Key the cache on the voice id, not on how it was spelled
+        from citl_tts import find_voice
+        import pyttsx3
+
+        voice = find_voice(pyttsx3.init(), voice)
+
+    todo = {}
+    for item in items:
+        item["key"] = cache_key(item["text"], rate, volume, voice, fmt)
+        item["cached"] = cache_file(cache_dir, item["key"], fmt).exists()
+        if not item["cached"]:
+            todo.setdefault(item["key"], item["text"])
+
+    seconds = {}
+    errors = 0
+    if todo:
+        workers = max(1, min(int(jobs), len(todo)))
+        print(f"[INFO] Synthesizing {len(todo)} text(s) with {workers} worker(s)...", file=sys.stderr)
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(rate, volume, voice),
+        ) as pool:
+            # Longest first, so one long chapter does not finish alone at the end
+            order = sorted(todo.items(), key=lambda kv: -len(kv[1]))
+            futures = {
+                pool.submit(_render, (key, text, str(cache_file(cache_dir, key, fmt)), fmt)): key
+                for key, text in order
+            }
+            for fut in as_completed(futures):
+                try:
+                    key, secs = fut.result()
+                    seconds[key] = secs
+                except Exception as e:
+                    errors += 1
+                    print(f"[ERROR] Rendering failed: {type(e).__name__}: {e}", file=sys.stderr)
+
+    total_audio = 0.0
+    done = 0
+    with open(out_dir / "index.jsonl", "w", encoding="utf-8") as index:
+        for item in items:
+            cached = cache_file(cache_dir, item["key"], fmt)
+            if not cached.exists():
+                continue
+            dst = out_dir / f"{item['id']}.{fmt}"
+            _place(cached, dst)
+            secs = seconds.get(item["key"])
+            if secs is None:
+                secs = cached_seconds(cache_dir, item["key"])
+            if secs is None:
+                secs = audio_seconds(dst)
+            total_audio += secs
+            done += 1
+            index.write(
+                json.dumps(
+                    {"id": item["id"], "file": dst.name, "seconds": round(secs, 2), "cached": item["cached"]},
+                    ensure_ascii=False,
+                )
+                + "\n"
+            )
+
+    return {
+        "items": len(items),
+        "written": done,
+        "synthesized": len(seconds),
+        "cached": sum(1 for i in items if i["cached"]),
+        "errors": errors,
+        "audio_seconds": total_audio,
+        "synth_audio_seconds": sum(seconds.values()),
+        "wall_seconds": time.perf_counter() - t0,
+    }
+
+
+def report(stats: dict) -> str:
+    wall = stats["wall_seconds"] or 1e-9
+    msg = (
+        f"[INFO] {stats['written']}/{stats['items']} file(s), {stats['audio_seconds'] / 60:.1f} min of audio "
+        f"in {wall:.1f}s: {stats['synthesized']} synthesized "
+        f"({stats['synth_audio_seconds'] / wall:.1f} audio s per wall s), {stats['cached']} from cache"
+    )
+    if stats["errors"]:
+        msg += f", {stats['errors']} failed"
+    return msg
@@ -0,0 +1,495 @@
+#!/usr/bin/env python3
+"""
+Pluggable vector-index layer for corpus retrieval.
+
+  FlatIndex - exact brute-force emb @ q (today's behavior, the baseline)
+  IVFIndex  - inverted-file ANN in pure NumPy: spherical k-means centroids,
+              each chunk assigned to its nearest centroid, and a query only
+              scores the chunks in its ``nprobe`` closest lists
+
+The IVF index is built by the indexers (--ann ivf, or automatically for big
+corpora) and saved next to the embeddings as index/<name>.ivf.npz. It records
+the size/mtime of the .emb.npy it was built from and is ignored if the
+embeddings have been rewritten since.
+
+Environment:
+  CITL_ANN         - "auto" (use IVF if present, default), "flat" or "ivf"
+  CITL_ANN_NPROBE  - lists probed per query (default: nlist / 8)
+
+Recall@k vs latency against the flat baseline:
+  python citl_vector_index.py report --name nursing -k 10 --nprobe 1 4 16
+"""
+
+import os
+import time
+import argparse
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from citl_quant import score
+
+ANN_SUFFIX = ".ivf.npz"
+ANN_MODE = os.environ.get("CITL_ANN", "auto")
+_nprobe = os.environ.get("CITL_ANN_NPROBE")
+DEFAULT_NPROBE: Optional[int] = int(_nprobe) if _nprobe else None
+
+# --ann auto builds IVF only for corpora at least this big
+AUTO_MIN_CHUNKS = 20000
+
+
+def ann_path(index_dir: Path, name: str) -> Path:
+    return Path(index_dir) / f"{name}{ANN_SUFFIX}"
+
+
+def _top(sims: np.ndarray, k: int) -> np.ndarray:
+    """
+    Indices of the k largest values of a 1-D array, best first.
+    """
+    k = min(k, sims.shape[0])
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    idx = np.argpartition(-sims, k - 1)[:k]
+    return idx[np.argsort(-sims[idx])]
+
+
+def top_rows(sims: np.ndarray, k: int) -> np.ndarray:
+    """
+    Row-wise _top for a (Q, N) score matrix: (Q, k) column indices.
+    """
+    k = min(k, sims.shape[1])
+    if k <= 0:
+        return np.zeros((sims.shape[0], 0), dtype=np.int64)
+    idx = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+    part = np.take_along_axis(sims, idx, axis=1)
+    return np.take_along_axis(idx, np.argsort(-part, axis=1), axis=1)
+
+
+def query_block(n_rows: int, budget: int = 1 << 26) -> int:
+    """
+    Queries per Q @ E.T block so the score matrix stays under ``budget``
+    floats (256 MB).
+    """
+    return max(1, budget // max(1, n_rows))
+
+
+# ---------------------------------------------------------------------
+# Indexes
+# ---------------------------------------------------------------------
+
+class FlatIndex:
+    """
+    Exact search over every row.
+    """
+
+    kind = "flat"
+
+    def __init__(self, emb: np.ndarray):
+        self.emb = emb
+
+    def __len__(self) -> int:
+        return self.emb.shape[0]
+
+    def search(self, qvec: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return (row ids, scores) of the top-k rows, best first.
+        """
+        if self.emb.shape[0] == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        sims = score(self.emb, qvec)
+        idx = _top(sims, k)
+        return idx, sims[idx]
+
+    def search_batch(self, qmat: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k for many queries with one Q @ E.T product per block.
+        Returns (Q, k) ids and scores, best first per row.
+        """
+        n = self.emb.shape[0]
+        kk = min(k, n)
+        ids = np.zeros((qmat.shape[0], kk), dtype=np.int64)
+        scores = np.zeros((qmat.shape[0], kk), dtype=np.float32)
+        step = query_block(n)
+        for i in range(0, qmat.shape[0], step):
+            sims = score(self.emb, qmat[i : i + step])
+            top = top_rows(sims, kk)
+            ids[i : i + step] = top
+            scores[i : i + step] = np.take_along_axis(sims, top, axis=1)
+        return ids, scores
+
+
+class IVFIndex:
+    """
+    Inverted-file index. Lists are stored CSR-style: the chunk ids of list j
+    are list_ids[list_offsets[j]:list_offsets[j + 1]].
+    """
+
+    kind = "ivf"
+
+    def __init__(
+        self,
+        emb: np.ndarray,
+        centroids: np.ndarray,
+        list_offsets: np.ndarray,
+        list_ids: np.ndarray,
+        nprobe: Optional[int] = None,
+    ):
+        self.emb = emb
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_ids = list_ids
+        nlist = centroids.shape[0]
+        self.nprobe = max(1, min(nlist, nprobe or DEFAULT_NPROBE or max(1, nlist // 8)))
+
+    def __len__(self) -> int:
+        return self.emb.shape[0]
+
+    @property
+    def nlist(self) -> int:
+        return self.centroids.shape[0]
+
+    def candidates(self, qvec: np.ndarray, nprobe: Optional[int] = None) -> np.ndarray:
+        probe = _top(self.centroids @ qvec, nprobe or self.nprobe)
+        parts = [
+            self.list_ids[self.list_offsets[p] : self.list_offsets[p + 1]] for p in probe
+        ]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=self.list_ids.dtype)
+
+    def search(
+        self, qvec: np.ndarray, k: int, nprobe: Optional[int] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        cand = self.candidates(qvec, nprobe)
+        if cand.shape[0] == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        # Sorting the ids keeps reads from a memory-mapped matrix sequential
+        cand = np.sort(cand)
+        sims = self.emb[cand] @ qvec
+        idx = _top(sims, k)
+        return cand[idx].astype(np.int64), sims[idx]
+
+    def search_batch(self, qmat: np.ndarray, k: int) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+        """
+        Per-query search; candidate lists differ per query, so rows may
+        have fewer than k hits and are returned as lists.
+        """
+        out = [self.search(q, k) for q in qmat]
+        return [o[0] for o in out], [o[1] for o in out]
+
+
+# ---------------------------------------------------------------------
+# Building
+# ---------------------------------------------------------------------
+
+def _assign(emb: np.ndarray, centroids: np.ndarray, block: int = 65536) -> np.ndarray:
+    out = np.empty(emb.shape[0], dtype=np.int32)
+    for i in range(0, emb.shape[0], block):
+        part = np.asarray(emb[i : i + block], dtype=np.float32)
+        out[i : i + block] = np.argmax(part @ centroids.T, axis=1)
+    return out
+
+
+def train_centroids(
+    emb: np.ndarray,
+    nlist: int,
+    iters: int = 20,
+    sample: int = 256,
+    seed: int = 0,
+) -> np.ndarray:
+    """
+    Spherical k-means on a sample of at most ``sample * nlist`` rows.
+    """
+    rng = np.random.default_rng(seed)
+    n = emb.shape[0]
+    take = min(n, sample * nlist)
+    rows = np.sort(rng.choice(n, size=take, replace=False)) if take < n else np.arange(n)
+    x = np.asarray(emb[rows], dtype=np.float32)
+
+    centroids = x[rng.choice(x.shape[0], size=nlist, replace=False)].copy()
+    for _ in range(iters):
+        assign = np.argmax(x @ centroids.T, axis=1)
+        counts = np.bincount(assign, minlength=nlist)
+        order = np.argsort(assign, kind="stable")
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        sums = np.zeros_like(centroids)
+        filled = counts > 0
+        sums[filled] = np.add.reduceat(x[order], starts[filled], axis=0)
+        empty = ~filled
+        if empty.any():
+            # Re-seed empty clusters from random points
+            sums[empty] = x[rng.choice(x.shape[0], size=int(empty.sum()), replace=False)]
+        centroids = sums / (np.linalg.norm(sums, axis=1, keepdims=True) + 1e-8)
+    return centroids.astype(np.float32)
+
+
+def default_nlist(n: int) -> int:
+    return int(max(1, min(n, round(4 * np.sqrt(n)))))
+
+
+def build_ivf(
+    emb: np.ndarray,
+    nlist: Optional[int] = None,
+    iters: int = 20,
+    seed: int = 0,
+) -> IVFIndex:
+    n = emb.shape[0]
+    nlist = min(n, nlist or default_nlist(n))
+    centroids = train_centroids(emb, nlist, iters=iters, seed=seed)
+    assign = _assign(emb, centroids)
+    order = np.argsort(assign, kind="stable").astype(np.int32)
+    counts = np.bincount(assign, minlength=nlist)
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    return IVFIndex(emb, centroids, offsets, order)
+
+
+def extend_ivf(ivf: IVFIndex, emb: np.ndarray, start: int) -> IVFIndex:
+    """
+    The index over ``emb``, whose rows from ``start`` on are new: they join
+    the list of their nearest existing centroid, nothing is re-trained.
+    """
+    assign = _assign(emb[start:], ivf.centroids)
+    lists = np.concatenate([
+        np.repeat(np.arange(ivf.nlist, dtype=np.int32), np.diff(ivf.list_offsets)),
+        assign,
+    ])
+    ids = np.concatenate([ivf.list_ids, np.arange(start, emb.shape[0], dtype=ivf.list_ids.dtype)])
+    order = np.argsort(lists, kind="stable")
+    counts = np.bincount(lists, minlength=ivf.nlist)
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    return IVFIndex(emb, ivf.centroids, offsets, ids[order])
+
+
+def save_ivf(index: IVFIndex, path: Path, emb_path: Path) -> None:
+    st = Path(emb_path).stat()
+    path = Path(path)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        np.savez(
+            f,
+            centroids=index.centroids,
+            list_offsets=index.list_offsets,
+            list_ids=index.list_ids,
+            emb_sig=np.array([st.st_size, st.st_mtime_ns], dtype=np.int64),
+        )
+    os.replace(tmp, path)
+
+
+def load_ivf(path: Path, emb: np.ndarray, emb_path: Path, nprobe: Optional[int] = None) -> Optional[IVFIndex]:
+    """
+    Load an IVF index, or None if it is missing or stale.
+    """
+    path = Path(path)
+    if not path.exists():
+        return None
+    st = Path(emb_path).stat()
+    # Read everything and close the archive, so the file can be replaced
+    with np.load(path) as data:
+        if tuple(data["emb_sig"]) != (st.st_size, st.st_mtime_ns):
+            print(f"[WARN] {path.name} is older than the embeddings; using exact search")
+            return None
+        return IVFIndex(emb, data["centroids"], data["list_offsets"], data["list_ids"], nprobe)
+
+
+def open_index(
+    index_dir: Path,
+    name: str,
+    emb: np.ndarray,
+    mode: str = ANN_MODE,
+    nprobe: Optional[int] = None,
+):
+    """
+    Pick the search backend for a corpus: IVF when available (mode "auto"
+    or "ivf"), otherwise exact flat search.
+    """
+    if mode != "flat":
+        emb_path = Path(index_dir) / f"{name}.emb.npy"
+        ivf = load_ivf(ann_path(index_dir, name), emb, emb_path, nprobe)
+        if ivf is not None:
+            return ivf
+        if mode == "ivf":
+            print(f"[WARN] No usable IVF index for '{name}'; using exact search")
+    return FlatIndex(emb)
+
+
+# ---------------------------------------------------------------------
+# Indexer integration
+# ---------------------------------------------------------------------
+
+def add_ann_args(parser) -> None:
+    parser.add_argument(
+        "--ann",
+        choices=["auto", "ivf", "none"],
+        default="auto",
+        help=f"Build an IVF ANN index (auto: only for corpora >= {AUTO_MIN_CHUNKS} chunks)",
+    )
+    parser.add_argument(
+        "--nlist",
+        type=int,
+        default=None,
+        help="IVF lists (default: 4 * sqrt(chunks))",
+    )
+
+
+def build_for_corpus(index_dir: Path, name: str, ann: str = "auto", nlist: Optional[int] = None) -> None:
+    """
+    Called by the indexers after write_corpus(), on the saved (normalized)
+    embeddings. Removes a stale IVF file when ANN is off so a later query
+    can't pick it up.
+    """
+    from citl_corpus import open_corpus
+
+    path = ann_path(index_dir, name)
+    emb_path = Path(index_dir) / f"{name}.emb.npy"
+    corpus = open_corpus(index_dir, name)
+    corpus.close()
+    emb = corpus.emb
+    if ann == "none" or (ann == "auto" and emb.shape[0] < AUTO_MIN_CHUNKS):
+        if path.exists():
+            path.unlink()
+        return
+    t0 = time.perf_counter()
+    ivf = build_ivf(emb, nlist)
+    save_ivf(ivf, path, emb_path)
+    print(f"Built IVF index ({ivf.nlist} lists) in {time.perf_counter() - t0:.1f}s -> {path}")
+
+
+def append_for_corpus(index_dir: Path, name: str, start: int, ann: str = "auto", nlist: Optional[int] = None) -> None:
+    """
+    Called after rows were appended to a corpus from ``start`` on: an
+    existing IVF index that ends at ``start`` gets the new rows assigned to
+    its centroids. Anything else (no index yet, ANN off, --nlist given) goes
+    through build_for_corpus, so k-means only runs when a corpus first
+    reaches AUTO_MIN_CHUNKS or is rebuilt.
+    """
+    from citl_corpus import open_corpus
+
+    path = ann_path(index_dir, name)
+    if ann == "none" or nlist is not None or not start or not path.exists():
+        build_for_corpus(index_dir, name, ann, nlist)
+        return
+    with np.load(path) as data:
+        centroids, offsets, ids = data["centroids"], data["list_offsets"], data["list_ids"]
+    if ids.shape[0] != start:
+        build_for_corpus(index_dir, name, ann, nlist)
+        return
+
+    t0 = time.perf_counter()
+    corpus = open_corpus(index_dir, name)
+    corpus.close()
+    ivf = extend_ivf(IVFIndex(corpus.emb, centroids, offsets, ids), corpus.emb, start)
+    save_ivf(ivf, path, Path(index_dir) / f"{name}.emb.npy")
+    print(
+        f"Added {corpus.emb.shape[0] - start} rows to the IVF index ({ivf.nlist} lists) "
+        f"in {time.perf_counter() - t0:.2f}s -> {path}"
+    )
+
+
+# ---------------------------------------------------------------------
+# Recall / latency report
+# ---------------------------------------------------------------------
+
+def _percentile_ms(times: List[float], q: float) -> float:
+    return float(np.percentile(np.asarray(times) * 1000, q)) if times else 0.0
+
+
+def recall_report(
+    emb: np.ndarray,
+    ivf: IVFIndex,
+    queries: np.ndarray,
+    k: int,
+    nprobes: Sequence[int],
+) -> List[dict]:
+    """
+    Compare IVF at several nprobe settings against exact flat search.
+    Returns one row per setting (nprobe 0 = the flat baseline).
+    """
+    flat = FlatIndex(emb)
+    truth = []
+    times: List[float] = []
+    for q in queries:
+        t0 = time.perf_counter()
+        ids, _ = flat.search(q, k)
+        times.append(time.perf_counter() - t0)
+        truth.append(set(ids.tolist()))
+    flat_ms = float(np.mean(times) * 1000)
+    rows = [{
+        "backend": "flat", "nprobe": 0, "recall": 1.0,
+        "mean_ms": flat_ms, "p95_ms": _percentile_ms(times, 95), "speedup": 1.0,
+    }]
+
+    for nprobe in nprobes:
+        hits = 0
+        times = []
+        for q, want in zip(queries, truth):
+            t0 = time.perf_counter()
+            ids, _ = ivf.search(q, k, nprobe=nprobe)
+            times.append(time.perf_counter() - t0)
+            hits += len(want.intersection(ids.tolist()))
+        mean_ms = float(np.mean(times) * 1000)
+        rows.append({
+            "backend": "ivf", "nprobe": int(nprobe),
+            "recall": hits / max(1, len(truth) * k),
+            "mean_ms": mean_ms, "p95_ms": _percentile_ms(times, 95),
+            "speedup": flat_ms / mean_ms if mean_ms > 0 else 0.0,
+        })
+    return rows
+
+
+def sample_queries(emb: np.ndarray, n: int, noise: float = 0.05, seed: int = 1) -> np.ndarray:
+    """
+    Offline stand-in queries: stored vectors plus a little noise.
+    """
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(emb.shape[0], size=min(n, emb.shape[0]), replace=False)
+    q = np.asarray(emb[rows], dtype=np.float32)
+    q = q + noise * rng.standard_normal(q.shape).astype(np.float32) / np.sqrt(q.shape[1])
+    return q / (np.linalg.norm(q, axis=1, keepdims=True) + 1e-8)
+
+
+def main() -> None:
+    from citl_corpus import INDEX_DIR, open_corpus
+
+    ap = argparse.ArgumentParser(description="Build or evaluate IVF ANN indexes.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    b = sub.add_parser("build", help="Build <name>.ivf.npz for an existing corpus")
+    b.add_argument("--name", required=True)
+    b.add_argument("--nlist", type=int, default=None)
+
+    r = sub.add_parser("report", help="Recall@k vs latency against flat search")
+    r.add_argument("--name", required=True)
+    r.add_argument("-k", type=int, default=10)
+    r.add_argument("--queries", type=int, default=200)
+    r.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    r.add_argument("--nlist", type=int, default=None, help="Build a throwaway IVF with this many lists")
+
+    for p in (b, r):
+        p.add_argument("--index-dir", default=str(INDEX_DIR))
+    args = ap.parse_args()
+
+    index_dir = Path(args.index_dir)
+    corpus = open_corpus(index_dir, args.name)
+    emb = np.asarray(corpus.emb, dtype=np.float32)
+
+    if args.cmd == "build":
+        build_for_corpus(index_dir, args.name, "ivf", args.nlist)
+        return
+
+    ivf = None
+    if args.nlist is None:
+        ivf = load_ivf(ann_path(index_dir, args.name), emb, index_dir / f"{args.name}.emb.npy")
+    if ivf is None:
+        ivf = build_ivf(emb, args.nlist)
+    queries = sample_queries(emb, args.queries)
+    rows = recall_report(emb, ivf, queries, args.k, [p for p in args.nprobe if p <= ivf.nlist])
+
+    print(f"{args.name}: {emb.shape[0]} chunks x {emb.shape[1]} dims, "
+          f"{ivf.nlist} lists, {len(queries)} queries, k={args.k}")
+    print(f"{'backend':<8}{'nprobe':>8}{'recall@k':>10}{'mean ms':>10}{'p95 ms':>10}{'speedup':>9}")
+    for row in rows:
+        print(f"{row['backend']:<8}{row['nprobe']:>8}{row['recall']:>10.3f}"
+              f"{row['mean_ms']:>10.3f}{row['p95_ms']:>10.3f}{row['speedup']:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
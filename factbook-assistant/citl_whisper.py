@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""
+Chunked, parallel Whisper transcription for long recordings (CPU only).
+
+  python citl_whisper.py lecture.wav --whisper-model base --workers 4
+
+  WAV -> 16 kHz mono int16 (no ffmpeg needed)
+      -> energy VAD: cut in the longest pause within every MAX_SEGMENT_S
+         of audio; all-silent stretches are dropped
+      -> process pool, each worker loads the model once and transcribes
+         whole segments
+      -> segments stitched back in order, Whisper's timestamps shifted by
+         each segment's offset
+
+Cutting in pauses keeps words whole, and segments of at most 30 s match
+Whisper's own decode window, so a segment is one decode pass. Throughput
+is reported as the realtime factor (RTF = wall time / audio time; 0.25
+means an hour of audio takes 15 minutes).
+
+Workers split the CPU cores between them (torch threads = cores /
+workers): on a lab machine several single-threaded decodes beat one
+decode that cannot use the cores efficiently.
+
+Environment:
+  CITL_WHISPER_WORKERS - worker processes (default: cores // 2, at least 1)
+"""
+
+import os
+import sys
+import time
+import wave
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+FRAME_S = 0.02
+MAX_SEGMENT_S = 30.0
+MIN_SEGMENT_S = 5.0
+# A frame counts as silence below the noise floor plus this margin
+SILENCE_MARGIN_DB = 8.0
+MIN_SILENCE_DB = -55.0
+
+DEFAULT_WORKERS = int(os.environ.get("CITL_WHISPER_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+
+Span = Tuple[int, int]
+
+
+# ---------------------------------------------------------------------
+# Audio
+# ---------------------------------------------------------------------
+
+def read_wav(path: Path) -> np.ndarray:
+    """
+    Read a PCM WAV as 16 kHz mono int16 (channels averaged, other rates
+    resampled linearly).
+    """
+    with wave.open(str(path), "rb") as wf:
+        channels = wf.getnchannels()
+        width = wf.getsampwidth()
+        rate = wf.getframerate()
+        raw = wf.readframes(wf.getnframes())
+    if width == 2:
+        pcm = np.frombuffer(raw, dtype=np.int16)
+    elif width == 1:
+        pcm = ((np.frombuffer(raw, dtype=np.uint8).astype(np.int16) - 128) << 8)
+    elif width == 4:
+        pcm = (np.frombuffer(raw, dtype=np.int32) >> 16).astype(np.int16)
+    else:
+        raise ValueError(f"{path}: unsupported sample width {width * 8} bits")
+    if channels > 1:
+        pcm = pcm.reshape(-1, channels).mean(axis=1).astype(np.int16)
+    if rate != SAMPLE_RATE:
+        pcm = resample(pcm, rate)
+    return pcm
+
+
+def resample(pcm: np.ndarray, rate: int) -> np.ndarray:
+    n = int(round(pcm.shape[0] * SAMPLE_RATE / rate))
+    x = np.arange(n, dtype=np.float64) * (rate / SAMPLE_RATE)
+    return np.interp(x, np.arange(pcm.shape[0]), pcm).astype(np.int16)
+
+
+def to_float(pcm: np.ndarray) -> np.ndarray:
+    """
+    int16 PCM -> float32 in [-1, 1], the array form whisper accepts.
+    """
+    return pcm.astype(np.float32) / 32768.0
+
+
+def frame_db(pcm: np.ndarray, frame: int) -> np.ndarray:
+    """
+    RMS level per frame in dBFS.
+    """
+    n = pcm.shape[0] // frame
+    if n == 0:
+        return np.zeros(0, dtype=np.float32)
+    x = pcm[: n * frame].astype(np.float32).reshape(n, frame) / 32768.0
+    rms = np.sqrt(np.mean(x * x, axis=1) + 1e-12)
+    return (20 * np.log10(rms)).astype(np.float32)
+
+
+def split_on_silence(
+    pcm: np.ndarray,
+    max_segment_s: float = MAX_SEGMENT_S,
+    min_segment_s: float = MIN_SEGMENT_S,
+) -> List[Span]:
+    """
+    Sample spans of at most ``max_segment_s`` each, cut in the middle of the
+    longest pause in the last part of every window (the quietest frame if
+    there is no pause). Spans that are silent throughout are left out.
+    """
+    frame = int(SAMPLE_RATE * FRAME_S)
+    db = frame_db(pcm, frame)
+    if db.shape[0] == 0:
+        return []
+    # Noise floor plus a margin, but well under the loud frames: a short
+    # window of near-continuous speech has no quiet tenth to measure
+    floor, loud = np.percentile(db, [10, 90])
+    threshold = max(min(floor + SILENCE_MARGIN_DB, loud - 2 * SILENCE_MARGIN_DB), MIN_SILENCE_DB)
+    silent = db < threshold
+
+    max_f = max(1, int(max_segment_s / FRAME_S))
+    min_f = min(max_f, max(1, int(min_segment_s / FRAME_S)))
+    cuts = [0]
+    start = 0
+    while db.shape[0] - start > max_f:
+        lo, hi = start + min_f, start + max_f
+        window = silent[lo:hi]
+        if window.any():
+            # Longest silent run, ties to the latest one
+            best_len, best_mid, run = 0, None, 0
+            for i, s in enumerate(window):
+                run = run + 1 if s else 0
+                if run and run >= best_len:
+                    best_len, best_mid = run, lo + i - run // 2
+            cut = best_mid
+        else:
+            cut = lo + int(np.argmin(db[lo:hi]))
+        cuts.append(cut)
+        start = cut
+    cuts.append(db.shape[0])
+
+    spans = []
+    for a, b in zip(cuts, cuts[1:]):
+        if b > a and not silent[a:b].all():
+            end = pcm.shape[0] if b == db.shape[0] else b * frame
+            spans.append((a * frame, end))
+    return spans
+
+
+def fmt_time(seconds: float) -> str:
+    s = int(seconds)
+    return f"{s // 3600:02d}:{s % 3600 // 60:02d}:{s % 60:02d}"
+
+
+# ---------------------------------------------------------------------
+# Workers
+# ---------------------------------------------------------------------
+
+_model = None
+_options: dict = {}
+
+
+def load_model(model_size: str, threads: Optional[int] = None):
+    """
+    Load a Whisper model for CPU decoding, optionally capping torch's
+    intra-op threads.
+    """
+    import whisper
+
+    if threads:
+        import torch
+
+        torch.set_num_threads(max(1, int(threads)))
+    return whisper.load_model(model_size, device="cpu")
+
+
+def decode(model, audio: np.ndarray, language: Optional[str] = "en") -> List[dict]:
+    """
+    Transcribe one float32 segment; returns Whisper's segments
+    ({"start", "end", "text"}, seconds relative to the segment).
+    """
+    result = model.transcribe(audio, language=language, fp16=False, verbose=None)
+    return [
+        {"start": float(s["start"]), "end": float(s["end"]), "text": s["text"].strip()}
+        for s in result.get("segments", [])
+        if s.get("text", "").strip()
+    ]
+
+
+def _init_worker(model_size: str, threads: int, language: Optional[str]) -> None:
+    global _model, _options
+    _model = load_model(model_size, threads)
+    _options = {"language": language}
+
+
+def _work(job: Tuple[int, float, np.ndarray]) -> Tuple[int, List[dict], float]:
+    index, offset, pcm = job
+    t0 = time.perf_counter()
+    segs = decode(_model, to_float(pcm), **_options)
+    for s in segs:
+        s["start"] += offset
+        s["end"] += offset
+    return index, segs, time.perf_counter() - t0
+
+
+# ---------------------------------------------------------------------
+# Engine
+# ---------------------------------------------------------------------
+
+class Transcript:
+    """
+    Stitched result: ``segments`` ({"start", "end", "text"}, seconds from
+    the start of the recording) in order, plus timing.
+    """
+
+    def __init__(self, segments: List[dict], audio_seconds: float, wall_seconds: float, load_seconds: float = 0.0):
+        self.segments = segments
+        self.audio_seconds = audio_seconds
+        self.wall_seconds = wall_seconds
+        self.load_seconds = load_seconds
+
+    @property
+    def text(self) -> str:
+        return " ".join(s["text"] for s in self.segments).strip()
+
+    @property
+    def rtf(self) -> float:
+        return self.wall_seconds / self.audio_seconds if self.audio_seconds else 0.0
+
+    def timestamped(self) -> str:
+        """
+        One "[hh:mm:ss] text" line per Whisper segment.
+        """
+        return "\n".join(f"[{fmt_time(s['start'])}] {s['text']}" for s in self.segments)
+
+    def report(self) -> str:
+        speed = 1 / self.rtf if self.rtf else 0.0
+        msg = (
+            f"[INFO] Transcribed {self.audio_seconds / 60:.1f} min of audio in "
+            f"{self.wall_seconds / 60:.1f} min (RTF {self.rtf:.2f}, {speed:.1f}x realtime)"
+        )
+        if self.load_seconds:
+            msg += f"; model load {self.load_seconds:.1f}s"
+        return msg
+
+
+class WhisperEngine:
+    """
+    Transcribes long audio by splitting it at pauses and decoding the
+    segments on a pool of processes that each hold a loaded model.
+
+    engine = WhisperEngine("base", workers=4)
+    result = engine.transcribe("lecture.wav")
+    print(result.timestamped(), result.report())
+    engine.close()
+
+    The pool (and the models in it) lives until close(), so further calls
+    pay no load time. workers=1 decodes in this process.
+    """
+
+    def __init__(
+        self,
+        model_size: str = "base",
+        workers: int = DEFAULT_WORKERS,
+        language: Optional[str] = "en",
+        max_segment_s: float = MAX_SEGMENT_S,
+    ):
+        self.model_size = model_size
+        self.workers = max(1, int(workers))
+        self.language = language
+        self.max_segment_s = max_segment_s
+        self.threads = max(1, (os.cpu_count() or 1) // self.workers)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._model = None
+
+    def load(self) -> float:
+        """
+        Load the model(s) if needed; returns the seconds it took. A pool
+        whose workers fail to load is shut down, so the next call retries.
+        """
+        t0 = time.perf_counter()
+        if self.workers == 1:
+            if self._model is None:
+                self._model = load_model(self.model_size, self.threads)
+                return time.perf_counter() - t0
+            return 0.0
+        if self._pool is None:
+            # spawn: torch does not survive fork, and it is the only method
+            # on Windows lab machines anyway
+            ctx = multiprocessing.get_context("spawn")
+            pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=ctx,
+                initializer=_init_worker,
+                initargs=(self.model_size, self.threads, self.language),
+            )
+            # Wait until every worker has loaded, so load time is not billed
+            # to the first segments: one task per worker, each blocked on a
+            # shared barrier, can only all finish once every process is up
+            try:
+                with ctx.Manager() as manager:
+                    barrier = manager.Barrier(self.workers)
+                    list(pool.map(_wait, [barrier] * self.workers))
+            except BaseException:
+                pool.shutdown(cancel_futures=True)
+                raise
+            self._pool = pool
+            return time.perf_counter() - t0
+        return 0.0
+
+    def transcribe_pcm(self, pcm: np.ndarray, offset: float = 0.0) -> Transcript:
+        """
+        Transcribe 16 kHz mono int16 PCM; timestamps start at ``offset``.
+        """
+        load = self.load()
+        t0 = time.perf_counter()
+        spans = split_on_silence(pcm, self.max_segment_s)
+        jobs = [(i, offset + a / SAMPLE_RATE, pcm[a:b]) for i, (a, b) in enumerate(spans)]
+
+        if self._pool is None:
+            _init_local(self._model, self.language)
+            results = [_work(job) for job in jobs]
+        else:
+            # Longest first, so one long segment does not finish alone at the end
+            order = sorted(jobs, key=lambda j: -j[2].shape[0])
+            results = list(self._pool.map(_work, order))
+        results.sort(key=lambda r: r[0])
+
+        segments = [s for _, segs, _ in results for s in segs]
+        return Transcript(segments, pcm.shape[0] / SAMPLE_RATE, time.perf_counter() - t0, load)
+
+    def transcribe(self, audio: Union[str, Path, np.ndarray]) -> Transcript:
+        pcm = audio if isinstance(audio, np.ndarray) else read_wav(Path(audio))
+        return self.transcribe_pcm(pcm)
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        self._model = None
+
+    def __enter__(self) -> "WhisperEngine":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def _wait(barrier) -> None:
+    barrier.wait()
+
+
+def _init_local(model, language: Optional[str]) -> None:
+    global _model, _options
+    _model = model
+    _options = {"language": language}
+
+
+def add_whisper_args(parser) -> None:
+    parser.add_argument(
+        "--whisper-model",
+        type=str,
+        default="base",
+        help="Whisper model size (tiny | base | small | medium | large). Default: base.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f"Transcription processes, one model each (default: {DEFAULT_WORKERS}; "
+        "lower it if RAM is short: ~1 GB per worker for base)",
+    )
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Transcribe a WAV file with parallel Whisper workers.")
+    ap.add_argument("wav", help="Input WAV file")
+    add_whisper_args(ap)
+    ap.add_argument("--language", default="en", help="Spoken language (default: en)")
+    ap.add_argument("--max-segment", type=float, default=MAX_SEGMENT_S, help="Longest segment in seconds")
+    ap.add_argument("--out", help="Write the timestamped transcript here (default: stdout)")
+    args = ap.parse_args()
+
+    with WhisperEngine(args.whisper_model, args.workers, args.language, args.max_segment) as engine:
+        result = engine.transcribe(args.wav)
+    if args.out:
+        Path(args.out).write_text(result.timestamped() + "\n", encoding="utf-8")
+        print(f"Saved transcript to: {args.out}")
+    else:
+        print(result.timestamped())
+    print(result.report(), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,461 @@
+#!/usr/bin/env python3
+"""
+Resident Whisper transcription service.
+
+Keeps Whisper models loaded (a WhisperEngine per model size, see
+citl_whisper.py) and transcribes jobs back-to-back from a local HTTP API,
+so recordings after the first pay no model-load time. A model that has not
+been used for --idle-minutes is unloaded to give its RAM back; the next job
+for it loads it again.
+
+  python citl_whisper_server.py --preload base     # http://127.0.0.1:8766
+  python citl_transcribe_lecture.py --server ...
+  python citl_whisper_server.py --ask lecture.wav  # one job, from a shell
+
+Endpoints:
+  GET  /health      - resident models (workers, idle seconds, jobs), queue
+                      length, totals
+  POST /transcribe  - JSON {"path": "lecture.wav", "model": "base",
+                      "language": "en"}, or a raw 16 kHz mono int16 PCM body
+                      (Content-Type: application/octet-stream) with
+                      ?model=base&language=en&offset=0 in the URL
+                      -> {"text", "segments", "timing"}
+
+"timing" keeps the parts of the latency apart: queue_s (waiting for
+earlier jobs), load_s (model load, 0 when resident), decode_s, total_s,
+plus audio_s and rtf (decode_s / audio_s).
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+
+import numpy as np
+
+from citl_whisper import DEFAULT_WORKERS, SAMPLE_RATE, WhisperEngine, fmt_time, read_wav
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8766
+DEFAULT_SERVER = os.environ.get("CITL_WHISPER_SERVER", f"http://{DEFAULT_HOST}:{DEFAULT_PORT}")
+DEFAULT_IDLE_MIN = float(os.environ.get("CITL_WHISPER_IDLE_MIN", "15"))
+
+ModelKey = Tuple[str, Optional[str]]
+
+
+# ---------------------------------------------------------------------
+# Resident models
+# ---------------------------------------------------------------------
+
+class ResidentModels:
+    """
+    WhisperEngines keyed by (model size, language), loaded on first use and
+    unloaded after ``idle_s`` without a job. An engine is only kept once
+    its model has loaded, so a bad model name fails that job alone.
+
+    Only the job thread calls get() and evict_idle(), so an engine is never
+    unloaded under a running job; status() may be called from anywhere.
+    """
+
+    def __init__(self, workers: int = DEFAULT_WORKERS, idle_s: float = DEFAULT_IDLE_MIN * 60):
+        self.workers = workers
+        self.idle_s = idle_s
+        self._lock = threading.Lock()
+        self._engines: Dict[ModelKey, WhisperEngine] = {}
+        self._last_used: Dict[ModelKey, float] = {}
+        self._jobs: Dict[ModelKey, int] = {}
+        self._loaded_at: Dict[ModelKey, float] = {}
+
+    def get(self, model_size: str, language: Optional[str]) -> WhisperEngine:
+        """
+        The resident engine for the key, loading it first if needed.
+        """
+        key = (model_size, language)
+        with self._lock:
+            engine = self._engines.get(key)
+        if engine is None:
+            engine = WhisperEngine(model_size, workers=self.workers, language=language)
+            try:
+                engine.load()
+            except BaseException:
+                engine.close()
+                raise
+            with self._lock:
+                self._engines[key] = engine
+                self._jobs[key] = 0
+                self._loaded_at[key] = time.time()
+        with self._lock:
+            self._last_used[key] = time.monotonic()
+            self._jobs[key] += 1
+        return engine
+
+    def touch(self, model_size: str, language: Optional[str]) -> None:
+        with self._lock:
+            self._last_used[(model_size, language)] = time.monotonic()
+
+    def evict_idle(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            idle = [k for k, t in self._last_used.items() if k in self._engines and now - t >= self.idle_s]
+            engines = [(k, self._engines.pop(k)) for k in idle]
+        for (size, language), engine in engines:
+            engine.close()
+            print(f"[INFO] Unloaded Whisper {size} ({language or 'auto'}) after {self.idle_s / 60:g} min idle", flush=True)
+
+    def close(self) -> None:
+        with self._lock:
+            engines = list(self._engines.values())
+            self._engines.clear()
+        for engine in engines:
+            engine.close()
+
+    def status(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                f"{size}/{language or 'auto'}": {
+                    "workers": engine.workers,
+                    "jobs": self._jobs[(size, language)],
+                    "idle_s": round(now - self._last_used[(size, language)], 1),
+                    "loaded_at": self._loaded_at[(size, language)],
+                }
+                for (size, language), engine in self._engines.items()
+            }
+
+
+# ---------------------------------------------------------------------
+# Job queue
+# ---------------------------------------------------------------------
+
+class Job:
+    def __init__(self, pcm: np.ndarray, model_size: str, language: Optional[str], offset: float = 0.0):
+        self.pcm = pcm
+        self.model_size = model_size
+        self.language = language
+        self.offset = offset
+        self.queued_at = time.perf_counter()
+        self.future: Future = Future()
+
+
+class Transcriber:
+    """
+    One thread that runs jobs in arrival order (a model uses every core it
+    has, so concurrent decodes would only slow each other down) and evicts
+    idle models between jobs.
+    """
+
+    def __init__(self, models: ResidentModels, poll: float = 5.0):
+        self.models = models
+        self.poll = poll
+        self.queue: "queue.Queue[Optional[Job]]" = queue.Queue()
+        self.done = 0
+        self.audio_seconds = 0.0
+        self.busy_seconds = 0.0
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def submit(self, job: Job) -> Future:
+        self.queue.put(job)
+        return job.future
+
+    def preload(self, model_size: str, language: Optional[str]) -> None:
+        """
+        Load a model now (on the job thread), e.g. at start-up.
+        """
+        self.submit(Job(np.zeros(0, dtype=np.int16), model_size, language)).result()
+
+    def _loop(self) -> None:
+        while True:
+            try:
+                job = self.queue.get(timeout=self.poll)
+            except queue.Empty:
+                self.models.evict_idle()
+                continue
+            if job is None:
+                break
+            if not job.future.set_running_or_notify_cancel():
+                continue
+            try:
+                job.future.set_result(self._run(job))
+            except Exception as e:
+                job.future.set_exception(e)
+            self.models.evict_idle()
+
+    def _run(self, job: Job) -> dict:
+        t0 = time.perf_counter()
+        engine = self.models.get(job.model_size, job.language)
+        load = time.perf_counter() - t0
+        # Empty PCM (a preload) only loads the model
+        result = engine.transcribe_pcm(job.pcm, offset=job.offset)
+        self.models.touch(job.model_size, job.language)
+        t1 = time.perf_counter()
+
+        audio = job.pcm.shape[0] / SAMPLE_RATE
+        self.done += 1
+        self.audio_seconds += audio
+        self.busy_seconds += t1 - t0
+        return {
+            "text": result.text,
+            "segments": result.segments,
+            "timing": {
+                "queue_s": round(t0 - job.queued_at, 3),
+                "load_s": round(load + result.load_seconds, 3),
+                "decode_s": round(result.wall_seconds, 3),
+                "total_s": round(t1 - job.queued_at, 3),
+                "audio_s": round(audio, 3),
+                "rtf": round(result.wall_seconds / audio, 3) if audio else 0.0,
+            },
+        }
+
+    def stop(self) -> None:
+        self.queue.put(None)
+        self._thread.join()
+
+
+# ---------------------------------------------------------------------
+# HTTP API
+# ---------------------------------------------------------------------
+
+class WhisperHandler(BaseHTTPRequestHandler):
+    server_version = "CITLWhisper/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+    def _send_json(self, code: int, obj: dict) -> None:
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            t = self.server.transcriber
+            self._send_json(
+                200,
+                {
+                    "status": "ok",
+                    "models": self.server.models.status(),
+                    "queued": t.queue.qsize(),
+                    "jobs_done": t.done,
+                    "audio_s": round(t.audio_seconds, 1),
+                    "busy_s": round(t.busy_seconds, 1),
+                },
+            )
+        else:
+            self._send_json(404, {"error": f"unknown path {self.path}"})
+
+    def _parse_job(self) -> Job:
+        url = urllib.parse.urlsplit(self.path)
+        params = {k: v[-1] for k, v in urllib.parse.parse_qs(url.query).items()}
+        n = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(n) if n else b""
+        ctype = (self.headers.get("Content-Type") or "").split(";")[0].strip()
+
+        if ctype == "application/octet-stream":
+            if len(raw) % 2:
+                raise ValueError("PCM body must be 16-bit samples")
+            pcm = np.frombuffer(raw, dtype="<i2").astype(np.int16)
+        else:
+            data = json.loads(raw.decode("utf-8") or "{}")
+            if not isinstance(data, dict):
+                raise ValueError("request body must be a JSON object")
+            params.update(data)
+            if "path" not in params:
+                raise KeyError("'path' (a WAV file) or a PCM body is required")
+            # Paths are read by this process: local clients only (see --host)
+            pcm = read_wav(Path(params["path"]))
+
+        language = params.get("language", self.server.language)
+        return Job(
+            pcm,
+            str(params.get("model") or self.server.model_size),
+            None if language in (None, "", "auto") else str(language),
+            float(params.get("offset") or 0.0),
+        )
+
+    def do_POST(self):
+        if urllib.parse.urlsplit(self.path).path != "/transcribe":
+            self._send_json(404, {"error": f"unknown path {self.path}"})
+            return
+        try:
+            job = self._parse_job()
+        except (KeyError, ValueError, UnicodeDecodeError) as e:
+            self._send_json(400, {"error": f"bad request: {e}"})
+            return
+        except (OSError, RuntimeError) as e:
+            self._send_json(400, {"error": f"cannot read audio: {e}"})
+            return
+
+        try:
+            result = self.server.transcriber.submit(job).result()
+        except Exception as e:
+            self._send_json(500, {"error": f"{type(e).__name__}: {e}"})
+            return
+        timing = result["timing"]
+        print(
+            f"[INFO] {job.model_size}: {timing['audio_s']:.0f}s audio | queue {timing['queue_s']:.2f}s | "
+            f"load {timing['load_s']:.2f}s | decode {timing['decode_s']:.2f}s (RTF {timing['rtf']:.2f})",
+            flush=True,
+        )
+        self._send_json(200, result)
+
+
+class WhisperServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        addr,
+        transcriber: Transcriber,
+        model_size: str = "base",
+        language: Optional[str] = "en",
+        verbose: bool = False,
+    ):
+        super().__init__(addr, WhisperHandler)
+        self.transcriber = transcriber
+        self.models = transcriber.models
+        self.model_size = model_size
+        self.language = language
+        self.verbose = verbose
+
+
+# ---------------------------------------------------------------------
+# Client
+# ---------------------------------------------------------------------
+
+def ask_whisper_server(
+    server: str,
+    audio: Union[str, Path, np.ndarray],
+    model_size: str = "base",
+    language: Optional[str] = "en",
+    timeout: float = 3600.0,
+) -> Optional[dict]:
+    """
+    Transcribe a WAV path (read by the server) or int16 PCM array (sent in
+    the body) on a running server.
+
+    Returns None when the server cannot be reached so callers can fall back
+    to transcribing in-process; server-side errors are raised as RuntimeError.
+    """
+    base = server.rstrip("/") + "/transcribe"
+    if isinstance(audio, np.ndarray):
+        query = urllib.parse.urlencode({"model": model_size, "language": language or "auto"})
+        req = urllib.request.Request(
+            f"{base}?{query}",
+            data=np.asarray(audio, dtype="<i2").tobytes(),
+            headers={"Content-Type": "application/octet-stream"},
+            method="POST",
+        )
+    else:
+        payload = {"path": str(Path(audio).resolve()), "model": model_size, "language": language or "auto"}
+        req = urllib.request.Request(
+            base,
+            data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+    try:
+        resp = urllib.request.urlopen(req, timeout=timeout)
+    except urllib.error.HTTPError as e:
+        detail = e.read().decode("utf-8", errors="replace")
+        raise RuntimeError(f"Whisper server error {e.code}: {detail}") from e
+    except (urllib.error.URLError, ConnectionError, TimeoutError):
+        return None
+    with resp:
+        return json.loads(resp.read().decode("utf-8"))
+
+
+def format_timing(timing: dict) -> str:
+    return (
+        f"[INFO] Transcribed {timing['audio_s'] / 60:.1f} min of audio: queue {timing['queue_s']:.2f}s, "
+        f"model load {timing['load_s']:.2f}s, decode {timing['decode_s']:.2f}s "
+        f"(RTF {timing['rtf']:.2f}), total {timing['total_s']:.2f}s"
+    )
+
+
+# ---------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Resident Whisper transcription server (keeps models loaded).")
+    ap.add_argument("--host", default=DEFAULT_HOST, help=f"Bind address (default: {DEFAULT_HOST})")
+    ap.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port (default: {DEFAULT_PORT})")
+    ap.add_argument("--whisper-model", default="base", help="Model for jobs that do not name one (default: base)")
+    ap.add_argument("--language", default="en", help="Language for jobs that do not name one (default: en)")
+    ap.add_argument(
+        "--preload",
+        nargs="*",
+        default=None,
+        metavar="SIZE",
+        help="Load these model sizes at start-up (no sizes: the default model)",
+    )
+    ap.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f"Decoding processes per resident model (default: {DEFAULT_WORKERS})",
+    )
+    ap.add_argument(
+        "--idle-minutes",
+        type=float,
+        default=DEFAULT_IDLE_MIN,
+        help=f"Unload a model after this long without jobs (default: {DEFAULT_IDLE_MIN:g}; "
+        "env CITL_WHISPER_IDLE_MIN)",
+    )
+    ap.add_argument(
+        "--ask",
+        metavar="WAV",
+        help=f"Do not serve: send WAV to the running server ({DEFAULT_SERVER}) and print the transcript",
+    )
+    ap.add_argument("-v", "--verbose", action="store_true", help="Log every request")
+    args = ap.parse_args()
+    language = None if args.language == "auto" else args.language
+
+    if args.ask:
+        result = ask_whisper_server(DEFAULT_SERVER, args.ask, args.whisper_model, language)
+        if result is None:
+            print(f"[ERROR] Whisper server not reachable at {DEFAULT_SERVER}. Start citl_whisper_server.py first.")
+            sys.exit(1)
+        for seg in result["segments"]:
+            print(f"[{fmt_time(seg['start'])}] {seg['text']}")
+        print(format_timing(result["timing"]), file=sys.stderr)
+        return
+
+    models = ResidentModels(workers=args.workers, idle_s=args.idle_minutes * 60)
+    transcriber = Transcriber(models)
+    preload = args.preload or ([args.whisper_model] if args.preload is not None else [])
+    for size in preload:
+        t0 = time.perf_counter()
+        transcriber.preload(size, language)
+        print(f"[INFO] Loaded Whisper {size} x{args.workers} in {time.perf_counter() - t0:.1f}s", flush=True)
+
+    server = WhisperServer((args.host, args.port), transcriber, args.whisper_model, language, args.verbose)
+    print(f"[INFO] CITL Whisper server listening on http://{args.host}:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n[INFO] Shutting down.")
+    finally:
+        server.server_close()
+        transcriber.stop()
+        models.close()
+
+
+if __name__ == "__main__":
+    main()
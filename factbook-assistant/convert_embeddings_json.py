@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Convert legacy *_embeddings.json corpora to the binary index layout.
+
+  python convert_embeddings_json.py law_embeddings.json nursing_embeddings.json
+  python convert_embeddings_json.py --dtype float16 *_embeddings.json
+  python convert_embeddings_json.py --dtype int8 *_embeddings.json
+
+Writes index/<name>.emb.npy, index/<name>.chunks.jsonl,
+index/<name>.offsets.npy and index/<name>.manifest.json (see citl_corpus.py).
+The JSON files are left alone.
+"""
+
+import argparse
+from pathlib import Path
+
+from citl_corpus import INDEX_DIR, add_storage_args, convert_json, legacy_name
+from citl_embed import EMBED_MODEL
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Convert *_embeddings.json files to memory-mapped .npy corpora."
+    )
+    parser.add_argument("json_files", nargs="+", help="Legacy *_embeddings.json files")
+    parser.add_argument(
+        "--index-dir",
+        default=str(INDEX_DIR),
+        help=f"Output index directory (default: {INDEX_DIR})",
+    )
+    add_storage_args(parser)
+    parser.add_argument(
+        "--model",
+        default=EMBED_MODEL,
+        help=f"Embed model the JSON files were built with, recorded in the manifest (default: {EMBED_MODEL})",
+    )
+    args = parser.parse_args()
+
+    for f in args.json_files:
+        path = Path(f)
+        if not path.exists():
+            print(f"[ERROR] Not found: {path}")
+            continue
+        name = legacy_name(path)
+        emb_path, ch_path, _ = convert_json(path, Path(args.index_dir), name, args.dtype, not args.no_full, args.model)
+        print(f"[INFO] {path.name} -> {emb_path.name}, {ch_path.name}")
+
+
+if __name__ == "__main__":
+    main()
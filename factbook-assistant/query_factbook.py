@@ -10,51 +10,60 @@ Supports:
 Requires that build_factbook_index.py has already been run.
 """
 
+import time
+
+# Taken before the imports below so --profile can report what they cost
+_T_IMPORT = time.perf_counter()
+
 import os
 import re
 import sys
-import json
 import argparse
 import pathlib
-from typing import List, Tuple
+from typing import Callable, List, Optional, Sequence, Tuple
 
 import numpy as np
-import requests
-# Always anchor paths to this file's folder, not the shell CWD
-ROOT = Path(__file__).resolve().parent
 
-DATA = ROOT / "factbook_embeddings.json"
-FACTBOOK = ROOT / "factbook.txt"
+import citl_batch
+import citl_ollama
+import citl_trace
+from citl_cache import QueryCache
+from citl_corpus import Corpus
+from citl_embed import EMBED_MODEL
+from citl_factbook_fields import FieldIndex
+from citl_ollama import TokenCallback, TokenPrinter
+from citl_rag_client import DEFAULT_SERVER, ask_server
+from citl_registry import CorpusRegistry, ModelMismatchError
+
+_IMPORTED = time.perf_counter()
 
-LLM = "mistral:7b-instruct"
-GEN_URL = "http://localhost:11434/api/generate"
-EMB_URL = "http://localhost:11434/api/embed"
-EMBED_MODEL = "nomic-embed-text"
 # ---------------------------------------------------------------------
 # Configuration
 # ---------------------------------------------------------------------
 
-OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "http://127.0.0.1:11434")
-GEN_URL = f"{OLLAMA_HOST}/api/generate"
-EMB_URL = f"{OLLAMA_HOST}/api/embeddings"
-
 LLM_MODEL = os.environ.get("FACTBOOK_MODEL", "mistral:7b-instruct")
-EMB_MODEL = os.environ.get("FACTBOOK_EMBED", "nomic-embed-text")
 
 ROOT = pathlib.Path(__file__).resolve().parent
 INDEX_DIR = ROOT / "index"
 EMB_PATH = INDEX_DIR / "factbook.emb.npy"
 CH_PATH = INDEX_DIR / "factbook.chunks.jsonl"
 TXT_PATH = ROOT / "factbook.txt"
+FIELDS_PATH = INDEX_DIR / "factbook.fields.json"
+
+REGISTRY = CorpusRegistry(INDEX_DIR, EMBED_MODEL)
+
+_field_index: Optional[FieldIndex] = None
+_field_sig: Optional[tuple] = None
 
 
 # ---------------------------------------------------------------------
 # Data loading
 # ---------------------------------------------------------------------
 
-def load_index() -> Tuple[np.ndarray, List[dict]]:
+def load_index() -> Corpus:
     """
-    Load the precomputed embeddings and chunk metadata.
+    Memory-map the precomputed embeddings and open the lazy chunk store.
+    Only the chunks that end up as hits are ever read from disk.
     """
     if not EMB_PATH.exists() or not CH_PATH.exists():
         raise SystemExit(
@@ -64,101 +73,48 @@ def load_index() -> Tuple[np.ndarray, List[dict]]:
             f"  {CH_PATH}\n"
         )
 
-    emb = np.load(EMB_PATH)
-
-    chunks: List[dict] = []
-    with CH_PATH.open("r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                chunks.append(json.loads(line))
-            except json.JSONDecodeError:
-                continue
-
-    return emb, chunks
+    try:
+        return REGISTRY.get("factbook")
+    except ModelMismatchError as e:
+        raise SystemExit(f"ERROR: {e}")
 
 
 # ---------------------------------------------------------------------
 # Embedding helper for queries
 # ---------------------------------------------------------------------
 
-def embed_query(text: str) -> np.ndarray:
+def embed_query(text: str, cache: Optional[QueryCache] = None) -> np.ndarray:
     """
-    Call Ollama /api/embeddings for the query text and return a normalized vector.
+    Call Ollama /api/embed for the query text and return a normalized vector.
+    With a cache, a repeated question never reaches Ollama.
     """
-    payload = {
-        "model": EMB_MODEL,
-        "input": text,
-    }
-    r = requests.post(EMB_URL, json=payload, timeout=120)
-    r.raise_for_status()
-    data = r.json()
-
-    vec = None
-
-    if isinstance(data, dict):
-        if "embedding" in data:
-            vec = data["embedding"]
-        elif "embeddings" in data:
-            first = data["embeddings"][0]
-            if isinstance(first, dict) and "embedding" in first:
-                vec = first["embedding"]
-            else:
-                vec = first
-    elif isinstance(data, list) and data:
-        first = data[0]
-        if isinstance(first, dict):
-            if "embedding" in first:
-                vec = first["embedding"]
-            elif "embeddings" in first:
-                inner = first["embeddings"][0]
-                if isinstance(inner, dict) and "embedding" in inner:
-                    vec = inner["embedding"]
-                else:
-                    vec = inner
-        else:
-            vec = first
-
-    if vec is None:
-        raise RuntimeError(f"Could not find embedding in Ollama response: {data}")
-
-    v = np.asarray(vec, dtype=np.float32)
-    v /= (np.linalg.norm(v) + 1e-8)
+    if cache is not None:
+        hit = cache.get_embedding(text, EMBED_MODEL)
+        if hit is not None:
+            return hit
+
+    v = citl_ollama.embed([text], EMBED_MODEL, timeout=120)[0]
+    if cache is not None:
+        cache.put_embedding(text, EMBED_MODEL, v)
     return v
 
 
-# ---------------------------------------------------------------------
-# Retrieval
-# ---------------------------------------------------------------------
-
-def top_k(emb: np.ndarray, chunks: List[dict], qvec: np.ndarray, k: int) -> List[str]:
-    """
-    Return the top-k chunk texts most similar to qvec (cosine via dot-product).
-    """
-    if emb.ndim != 2:
-        raise ValueError(f"Expected 2D embeddings array, got shape {emb.shape}")
-
-    if emb.shape[0] == 0:
-        return []
-
-    sims = emb @ qvec  # (N,)
-
-    k = max(1, min(k, sims.shape[0]))
-    idx = np.argpartition(-sims, k - 1)[:k]
-    idx = idx[np.argsort(-sims[idx])]
-
-    return [chunks[int(i)]["text"] for i in idx]
-
-
 # ---------------------------------------------------------------------
 # LLM call with context
 # ---------------------------------------------------------------------
 
-def gen_with_context(question: str, ctx: str) -> str:
+def gen_with_context(
+    question: str,
+    ctx: str,
+    on_token: Optional[TokenCallback] = None,
+    cache: Optional[QueryCache] = None,
+) -> str:
     """
     Ask the LLM to answer using ONLY the provided Factbook context.
+
+    With ``on_token`` the answer is streamed token by token; otherwise a
+    single blocking request is made. A cached answer for the same question
+    and context is returned (and "streamed" in one piece) without the LLM.
     """
     system_prompt = (
         "You are CITL Assistant, a college learning and accessibility coach.\n"
@@ -170,18 +126,27 @@ def gen_with_context(question: str, ctx: str) -> str:
         "short paragraphs or bullet points.\n"
     )
 
+    options = {"temperature": 0.2}
     payload = {
         "model": LLM_MODEL,
         "system": system_prompt,
         "prompt": f"Context:\n{ctx}\n\nQuestion: {question}\nAnswer:",
-        "stream": False,
-        "options": {"temperature": 0.2},
+        "options": options,
     }
 
-    r = requests.post(GEN_URL, json=payload, timeout=600)
-    r.raise_for_status()
-    data = r.json()
-    return str(data.get("response", "")).strip()
+    cache_opts = {"system": system_prompt, **options}
+    if cache is not None:
+        hit = cache.get_answer(question, ctx, LLM_MODEL, cache_opts)
+        if hit is not None:
+            citl_trace.note(cached=True)
+            if on_token is not None:
+                on_token(hit)
+            return hit
+
+    answer = citl_ollama.generate(payload, on_token=on_token, timeout=600).text
+    if cache is not None and answer:
+        cache.put_answer(question, ctx, LLM_MODEL, cache_opts, answer)
+    return answer
 
 
 # ---------------------------------------------------------------------
@@ -216,9 +181,10 @@ def regex_search(pat: str, maxhits: int = 8) -> List[str]:
 # Shortcut parsing (capital:laos etc.)
 # ---------------------------------------------------------------------
 
-# Fixing the `shortcut` function definition
-def shortcut(q: str):
+def parse_shortcut(q: str) -> Optional[Tuple[str, str]]:
     """
+    Split a shortcut query into (canonical field, country), or None.
+
     Supported forms (case-insensitive), examples:
 
       capital:laos
@@ -247,7 +213,6 @@ def shortcut(q: str):
 
     raw_field = m.group(1).lower()
     country = m.group(2).strip()
-    country_esc = re.escape(country)
 
     # Normalize synonyms to canonical field keys
     if raw_field in ("neighbor", "neighbors", "neighbour", "neighbours"):
@@ -259,6 +224,54 @@ def shortcut(q: str):
     else:
         field = raw_field
 
+    return field, country
+
+
+def get_field_index() -> Optional[FieldIndex]:
+    """
+    The country/field index (index/factbook.fields.json), kept in memory
+    and reloaded only when factbook.txt changes. None if factbook.txt is
+    missing.
+    """
+    global _field_index, _field_sig
+    if not TXT_PATH.exists():
+        return None
+    st = TXT_PATH.stat()
+    sig = (st.st_size, st.st_mtime_ns)
+    if _field_index is None or sig != _field_sig:
+        _field_index = FieldIndex.load(FIELDS_PATH, TXT_PATH)
+        _field_sig = sig
+    return _field_index
+
+
+def shortcut_lookup(q: str, maxhits: int = 8) -> List[str]:
+    """
+    Answer a shortcut from the precomputed field index: a dictionary hit
+    on (country, field) and one seek into factbook.txt. Empty if the query
+    is not a shortcut or the country/field is not in the index.
+    """
+    parsed = parse_shortcut(q)
+    if parsed is None:
+        return []
+    idx = get_field_index()
+    if idx is None:
+        return []
+    field, country = parsed
+    return idx.lookup(field, country)[:maxhits]
+
+
+def shortcut(q: str):
+    """
+    Regex fallback for shortcut queries (see parse_shortcut for the forms).
+    Used when the field index has no entry for the query.
+    """
+    parsed = parse_shortcut(q)
+    if parsed is None:
+        return None
+
+    field, country = parsed
+    country_esc = re.escape(country)
+
     # Regex patterns are tuned to CIA Factbook style headings/labels.
     # They work within a single country's block that starts at ^CountryName.
     pats = {
@@ -298,6 +311,109 @@ def shortcut(q: str):
 
     return pats[field]
 
+# ---------------------------------------------------------------------
+# Query pipeline
+# ---------------------------------------------------------------------
+
+def shortcut_context(query: str, topk: int, maxctx: int, use_regex: bool = False) -> Optional[str]:
+    """
+    Context for the non-semantic paths: raw regex (always answers, even
+    with no hits) or a shortcut (capital:laos etc.; field index first,
+    regex fallback). None means the query needs semantic retrieval.
+    """
+    # 1) Raw regex mode
+    if use_regex:
+        return "\n---\n".join(regex_search(query, topk))[:maxctx]
+
+    # 2) Shortcut mode
+    snippets = shortcut_lookup(query, topk)
+    if snippets:
+        return "\n---\n".join(snippets)[:maxctx]
+
+    sc_pat = shortcut(query)
+    if sc_pat:
+        snippets = regex_search(sc_pat, topk)
+        if snippets:
+            return "\n---\n".join(snippets)[:maxctx]
+    return None
+
+
+def answer_query(
+    query: str,
+    topk: int,
+    maxctx: int,
+    use_regex: bool = False,
+    index_loader: Callable[[], Corpus] = load_index,
+    on_token: Optional[TokenCallback] = None,
+    cache: Optional[QueryCache] = None,
+) -> str:
+    """
+    Answer one query: raw regex, shortcut (capital:laos etc.) or semantic RAG.
+    ``index_loader`` lets the resident server supply an index already in
+    memory; ``on_token`` streams the answer as it is generated.
+    """
+    with citl_trace.trace("factbook", query):
+        with citl_trace.stage("shortcut"):
+            ctx = shortcut_context(query, topk, maxctx, use_regex)
+        if ctx is not None:
+            citl_trace.note(path="regex" if use_regex else "shortcut")
+        else:
+            # 3) Semantic RAG over embeddings, fused with BM25 when indexed
+            citl_trace.note(path="semantic")
+            with citl_trace.stage("load_index"):
+                corpus = index_loader()
+            with citl_trace.stage("embed"):
+                qvec = embed_query(query, cache)
+            with citl_trace.stage("retrieve"):
+                ids, _ = corpus.search(qvec, max(1, topk), text=query)
+                ctx = "\n---\n".join(corpus.chunks.texts(ids))[:maxctx]
+        with citl_trace.stage("generate"):
+            return gen_with_context(query, ctx, on_token, cache)
+
+
+def answer_batch(
+    records: Sequence[dict],
+    topk: int,
+    maxctx: int,
+    out,
+    use_regex: bool = False,
+    index_loader: Callable[[], Corpus] = load_index,
+    cache: Optional[QueryCache] = None,
+    workers: int = citl_batch.DEFAULT_GEN_WORKERS,
+) -> int:
+    """
+    --batch mode: shortcuts are resolved directly, the remaining questions
+    are embedded together and scored with one Q @ E.T per block, then all
+    answers are generated through a bounded pool and written to ``out``
+    in order. Returns the number of failures.
+    """
+    queries = [str(r["question"]) for r in records]
+    # Retrieval is shared by the whole batch, so it is traced once; each
+    # answer then gets its own trace (see citl_batch.write_answers)
+    with citl_trace.trace("factbook_batch", f"{len(records)} questions"):
+        with citl_trace.stage("shortcut"):
+            contexts: List[Optional[str]] = [shortcut_context(q, topk, maxctx, use_regex) for q in queries]
+
+        semantic = [i for i, c in enumerate(contexts) if c is None]
+        if semantic:
+            with citl_trace.stage("load_index"):
+                corpus = index_loader()
+            with citl_trace.stage("embed"):
+                qmat = citl_batch.embed_questions(
+                    [queries[i] for i in semantic], EMBED_MODEL, cache
+                )
+            with citl_trace.stage("retrieve"):
+                rows = corpus.search_batch(qmat, max(1, topk), texts=[queries[i] for i in semantic])
+                for i, row in zip(semantic, rows):
+                    contexts[i] = "\n---\n".join(corpus.chunks.texts(row))[:maxctx]
+
+    def answer(job: dict) -> str:
+        return gen_with_context(job["record"]["question"], job["context"], cache=cache)
+
+    jobs = [{"record": r, "context": c} for r, c in zip(records, contexts)]
+    return citl_batch.write_answers(jobs, answer, out, workers, tool="factbook")
+
+
 # ---------------------------------------------------------------------
 # CLI
 # ---------------------------------------------------------------------
@@ -308,7 +424,8 @@ def main() -> None:
     )
     ap.add_argument(
         "query",
-        help="Question or shortcut like 'capital:laos'",
+        nargs="?",
+        help="Question or shortcut like 'capital:laos' (omit with --batch)",
     )
     ap.add_argument(
         "--regex",
@@ -328,30 +445,113 @@ def main() -> None:
         default=2400,
         help="Max characters of context to send to the LLM (default: 2400)",
     )
+    ap.add_argument(
+        "--no-stream",
+        action="store_true",
+        help="Wait for the whole answer instead of printing tokens as they arrive",
+    )
+    ap.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Bypass the query/answer cache (index/query_cache.sqlite)",
+    )
+    ap.add_argument(
+        "--cache-stats",
+        action="store_true",
+        help="Print query cache hit/miss counters after answering",
+    )
+    ap.add_argument(
+        "--server",
+        action="store_true",
+        help=f"Ask a running citl_rag_server.py ({DEFAULT_SERVER}, set CITL_RAG_SERVER "
+        "to change) instead of loading the index in this process",
+    )
+    citl_batch.add_batch_args(ap)
+    citl_trace.add_profile_args(ap)
     args = ap.parse_args()
-
-    # 1) Raw regex mode
-    if args.regex:
-        snippets = regex_search(args.query, args.topk)
-        ctx = "\n---\n".join(snippets)[: args.maxctx]
-        print(gen_with_context(args.query, ctx))
+    if not args.batch and not args.query:
+        ap.error("a query is required unless --batch is given")
+    if args.batch and args.server:
+        ap.error("--batch answers locally; it cannot be combined with --server")
+
+    tracer = citl_trace.enable_from_args(args, import_seconds=_IMPORTED - _T_IMPORT)
+    try:
+        run(args)
+    finally:
+        citl_trace.print_summary(tracer)
+
+
+def run(args) -> None:
+    if args.batch:
+        records = citl_batch.read_questions(args.batch)
+        cache = None if args.no_cache else QueryCache()
+        out = citl_batch.open_output(args.out)
+        t0 = time.perf_counter()
+        try:
+            errors = answer_batch(
+                records,
+                args.topk,
+                args.maxctx,
+                out,
+                use_regex=args.regex,
+                cache=cache,
+                workers=args.gen_workers,
+            )
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        print(citl_batch.report(len(records), time.perf_counter() - t0, errors), file=sys.stderr)
+        if cache is not None and args.cache_stats:
+            print(cache.report(), file=sys.stderr)
         return
 
-    # 2) Shortcut mode (capital:laos etc.)
-    sc_pat = shortcut(args.query)
-    if sc_pat:
-        snippets = regex_search(sc_pat, args.topk)
-        if snippets:
-            ctx = "\n---\n".join(snippets)[: args.maxctx]
-            print(gen_with_context(args.query, ctx))
+    printer = None if args.no_stream else TokenPrinter()
+
+    if args.server:
+        with citl_trace.trace("factbook", args.query):
+            citl_trace.note(path="server")
+            with citl_trace.stage("server"):
+                try:
+                    answer = ask_server(
+                        DEFAULT_SERVER,
+                        "/factbook",
+                        {
+                            "query": args.query,
+                            "regex": args.regex,
+                            "topk": args.topk,
+                            "maxctx": args.maxctx,
+                        },
+                        on_token=printer,
+                    )
+                except RuntimeError as e:
+                    # The server answered with an error (bad source, failed query)
+                    if printer is not None and printer.ttft is not None:
+                        printer.finish()  # end the partial answer's line
+                    print(f"[ERROR] {e}")
+                    sys.exit(1)
+        if answer is not None:
+            if printer is not None:
+                printer.finish(report=True)
+            else:
+                print(answer)
             return
-
-    # 3) Semantic RAG over embeddings
-    emb, chunks = load_index()
-    qvec = embed_query(args.query)
-    ctx_chunks = top_k(emb, chunks, qvec, args.topk)
-    ctx = "\n---\n".join(ctx_chunks)[: args.maxctx]
-    print(gen_with_context(args.query, ctx))
+        print(f"[WARN] RAG server at {DEFAULT_SERVER} unreachable; answering locally.")
+
+    cache = None if args.no_cache else QueryCache()
+    answer = answer_query(
+        args.query,
+        args.topk,
+        args.maxctx,
+        use_regex=args.regex,
+        on_token=printer,
+        cache=cache,
+    )
+    if printer is not None:
+        printer.finish(report=True)
+    else:
+        print(answer)
+    if cache is not None and args.cache_stats:
+        print(cache.report(), file=sys.stderr)
 
 
 if __name__ == "__main__":
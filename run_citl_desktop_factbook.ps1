@@ -63,30 +63,39 @@ if (-not $ollamaVersion) {
     ollama pull nomic-embed-text
 }
 
-# 7. Build embeddings if missing
-if (-not (Test-Path ".\factbook_embeddings.json")) {
+# 7. Build embeddings if missing (binary index layout under .\index)
+if (-not (Test-Path ".\index\factbook.emb.npy")) {
     Write-Host "Building Factbook embedding index..."
     python .\build_factbook_index.py
 } else {
-    Write-Host "factbook_embeddings.json already exists, skipping."
+    Write-Host "index\factbook.emb.npy already exists, skipping."
+}
+
+# Convert any legacy *_embeddings.json corpora instead of re-embedding them
+foreach ($name in @("law", "nursing", "dictionary")) {
+    if ((Test-Path ".\$($name)_embeddings.json") -and
+        (-not (Test-Path ".\index\$name.emb.npy"))) {
+        Write-Host "Converting $($name)_embeddings.json to index\$name.emb.npy..."
+        python .\convert_embeddings_json.py ".\$($name)_embeddings.json"
+    }
 }
 
 if ((Test-Path ".\Introduction to the Law of Property, Estate Planning, and Insurance.txt") -and
-    (-not (Test-Path ".\law_embeddings.json"))) {
-    Write-Host "Building law_embeddings.json..."
-    python .\build_corpus_index.py --src "Introduction to the Law of Property, Estate Planning, and Insurance.txt" --out "law_embeddings.json"
+    (-not (Test-Path ".\index\law.emb.npy"))) {
+    Write-Host "Building index\law.emb.npy..."
+    python .\build_corpus_index.py --src "Introduction to the Law of Property, Estate Planning, and Insurance.txt" --name law
 }
 
 if ((Test-Path ".\Nursing Fundamentals 2e.txt") -and
-    (-not (Test-Path ".\nursing_embeddings.json"))) {
-    Write-Host "Building nursing_embeddings.json..."
-    python .\build_corpus_index.py --src "Nursing Fundamentals 2e.txt" --out "nursing_embeddings.json"
+    (-not (Test-Path ".\index\nursing.emb.npy"))) {
+    Write-Host "Building index\nursing.emb.npy..."
+    python .\build_corpus_index.py --src "Nursing Fundamentals 2e.txt" --name nursing
 }
 
 if ((Test-Path ".\The New Oxford American Dictionary.txt") -and
-    (-not (Test-Path ".\dictionary_embeddings.json"))) {
-    Write-Host "Building dictionary_embeddings.json..."
-    python .\build_corpus_index.py --src "The New Oxford American Dictionary.txt" --out "dictionary_embeddings.json"
+    (-not (Test-Path ".\index\dictionary.emb.npy"))) {
+    Write-Host "Building index\dictionary.emb.npy..."
+    python .\build_corpus_index.py --src "The New Oxford American Dictionary.txt" --name dictionary
 }
 
 Write-Host ""